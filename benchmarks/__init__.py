@@ -0,0 +1,3 @@
+""" Benchmarks of the scrappers. Run them from the project's folder, e.g. python -m benchmarks.bench_extraction
+
+"""
@@ -0,0 +1,113 @@
+""" Compares the BeautifulSoup and the lxml/XPath extractors of product_page_extractor.
+
+First, it checks both extractors give exactly the same 10 information on every page. Then, it measures the time
+each one needs per page, and the time BOOK_SCHEMA alone needs on an already parsed page: compiled once, as the lxml
+extractor applies it, and with its XPath expressions evaluated again on each page. The difference between the last two
+is small next to the parsing, and depends on the machine: the measures are interleaved and repeated to be comparable.
+
+Usage: python -m benchmarks.bench_extraction [number of pages]
+
+"""
+
+import sys
+import time
+
+from lxml import etree
+
+from benchmarks.catalogue_pages import making_book, rendering_product_page
+from product_page_extractor import (extracting_book_information_fast, extracting_book_information_with_soup,
+                                    extracting_with_schema, SchemaSection, BOOK_SCHEMA, UNABLE_TO_SCRAP)
+
+
+def timing_extractor(extractor, pages, repeat=3):
+    """
+
+    Args:
+        extractor: one of the extracting_book_information_* functions.
+        pages: a list of (link, title, HTML source code) tuples.
+        repeat: the number of measures. We keep the best one.
+
+    Returns: the best time in seconds the extractor took to extract all the pages.
+
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for link, title, page_source in pages:
+            extractor(link, title, page_source)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def extracting_with_uncompiled_schema(node, book_dict, schema=BOOK_SCHEMA):
+    """ Same as product_page_extractor.extracting_with_schema, the XPath expressions being evaluated from their text
+    on every page, like the lookups were before the schema.
+    """
+    for item in schema:
+        if isinstance(item, SchemaSection):
+            sections = node.xpath(item.selector) if node is not None else []
+            extracting_with_uncompiled_schema(sections[0] if sections else None, book_dict, item.fields)
+            continue
+        try:
+            book_dict[item.name] = item.reading(node.xpath(item.selector, smart_strings=False)[0])
+        except (IndexError, ValueError, AttributeError, TypeError, UnicodeError):
+            book_dict[item.name] = UNABLE_TO_SCRAP
+    return book_dict
+
+
+def timing_schemas(appliers, trees, repeat=30):
+    """ The measures of the appliers are interleaved: a slower moment of the machine costs them all the same.
+
+    Args:
+        appliers: functions like extracting_with_schema and extracting_with_uncompiled_schema.
+        trees: a list of parsed pages.
+        repeat: the number of measures of each applier. We keep the best one.
+
+    Returns: the list of the best times in seconds each applier took on all the pages.
+
+    """
+    best = [None] * len(appliers)
+    for _ in range(repeat):
+        for position, applying in enumerate(appliers):
+            start = time.perf_counter()
+            for book_page in trees:
+                applying(book_page, {})
+            elapsed = time.perf_counter() - start
+            if best[position] is None or elapsed < best[position]:
+                best[position] = elapsed
+    return best
+
+
+def main(number_of_pages=200):
+    pages = []
+    for number in range(number_of_pages):
+        book = making_book(number)
+        pages.append(("http://books.toscrape.com/catalogue/" + book["slug"] + "/index.html",
+                      book["title"], rendering_product_page(book)))
+
+    for link, title, page_source in pages:
+        expected = extracting_book_information_with_soup(link, title, page_source)
+        if extracting_book_information_fast(link, title, page_source) != expected:
+            raise SystemExit("The extractors disagree on " + link)
+
+    soup_time = timing_extractor(extracting_book_information_with_soup, pages)
+    fast_time = timing_extractor(extracting_book_information_fast, pages)
+    print("pages: {}".format(number_of_pages))
+    print("BeautifulSoup: {:.3f} ms per page".format(soup_time / number_of_pages * 1000))
+    print("lxml/XPath:    {:.3f} ms per page".format(fast_time / number_of_pages * 1000))
+    print("speedup:       {:.1f}x".format(soup_time / fast_time))
+
+    trees = [etree.fromstring(page_source, etree.HTMLParser()) for _, _, page_source in pages]
+    if any(extracting_with_schema(tree, {}) != extracting_with_uncompiled_schema(tree, {}) for tree in trees):
+        raise SystemExit("The compiled and uncompiled schemas disagree")
+    compiled_time, uncompiled_time = timing_schemas((extracting_with_schema, extracting_with_uncompiled_schema), trees)
+    print("schema only, without the parsing:")
+    print("    compiled once:     {:.3f} ms per page".format(compiled_time / number_of_pages * 1000))
+    print("    compiled per page: {:.3f} ms per page ({:.2f}x)".format(uncompiled_time / number_of_pages * 1000,
+                                                                     uncompiled_time / compiled_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
@@ -0,0 +1,82 @@
+""" Checks the memory of the pipeline stays flat when the catalogue grows.
+
+The pipeline stage of run_benchmarks runs against synthetic catalogues of growing sizes, each in its own process.
+Their peak RSS are compared with the smallest catalogue's: beyond the tolerance, the memory grows with the catalogue
+and the script exits with an error.
+
+The memory isn't flat from the first book: the cache of the parsed listing pages (see request_cache.py) grows until
+it holds DEFAULT_MAXSIZE pages, a few tens of megabytes. Only the catalogues big enough to fill it (MIN_BOOKS) are
+compared: a smaller one would measure the cache filling up, not the pipeline growing. With --max-rss, the cache is
+emptied whenever the ceiling is reached.
+
+Usage: python -m benchmarks.bench_memory [--books 2000 20000 200000] [--tolerance 1.25] [--max-rss 200]
+
+"""
+
+import argparse
+import sys
+
+from benchmarks.catalogue_pages import SyntheticCatalogue, BOOKS_PER_PAGE
+from benchmarks.fixture_server import starting_fixture_server
+from benchmarks.run_benchmarks import measuring_stage, printing_report, DEFAULT_CONCURRENCY
+from request_cache import DEFAULT_MAXSIZE
+
+DEFAULT_SIZES = (2000, 20000)
+# The largest peak RSS may be this many times the smallest one.
+DEFAULT_TOLERANCE = 1.25
+# The smallest catalogue whose listing pages fill the cache of the parsed pages, with some margin.
+MIN_BOOKS = 2 * DEFAULT_MAXSIZE * BOOKS_PER_PAGE
+
+
+def measuring_sizes(arguments):
+    """
+
+    Args: arguments: the parsed command line arguments.
+
+    Returns: the measures of the pipeline stage, one per catalogue size.
+
+    """
+    all_measures = []
+    for number_of_books in arguments.books:
+        server = starting_fixture_server(SyntheticCatalogue(number_of_books))
+        try:
+            stage_arguments = argparse.Namespace(books=number_of_books, concurrency=arguments.concurrency,
+                                                 recorded=None, max_rss=arguments.max_rss)
+            measures = measuring_stage("pipeline", server.base_url, stage_arguments)
+            # the report's first column gives the catalogue's size, instead of the stage.
+            measures["stage"] = str(number_of_books)
+            all_measures.append(measures)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return all_measures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the pipeline's peak memory doesn't grow with the catalogue.")
+    parser.add_argument("--books", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="sizes of the synthetic catalogues, the smallest one first")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="the largest peak RSS may be this many times the smallest one")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="requests in flight")
+    parser.add_argument("--max-rss", type=int, help="memory ceiling in megabytes (see memory_limit.py)")
+    arguments = parser.parse_args()
+    if min(arguments.books) < MIN_BOOKS:
+        parser.error("the catalogues need at least {} books: below, the cache of the parsed pages is still filling "
+                     "up".format(MIN_BOOKS))
+
+    all_measures = measuring_sizes(arguments)
+    printing_report(all_measures)
+
+    peaks = [measures["peak_rss_mb"] for measures in all_measures]
+    if None in peaks:
+        print("The peak RSS can't be measured on this system.")
+        return
+    ratio = max(peaks) / peaks[0]
+    print("Largest peak RSS / smallest catalogue's: {:.2f} (tolerance {:.2f})".format(ratio, arguments.tolerance))
+    if ratio > arguments.tolerance:
+        sys.exit("The memory grows with the catalogue.")
+
+
+if __name__ == '__main__':
+    main()
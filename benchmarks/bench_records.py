@@ -0,0 +1,128 @@
+""" Compares the books as dictionaries and as BookRecords (see book_record.py).
+
+First, it checks both give exactly the same JSON Lines and SQLite rows. Then, it measures the memory each one needs
+per book (with tracemalloc), and the time needed to serialize a batch of books the way the sinks did before and do
+now.
+
+Usage: python -m benchmarks.bench_records [number of books]
+
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks.catalogue_pages import making_book, rendering_product_page
+from book_record import BookRecord, FIELDNAMES, encoding_json_lines, rows_from_records, serializable_value
+from product_page_extractor import extracting_book_information_fast
+
+# Number of distinct pages extracted: the other books are copies of them, with their own URL and UPC.
+DISTINCT_PAGES = 100
+
+
+def fresh(value):
+    """ A copy of the value which isn't the same object, like the extractor gives for each page.
+    """
+    if isinstance(value, str):
+        return (value + " ")[:-1]
+    if isinstance(value, bytes):
+        return (value + b" ")[:-1]
+    return value
+
+
+def making_book_dicts(number_of_books):
+    """
+
+    Args: number_of_books: the number of dictionaries wanted.
+
+    Returns: a list of dictionaries as the extractor gives them, every 7th one with a missing rating.
+
+    """
+    pages = []
+    for number in range(DISTINCT_PAGES):
+        book = making_book(number)
+        link = "http://books.toscrape.com/catalogue/" + book["slug"] + "/index.html"
+        pages.append(extracting_book_information_fast(link, book["title"], rendering_product_page(book)))
+    book_dicts = []
+    for number in range(number_of_books):
+        book_dict = {field: fresh(value) for field, value in pages[number % DISTINCT_PAGES].items()}
+        book_dict["product_page_url"] = "http://books.toscrape.com/catalogue/book_{}/index.html".format(number)
+        book_dict["universal_product_code"] = "{:016x}".format(number)
+        if number % 7 == 0:
+            book_dict["review_rating"] = "Unable to scrap this information"
+        book_dicts.append(book_dict)
+    return book_dicts
+
+
+def measuring_memory(building):
+    """
+
+    Args: building: a function returning the objects to measure.
+
+    Returns: the objects, and the memory in bytes they hold.
+
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = building()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return objects, size
+
+
+def timing(function, argument, repeat=5):
+    """
+
+    Returns: the best time in seconds function(argument) took.
+
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def encoding_dicts(book_dicts):
+    """ The JSON Lines encoding of the sinks, before BookRecord.
+    """
+    records = [{field: serializable_value(book_dict.get(field)) for field in FIELDNAMES} for book_dict in book_dicts]
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+
+def rows_from_dicts(book_dicts):
+    """ The SQLite rows of the sinks, before BookRecord.
+    """
+    records = [{field: serializable_value(book_dict.get(field)) for field in FIELDNAMES} for book_dict in book_dicts]
+    return [[record[field] for field in FIELDNAMES] for record in records]
+
+
+def main(number_of_books=20000):
+    # a first run, so that the caches of the extractor aren't measured with the books.
+    making_book_dicts(DISTINCT_PAGES)
+    book_dicts, dicts_size = measuring_memory(lambda: making_book_dicts(number_of_books))
+    book_records, records_size = measuring_memory(
+        lambda: [BookRecord.from_mapping(book_dict) for book_dict in making_book_dicts(number_of_books)])
+
+    if encoding_json_lines(book_records) != encoding_dicts(book_dicts):
+        raise SystemExit("The JSON Lines of the records differ from the dictionaries'")
+    if [list(row) for row in rows_from_records(book_records)] != rows_from_dicts(book_dicts):
+        raise SystemExit("The rows of the records differ from the dictionaries'")
+
+    print("books: {}".format(number_of_books))
+    print("memory per book:   dict {:.0f} B, BookRecord {:.0f} B ({:.1f}x less)".format(
+        dicts_size / number_of_books, records_size / number_of_books, dicts_size / records_size))
+    for name, old, new in (("JSON Lines", encoding_dicts, encoding_json_lines),
+                           ("SQLite rows", rows_from_dicts, rows_from_records)):
+        old_time = timing(old, book_dicts)
+        new_time = timing(new, book_records)
+        print("{:<18} dict {:.2f} us, BookRecord {:.2f} us per book ({:.1f}x faster)".format(
+            name + ":", old_time / number_of_books * 1e6, new_time / number_of_books * 1e6, old_time / new_time))
+
+
+if __name__ == "__main__":
+    main(*[int(argument) for argument in sys.argv[1:2]])
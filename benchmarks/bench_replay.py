@@ -0,0 +1,79 @@
+""" Compares a crawl of the whole catalogue with the replay of its response archive (see response_archive.py).
+
+First, the pipeline crawls the local fixture server, its pages appended to an archive. Then the server is stopped and
+the pipeline runs again from the archive alone. It checks both runs write exactly the same books, and reports the
+time each one took: the replay only costs the parsing.
+
+Usage: python -m benchmarks.bench_replay [--books 1000] [--latency 0.05] [--concurrency 20]
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import http_client
+import links_and_titles_scrapper
+from benchmarks.catalogue_pages import SyntheticCatalogue
+from benchmarks.fixture_server import starting_fixture_server
+from output_sinks import opening_sink
+from pipeline import scraping_catalogue, DEFAULT_CONCURRENCY
+
+
+def running_pipeline(url, folder, name, concurrency):
+    """ Runs the pipeline without the images, the books going to a JSON Lines file.
+
+    Returns: the seconds it took, and the sorted lines of the file.
+
+    """
+    # the listing pages parsed by the previous run mustn't be reused.
+    links_and_titles_scrapper.requesting_page.cache_clear()
+    path = os.path.join(folder, name + ".jsonl")
+    started_at = time.perf_counter()
+    with opening_sink(path) as sink:
+        scraping_catalogue(url, concurrency, sink, base_directory=os.path.join(folder, name), with_images=False)
+    elapsed = time.perf_counter() - started_at
+    with open(path, 'r', encoding="utf-8") as f:
+        return elapsed, sorted(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares a crawl with the replay of its response archive.")
+    parser.add_argument("--books", type=int, default=1000, help="number of books of the synthetic catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before each answer")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="requests in flight")
+    arguments = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="benchmark_replay_")
+    catalogue = SyntheticCatalogue(arguments.books)
+    server = starting_fixture_server(catalogue, latency=arguments.latency)
+    url = catalogue.catalogue_url(server.base_url)
+    try:
+        archive = http_client.enable_archive(os.path.join(folder, "crawl.warc.gz"))
+        try:
+            crawl_time, crawled = running_pipeline(url, folder, "crawl", arguments.concurrency)
+            pages, size = archive.counting()
+        finally:
+            http_client.disable_archive()
+            server.shutdown()
+            server.server_close()
+
+        http_client.enable_replay(os.path.join(folder, "crawl.warc.gz"))
+        try:
+            replay_time, replayed = running_pipeline(url, folder, "replay", arguments.concurrency)
+        finally:
+            http_client.disable_replay()
+        if replayed != crawled:
+            raise SystemExit("The replay didn't write the same books as the crawl")
+
+        print("books: {}, pages archived: {}, archive: {:.1f} MB".format(len(crawled), pages, size / 1024 / 1024))
+        print("crawl:  {:.2f} s".format(crawl_time))
+        print("replay: {:.2f} s ({:.0f} pages/sec, no network)".format(replay_time, pages / replay_time))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
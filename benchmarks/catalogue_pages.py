@@ -0,0 +1,519 @@
+""" This script writes synthetic pages shaped like the books.toscrape.com ones, and holds the catalogues served by the
+fixture server.
+
+The benchmarks use them so they don't depend on the live website:
+    - SyntheticCatalogue generates its pages on the fly, for any number of books (10k, 100k...), in the website's 50
+      categories and 20 books per listing page.
+    - RecordedCatalogue serves pages recorded from the website (e.g. with wget --mirror) from a folder.
+
+"""
+
+import hashlib
+import html
+import math
+import mimetypes
+import os
+import re
+
+RATINGS = ("One", "Two", "Three", "Four", "Five")
+
+CATEGORIES = ("Travel", "Mystery", "Historical Fiction", "Sequential Art", "Classics", "Philosophy", "Romance",
+              "Womens Fiction", "Fiction", "Childrens", "Religion", "Nonfiction", "Music", "Default",
+              "Science Fiction", "Sports and Games", "Add a comment", "Fantasy", "New Adult", "Young Adult",
+              "Science", "Poetry", "Paranormal", "Art", "Psychology", "Autobiography", "Parenting", "Adult Fiction",
+              "Humor", "Horror", "History", "Food and Drink", "Christian Fiction", "Business", "Biography",
+              "Thriller", "Contemporary", "Spirituality", "Academic", "Self Help", "Historical", "Christian",
+              "Suspense", "Short Stories", "Novels", "Health", "Politics", "Cultural", "Erotica", "Crime")
+
+BOOKS_PER_PAGE = 20
+IMAGE_SIZE = 12 * 1024
+
+
+def making_book(number, category="Mystery"):
+    """
+
+    Args:
+        number: the number of the book. Two different numbers give two different books.
+        category: the category of the book.
+
+    Returns: a dictionary describing the book, used to write its pages.
+
+    """
+    return {"number": number,
+            "slug": "book-number-" + str(number) + "_" + str(number),
+            "title": "Book number " + str(number) + " & co: a <synthetic> title",
+            "upc": format(number * 7919, "016x"),
+            "price": "£" + str(10 + number % 50) + "." + format(number % 100, "02d"),
+            "available": number % 30 + 1,
+            "rating": RATINGS[number % 5],
+            "description": ("The description of book number " + str(number) + ", with some café & “quotes”. ") * 8,
+            "category": category,
+            "image": "../../" + image_path(number)}
+
+
+def image_path(number):
+    """
+
+    Args: number: the number of the book.
+
+    Returns: the path of the book's image on the website, e.g. 'media/cache/01/03/<hash>.jpg'.
+
+    """
+    return "media/cache/" + format(number % 256, "02x") + "/" + format(number * 3 % 256, "02x") + "/" \
+           + format(number, "032x") + ".jpg"
+
+
+def category_slug(category_index):
+    """
+
+    Args: category_index: the position of the category in CATEGORIES.
+
+    Returns: the name of the category in its URL, e.g. 'mystery_3'.
+
+    """
+    return CATEGORIES[category_index].lower().replace(" ", "-") + "_" + str(category_index + 2)
+
+
+def rendering_category_page(category_index, page_number, number_of_pages, books):
+    """
+
+    Args:
+        category_index: the position of the category in CATEGORIES.
+        page_number: the number of the listing page, starting at 1.
+        number_of_pages: the number of listing pages in the category.
+        books: the dictionaries (see making_book) of the books listed on this page.
+
+    Returns: the HTML source code of the listing page.
+
+    """
+    return rendering_listing_page(CATEGORIES[category_index], category_slug(category_index), page_number,
+                                  number_of_pages, books, "../../../")
+
+
+def rendering_catalogue_page(page_number, number_of_pages, books):
+    """
+
+    Args:
+        page_number: the number of the catalogue's page (catalogue/page-N.html), starting at 1.
+        number_of_pages: the number of pages of the catalogue.
+        books: the dictionaries (see making_book) of the books listed on this page.
+
+    Returns: the HTML source code of the catalogue's page, listing the books of every category.
+
+    """
+    return rendering_listing_page("All products", None, page_number, number_of_pages, books, "")
+
+
+def rendering_listing_page(heading, current_slug, page_number, number_of_pages, books, to_catalogue):
+    """
+
+    Args:
+        heading: the title of the page.
+        current_slug: the slug of the page's category, None for the catalogue's pages.
+        page_number: the number of the listing page, starting at 1.
+        number_of_pages: the number of listing pages.
+        books: the dictionaries (see making_book) of the books listed on this page.
+        to_catalogue: the relative path from the page to the 'catalogue' folder e.g. '../../../'.
+
+    Returns: the HTML source code of the listing page.
+
+    """
+    sidebar = []
+    for index, category in enumerate(CATEGORIES):
+        slug = category_slug(index)
+        href = "index.html" if slug == current_slug else to_catalogue + "category/books/" + slug + "/index.html"
+        sidebar.append("""                        <li>
+                            <a href="{}">
+                                {}
+                            </a>
+                        </li>""".format(href, category))
+
+    articles = []
+    for book in books:
+        articles.append("""        <li class="col-xs-6 col-sm-4 col-md-3 col-lg-3">
+    <article class="product_pod">
+            <div class="image_container">
+                    <a href="{to_catalogue}{slug}/index.html"><img src="{to_catalogue}../{image}" alt="{title}"
+                        class="thumbnail"></a>
+            </div>
+                <p class="star-rating {rating}">
+                    <i class="icon-star"></i>
+                </p>
+            <h3><a href="{to_catalogue}{slug}/index.html" title="{title}">{short_title}</a></h3>
+            <div class="product_price">
+        <p class="price_color">{price}</p>
+<p class="instock availability">
+    <i class="icon-ok"></i>
+        In stock
+</p>
+            </div>
+    </article>
+</li>""".format(slug=book["slug"], image=image_path(book["number"]), title=html.escape(book["title"]),
+                short_title=html.escape(book["title"][:20]) + "...", rating=book["rating"], price=book["price"],
+                to_catalogue=to_catalogue))
+
+    pager = ""
+    if number_of_pages > 1:
+        pager = """<div>
+    <ul class="pager">"""
+        if page_number > 1:
+            pager += """
+            <li class="previous"><a href="page-{}.html">previous</a></li>""".format(page_number - 1)
+        pager += """
+        <li class="current">
+            Page {} of {}
+        </li>""".format(page_number, number_of_pages)
+        if page_number < number_of_pages:
+            pager += """
+            <li class="next"><a href="page-{}.html">next</a></li>""".format(page_number + 1)
+        pager += """
+    </ul>
+</div>"""
+
+    return """<!DOCTYPE html>
+<html lang="en-us" class="no-js">
+<head>
+    <title>{category} | Books to Scrape - Sandbox</title>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+</head>
+<body id="default" class="default">
+<header class="header container-fluid">
+    <div class="page_inner">
+        <div class="row">
+            <div class="col-sm-8 h1">
+                <a href="{to_catalogue}../index.html">Books to Scrape</a><small> We love being scraped!</small>
+            </div>
+        </div>
+    </div>
+</header>
+<div class="container-fluid page">
+    <div class="page_inner">
+<ul class="breadcrumb">
+    <li>
+        <a href="{to_catalogue}../index.html">Home</a>
+    </li>
+    <li>
+        <a href="{to_catalogue}category/books_1/index.html">Books</a>
+    </li>
+    <li class="active">{category}</li>
+</ul>
+        <div class="row">
+            <aside class="sidebar col-sm-4 col-md-3">
+                <div class="side_categories">
+                    <ul class="nav nav-list">
+                        <li>
+                            <a href="{to_catalogue}category/books_1/index.html">
+                                Books
+                            </a>
+                            <ul>
+{sidebar}
+                            </ul>
+                        </li>
+                    </ul>
+                </div>
+            </aside>
+            <div class="col-sm-8 col-md-9">
+                <div class="page-header action">
+                    <h1>{category}</h1>
+                </div>
+                <section>
+                    <div>
+                        <ol class="row">
+{articles}
+                        </ol>
+{pager}
+                    </div>
+                </section>
+            </div>
+        </div>
+    </div>
+</div>
+<footer class="footer container-fluid"></footer>
+</body>
+</html>
+""".format(category=heading, sidebar="\n".join(sidebar), articles="\n".join(articles), pager=pager,
+           to_catalogue=to_catalogue)
+
+
+def rendering_product_page(book):
+    """
+
+    Args: book: a dictionary returned by making_book.
+
+    Returns: the HTML source code of the book's page.
+
+    """
+    values = dict(book,
+                  title=html.escape(book["title"]),
+                  description=html.escape(book["description"]),
+                  category_slug=book["category"].lower().replace(" ", "-"))
+    return """<!DOCTYPE html>
+<html lang="en-us" class="no-js">
+<head>
+    <title>{title} | Books to Scrape - Sandbox</title>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+</head>
+<body id="default" class="default">
+<header class="header container-fluid">
+    <div class="page_inner">
+        <div class="row">
+            <div class="col-sm-8 h1">
+                <a href="../../index.html">Books to Scrape</a><small> We love being scraped!</small>
+            </div>
+        </div>
+    </div>
+</header>
+<div class="container-fluid page">
+    <div class="page_inner">
+<ul class="breadcrumb">
+    <li>
+        <a href="../../index.html">Home</a>
+    </li>
+    <li>
+        <a href="../category/books_1/index.html">Books</a>
+    </li>
+    <li>
+        <a href="../category/books/{category_slug}_3/index.html">{category}</a>
+    </li>
+    <li class="active">{title}</li>
+</ul>
+<div id="messages"></div>
+<div class="content">
+    <div id="promotions"></div>
+    <div id="content_inner">
+<article class="product_page"><!-- Start of product page -->
+    <div class="row">
+        <div class="col-sm-6">
+<div id="product_gallery" class="carousel">
+    <div class="thumbnail">
+        <div class="carousel-inner">
+            <div class="item active">
+                <img src="{image}" alt="{title}" />
+            </div>
+        </div>
+    </div>
+</div>
+        </div>
+        <div class="col-sm-6 product_main">
+    <h1>{title}</h1>
+<p class="price_color">{price}</p>
+<p class="instock availability">
+    <i class="icon-ok"></i>
+        In stock ({available} available)
+</p>
+    <p class="star-rating {rating}">
+        <i class="icon-star"></i>
+        <i class="icon-star"></i>
+        <i class="icon-star"></i>
+        <i class="icon-star"></i>
+        <i class="icon-star"></i>
+    </p>
+    <hr/>
+</div><!-- /col-sm-6 -->
+    </div><!-- /row -->
+    <div id="product_description" class="sub-header">
+        <h2>Product Description</h2>
+    </div>
+    <p>{description} ...more</p>
+    <div class="sub-header">
+        <h2>Product Information</h2>
+    </div>
+<table class="table table-striped">
+        <tr>
+            <th>UPC</th><td>{upc}</td>
+        </tr>
+        <tr>
+            <th>Product Type</th><td>Books</td>
+        </tr>
+            <tr>
+                <th>Price (excl. tax)</th><td>{price}</td>
+            </tr>
+                <tr>
+                    <th>Price (incl. tax)</th><td>{price}</td>
+                </tr>
+                <tr>
+                    <th>Tax</th><td>£0.00</td>
+                </tr>
+        <tr>
+            <th>Availability</th>
+            <td>In stock ({available} available)</td>
+        </tr>
+        <tr>
+            <th>Number of reviews</th>
+            <td>0</td>
+        </tr>
+</table>
+</article>
+    </div>
+</div>
+    </div>
+</div>
+<footer class="footer container-fluid"></footer>
+</body>
+</html>
+""".format(**values)
+
+
+def rendering_image(number):
+    """
+
+    Args: number: the number of the book.
+
+    Returns: IMAGE_SIZE bytes standing for the book's JPEG image. Two books never share the same bytes.
+
+    """
+    seed = hashlib.sha256(str(number).encode("ascii")).digest()
+    return b"\xff\xd8\xff\xe0" + (seed * (IMAGE_SIZE // len(seed) + 1))[:IMAGE_SIZE - 4]
+
+
+class SyntheticCatalogue:
+    """ A catalogue of any size, whose pages are generated when requested. Nothing is kept in memory.
+
+    The books are spread over the 50 categories: book number n belongs to the category n % 50.
+    """
+
+    CATALOGUE_PAGE = re.compile(r"^/catalogue/page-(\d+)\.html$")
+    CATEGORY_PAGE = re.compile(r"^/catalogue/category/books/([a-z-]+)_(\d+)/(?:index|page-(\d+))\.html$")
+    PRODUCT_PAGE = re.compile(r"^/catalogue/book-number-(\d+)_\d+/index\.html$")
+    IMAGE = re.compile(r"^/media/cache/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{32})\.jpg$")
+
+    def __init__(self, number_of_books):
+        self.number_of_books = number_of_books
+
+    def books_in_category(self, category_index):
+        """
+
+        Returns: the numbers of the books in the category, in the order they are listed.
+
+        """
+        return range(category_index, self.number_of_books, len(CATEGORIES))
+
+    def number_of_pages(self, category_index):
+        return max(1, math.ceil(len(self.books_in_category(category_index)) / BOOKS_PER_PAGE))
+
+    def number_of_catalogue_pages(self):
+        return max(1, math.ceil(self.number_of_books / BOOKS_PER_PAGE))
+
+    def catalogue_url(self, base_url):
+        """
+
+        Returns: the URL of the catalogue's first page, listing the books of every category.
+
+        """
+        return base_url + "/catalogue/page-1.html"
+
+    def category_urls(self, base_url):
+        """
+
+        Args: base_url: the URL of the fixture server, e.g. 'http://127.0.0.1:8000'.
+
+        Returns: the URLs of the first listing page of each category.
+
+        """
+        return [base_url + "/catalogue/category/books/" + category_slug(index) + "/index.html"
+                for index in range(len(CATEGORIES))]
+
+    def book_urls(self, base_url):
+        """
+
+        Returns: (product page URL, title) tuples, for every book of the catalogue.
+
+        """
+        for number in range(self.number_of_books):
+            book = making_book(number)
+            yield base_url + "/catalogue/" + book["slug"] + "/index.html", book["title"]
+
+    def image_urls(self, base_url):
+        """
+
+        Returns: the URLs of every book's image.
+
+        """
+        for number in range(self.number_of_books):
+            yield base_url + "/" + image_path(number)
+
+    def page(self, path):
+        """
+
+        Args: path: the path of the requested URL.
+
+        Returns: a (body in bytes, content type) tuple, or None if there's no such page.
+
+        """
+        match = self.CATALOGUE_PAGE.match(path)
+        if match:
+            page_number = int(match.group(1))
+            number_of_pages = self.number_of_catalogue_pages()
+            if not 1 <= page_number <= number_of_pages:
+                return None
+            numbers = range((page_number - 1) * BOOKS_PER_PAGE, min(page_number * BOOKS_PER_PAGE, self.number_of_books))
+            books = [making_book(number, CATEGORIES[number % len(CATEGORIES)]) for number in numbers]
+            return rendering_catalogue_page(page_number, number_of_pages, books).encode("utf-8"), "text/html"
+
+        match = self.CATEGORY_PAGE.match(path)
+        if match:
+            category_index = int(match.group(2)) - 2
+            if not 0 <= category_index < len(CATEGORIES):
+                return None
+            page_number = int(match.group(3) or 1)
+            number_of_pages = self.number_of_pages(category_index)
+            if page_number > number_of_pages:
+                return None
+            numbers = self.books_in_category(category_index)[(page_number - 1) * BOOKS_PER_PAGE:
+                                                             page_number * BOOKS_PER_PAGE]
+            books = [making_book(number, CATEGORIES[category_index]) for number in numbers]
+            markup = rendering_category_page(category_index, page_number, number_of_pages, books)
+            return markup.encode("utf-8"), "text/html"
+
+        match = self.PRODUCT_PAGE.match(path)
+        if match and int(match.group(1)) < self.number_of_books:
+            number = int(match.group(1))
+            markup = rendering_product_page(making_book(number, CATEGORIES[number % len(CATEGORIES)]))
+            return markup.encode("utf-8"), "text/html"
+
+        match = self.IMAGE.match(path)
+        if match and int(match.group(1), 16) < self.number_of_books:
+            return rendering_image(int(match.group(1), 16)), "image/jpeg"
+        return None
+
+
+class RecordedCatalogue:
+    """ Pages recorded from the website, stored in a folder with the same layout as the website's URLs.
+
+    Ex: the folder given by wget --mirror https://books.toscrape.com/
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+
+    def listing_paths(self, subfolder, pattern):
+        paths = []
+        for root, _, filenames in os.walk(os.path.join(self.folder, subfolder)):
+            for filename in filenames:
+                path = "/" + os.path.relpath(os.path.join(root, filename), self.folder).replace(os.sep, "/")
+                if re.match(pattern, path):
+                    paths.append(path)
+        return sorted(paths)
+
+    def catalogue_url(self, base_url):
+        return base_url + "/catalogue/page-1.html"
+
+    def category_urls(self, base_url):
+        return [base_url + path for path in self.listing_paths(os.path.join("catalogue", "category", "books"),
+                                                               r"^/catalogue/category/books/[^/]+/index\.html$")]
+
+    def book_urls(self, base_url):
+        for path in self.listing_paths("catalogue", r"^/catalogue/(?!category/)[^/]+/index\.html$"):
+            yield base_url + path, path.split("/")[2]
+
+    def image_urls(self, base_url):
+        for path in self.listing_paths("media", r"^/media/.+\.jpg$"):
+            yield base_url + path
+
+    def page(self, path):
+        filename = os.path.normpath(os.path.join(self.folder, path.lstrip("/")))
+        if not filename.startswith(self.folder) or not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            body = f.read()
+        return body, mimetypes.guess_type(filename)[0] or "application/octet-stream"
@@ -0,0 +1,124 @@
+""" This script serves a catalogue (see catalogue_pages.py) over HTTP on the local machine, for the benchmarks.
+
+The server can wait before each answer, to mimic the latency of the real website. It sends an ETag and answers
+'304 Not Modified' to the conditional requests, like the website does.
+
+Usage: python -m benchmarks.fixture_server [--books 10000] [--latency 0.05] [--recorded FOLDER] [--port 8000]
+
+"""
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.catalogue_pages import RecordedCatalogue, SyntheticCatalogue
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """ Answers the GET requests with the pages of the server's catalogue.
+    """
+
+    # keep-alive, so the benchmarks measure the shared session like it's used on the website.
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are sent separately. With Nagle's algorithm, each answer would wait 40 ms for an ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        found = server.catalogue.page(self.path.split("?")[0])
+        if found is None:
+            self.sending(404, b"Not found", "text/plain")
+            return
+        body, content_type = found
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.sending(304, b"", content_type, etag)
+            return
+        self.sending(200, body, content_type, etag)
+
+    def sending(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # thousands of lines in the terminal would cost more than the requests themselves.
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """ A threaded HTTP server holding a catalogue, a latency and a jitter.
+    """
+
+    daemon_threads = True
+    # the benchmarks open a lot of connections at once.
+    request_queue_size = 128
+
+    def __init__(self, catalogue, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+        """
+
+        Args:
+            catalogue: a SyntheticCatalogue or a RecordedCatalogue.
+            host: the address to listen on.
+            port: the port to listen on. 0 lets the system pick a free one.
+            latency: the number of seconds to wait before each answer.
+            jitter: a random number of seconds, between 0 and jitter, added to the latency.
+
+        """
+        super().__init__((host, port), FixtureRequestHandler)
+        self.catalogue = catalogue
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+
+def starting_fixture_server(catalogue, latency=0.0, jitter=0.0, port=0):
+    """ Starts the server in a background thread.
+
+    Args:
+        catalogue: a SyntheticCatalogue or a RecordedCatalogue.
+        latency: the number of seconds to wait before each answer.
+        jitter: a random number of seconds, between 0 and jitter, added to the latency.
+        port: the port to listen on. 0 lets the system pick a free one.
+
+    Returns: the FixtureServer. Its base_url gives the address to request, its shutdown() method stops it.
+
+    """
+    server = FixtureServer(catalogue, port=port, latency=latency, jitter=jitter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves a catalogue of books on the local machine.")
+    parser.add_argument("--books", type=int, default=1000, help="number of books of the synthetic catalogue")
+    parser.add_argument("--recorded", help="folder of recorded pages to serve instead of the synthetic catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this value")
+    parser.add_argument("--port", type=int, default=8000)
+    arguments = parser.parse_args()
+
+    if arguments.recorded:
+        served_catalogue = RecordedCatalogue(arguments.recorded)
+    else:
+        served_catalogue = SyntheticCatalogue(arguments.books)
+    fixture_server = FixtureServer(served_catalogue, port=arguments.port, latency=arguments.latency,
+                                   jitter=arguments.jitter)
+    print("Serving on " + fixture_server.base_url)
+    try:
+        fixture_server.serve_forever()
+    except KeyboardInterrupt:
+        fixture_server.server_close()
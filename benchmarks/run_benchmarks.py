@@ -0,0 +1,233 @@
+""" Measures the throughput of the stages of a crawl against the local fixture server, not the live website.
+
+The stages are:
+    - crawl: the links and titles of every category, with put_together_the_dict (fan-out mode),
+    - extract: the 10 required information of every book, with scraping_books_concurrently,
+    - images: every book's image, with downloading_images,
+    - pipeline: the catalogue's pages, product pages and JSON Lines output of pipeline.py, chained (no images: the
+      extractors point them to the live website).
+
+Each stage runs in its own process, so its CPU time and peak memory (RSS) aren't mixed up with the other stages' or
+the fixture server's. For each stage, we report the pages per second, the median (p50) and 99th percentile (p99)
+time per page, the CPU time and the peak RSS.
+
+Usage: python -m benchmarks.run_benchmarks [--books 10000] [--latency 0.05] [--jitter 0.02] [--recorded FOLDER]
+                                           [--max-rss 200]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows doesn't have it, we simply won't report the CPU time and the memory.
+    resource = None
+
+import http_client
+from benchmarks.catalogue_pages import RecordedCatalogue, SyntheticCatalogue
+from benchmarks.fixture_server import starting_fixture_server
+from book_scrapper import scraping_books_concurrently
+from image_downloader import downloading_images
+from links_and_titles_scrapper import put_together_the_dict, discovering_whole_catalogue
+from memory_limit import set_memory_ceiling
+from output_sinks import opening_sink
+from pipeline import scraping_books, saving_books_by_category
+
+STAGES = ("crawl", "extract", "images", "pipeline")
+DEFAULT_NUMBER_OF_BOOKS = 10000
+DEFAULT_CONCURRENCY = 20
+
+
+def percentile(sorted_values, percent):
+    """
+
+    Args:
+        sorted_values: the measures, in ascending order.
+        percent: e.g. 99 for the 99th percentile.
+
+    Returns: the value below which 'percent' % of the measures are, or None if there are no measures.
+
+    """
+    if not sorted_values:
+        return None
+    index = int(round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def crawling_categories(catalogue, base_url, arguments):
+    for category_url in catalogue.category_urls(base_url):
+        put_together_the_dict(category_url, fan_out=True)
+
+
+def extracting_books(catalogue, base_url, arguments):
+    links, books = [], []
+    for link, book in catalogue.book_urls(base_url):
+        links.append(link)
+        books.append(book)
+
+    async def extracting_all_books():
+        async for _ in scraping_books_concurrently(links, books, arguments.concurrency):
+            pass
+
+    asyncio.run(extracting_all_books())
+
+
+def downloading_all_images(catalogue, base_url, arguments):
+    folder = tempfile.mkdtemp(prefix="benchmark_images_")
+    try:
+        images = ((image_url, os.path.join(folder, str(number) + ".jpg"), image_url)
+                  for number, image_url in enumerate(catalogue.image_urls(base_url)))
+        downloading_images(images, arguments.concurrency)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def running_pipeline(catalogue, base_url, arguments):
+    folder = tempfile.mkdtemp(prefix="benchmark_pipeline_")
+    try:
+        with opening_sink(os.path.join(folder, "books.jsonl")) as sink:
+            books = discovering_whole_catalogue(catalogue.catalogue_url(base_url), arguments.concurrency)
+            scrapped_books = scraping_books(books, arguments.concurrency)
+            for _ in saving_books_by_category(scrapped_books, sink, base_directory=folder):
+                pass
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+STAGE_FUNCTIONS = {"crawl": crawling_categories,
+                   "extract": extracting_books,
+                   "images": downloading_all_images,
+                   "pipeline": running_pipeline}
+
+
+def running_stage(stage, arguments):
+    """ Runs one stage in the current process and measures it. Called in the child process started by measuring_stage.
+
+    Args:
+        stage: one of STAGES.
+        arguments: the parsed command line arguments.
+
+    Returns: a dictionary with the measures of the stage.
+
+    """
+    catalogue = choosing_catalogue(arguments)
+    http_client.configure_client(pool_size=arguments.concurrency)
+    if arguments.max_rss:
+        set_memory_ceiling(arguments.max_rss * 1024 * 1024)
+    latencies = []
+    http_client.request_hooks.append(lambda url, elapsed, size: latencies.append(elapsed))
+
+    started_at = time.perf_counter()
+    STAGE_FUNCTIONS[stage](catalogue, arguments.base_url, arguments)
+    wall_time = time.perf_counter() - started_at
+
+    latencies.sort()
+    measures = {"stage": stage,
+                "pages": len(latencies),
+                "seconds": wall_time,
+                "pages_per_second": len(latencies) / wall_time if wall_time else None,
+                "p50_ms": None if not latencies else percentile(latencies, 50) * 1000,
+                "p99_ms": None if not latencies else percentile(latencies, 99) * 1000,
+                "cpu_seconds": None,
+                "peak_rss_mb": None}
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        measures["cpu_seconds"] = usage.ru_utime + usage.ru_stime
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS.
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        measures["peak_rss_mb"] = usage.ru_maxrss / divisor
+    return measures
+
+
+def measuring_stage(stage, base_url, arguments):
+    """ Runs one stage in a new process, so its CPU time and peak RSS are its own.
+
+    Args:
+        stage: one of STAGES.
+        base_url: the URL of the fixture server.
+        arguments: the parsed command line arguments.
+
+    Returns: the dictionary returned by running_stage in the child process.
+
+    """
+    command = [sys.executable, "-m", "benchmarks.run_benchmarks", "--stage", stage, "--base-url", base_url,
+               "--books", str(arguments.books), "--concurrency", str(arguments.concurrency)]
+    if arguments.recorded:
+        command += ["--recorded", arguments.recorded]
+    if arguments.max_rss:
+        command += ["--max-rss", str(arguments.max_rss)]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    # the last line is ours, the lines before may be prints of the scrappers.
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def choosing_catalogue(arguments):
+    if arguments.recorded:
+        return RecordedCatalogue(arguments.recorded)
+    return SyntheticCatalogue(arguments.books)
+
+
+def formatting_value(value, pattern):
+    return "n/a" if value is None else pattern.format(value)
+
+
+def printing_report(all_measures):
+    print("{:<8} {:>8} {:>9} {:>10} {:>9} {:>9} {:>9} {:>10}".format(
+        "stage", "pages", "seconds", "pages/sec", "p50 ms", "p99 ms", "CPU s", "peak MB"))
+    for measures in all_measures:
+        print("{:<8} {:>8} {:>9} {:>10} {:>9} {:>9} {:>9} {:>10}".format(
+            measures["stage"],
+            measures["pages"],
+            formatting_value(measures["seconds"], "{:.2f}"),
+            formatting_value(measures["pages_per_second"], "{:.1f}"),
+            formatting_value(measures["p50_ms"], "{:.1f}"),
+            formatting_value(measures["p99_ms"], "{:.1f}"),
+            formatting_value(measures["cpu_seconds"], "{:.2f}"),
+            formatting_value(measures["peak_rss_mb"], "{:.1f}")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the crawl, extraction, image download and pipeline stages.")
+    parser.add_argument("--books", type=int, default=DEFAULT_NUMBER_OF_BOOKS,
+                        help="number of books of the synthetic catalogue (e.g. 10000 to 100000)")
+    parser.add_argument("--recorded", help="folder of recorded pages to serve instead of the synthetic catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this value")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="requests in flight during the extract and images stages")
+    parser.add_argument("--max-rss", type=int, help="memory ceiling of the stages in megabytes (see memory_limit.py)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--json", help="file where to write the measures, in JSON")
+    # used internally, to run a single stage in a child process.
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.stage:
+        print(json.dumps(running_stage(arguments.stage, arguments)))
+        return
+
+    server = starting_fixture_server(choosing_catalogue(arguments), arguments.latency, arguments.jitter)
+    try:
+        all_measures = [measuring_stage(stage, server.base_url, arguments) for stage in arguments.stages]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    printing_report(all_measures)
+    if arguments.json:
+        with open(arguments.json, 'w', encoding="utf-8") as f:
+            json.dump(all_measures, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
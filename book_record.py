@@ -0,0 +1,220 @@
+""" This script holds BookRecord, the compact type of a scrapped book.
+
+A book used to be a fresh dictionary of ten string keys, with the sentinel UNABLE_TO_SCRAP written in each information
+the extractor couldn't find. A BookRecord keeps the same ten information in __slots__ instead: no dictionary per book,
+the missing information are bits of a single int, and the categories and ratings (a few dozen distinct values for
+thousands of books) are interned, so each distinct value is stored once.
+
+A BookRecord reads like the dictionary it replaces: book_record["title"], book_record.get("category"), csv.DictWriter
+and dict(book_record) all work, and a missing information still reads UNABLE_TO_SCRAP. It compares equal to the
+dictionary holding the same information.
+
+The sinks write the records by batches, with the bulk functions below: rows_from_records() for SQLite and csv
+writers, encoding_json_lines() for JSON Lines, and decoding_json_lines() to read them back.
+
+Ex:
+    book_record = BookRecord.from_mapping(book_dict)
+    sink_file.write(encoding_json_lines(book_records))
+
+"""
+
+import json
+import sys
+from collections.abc import Mapping
+from json.encoder import encode_basestring
+from operator import attrgetter
+
+UNABLE_TO_SCRAP = "Unable to scrap this information"
+
+# The 10 required information, in the order they are written.
+FIELDNAMES = ["product_page_url",
+              "universal_product_code",
+              "title",
+              "price_including_tax",
+              "price_excluding_tax",
+              "number_available",
+              "category",
+              "review_rating",
+              "product_description",
+              "image_url"]
+
+# The information shared by many books: each distinct value is kept once.
+INTERNED_FIELDS = ("category", "review_rating")
+
+# information name -> its bit in BookRecord.missing.
+FIELD_BITS = {field: 1 << position for position, field in enumerate(FIELDNAMES)}
+DESCRIPTION = FIELDNAMES.index("product_description")
+
+_getting_values = attrgetter(*FIELDNAMES)
+_json_encoding = json.JSONEncoder(ensure_ascii=False).encode
+_json_decoding = json.JSONDecoder().decode
+# A book's JSON Lines object, with the keys already written: only the 10 values are encoded, each by itself. It's
+# what json.dumps(..., ensure_ascii=False) writes, without walking a dictionary.
+JSON_LINE = "{" + ", ".join(json.dumps(field) + ": %s" for field in FIELDNAMES) + "}\n"
+
+
+def serializable_value(value):
+    """ The product description is stored as windows-1252 bytes by the extractors. JSON and SQLite want text.
+    """
+    if isinstance(value, bytes):
+        # most descriptions are plain ASCII, which decodes several times faster.
+        if value.isascii():
+            return value.decode("ascii")
+        return value.decode("windows-1252", errors="replace")
+    return value
+
+
+class BookRecord(Mapping):
+    """ The 10 required information of a book, read like a dictionary.
+    """
+
+    __slots__ = tuple(FIELDNAMES) + ("missing",)
+
+    def __init__(self, *values, missing=0):
+        """
+
+        Args:
+            values: the 10 information, in the order of FIELDNAMES. The missing ones are None.
+            missing: the FIELD_BITS of the missing information, added together.
+
+        """
+        for field, value in zip(FIELDNAMES, values):
+            object.__setattr__(self, field, value)
+        self.missing = missing
+
+    @classmethod
+    def from_mapping(cls, book_dict):
+        """
+
+        Args: book_dict: a dictionary containing the 10 required information, or a BookRecord.
+
+        Returns: the BookRecord of the book. A BookRecord is returned as is. The information absent from the dictionary
+                are stored as None; the ones equal to UNABLE_TO_SCRAP are flagged missing.
+
+        """
+        if isinstance(book_dict, cls):
+            return book_dict
+        values = []
+        missing = 0
+        for field in FIELDNAMES:
+            value = book_dict.get(field)
+            if value == UNABLE_TO_SCRAP:
+                missing |= FIELD_BITS[field]
+                value = None
+            elif field in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            values.append(value)
+        return cls(*values, missing=missing)
+
+    @classmethod
+    def from_row(cls, row):
+        """
+
+        Args: row: the 10 information in the order of FIELDNAMES, e.g. a row of the SQLite sink.
+
+        Returns: the BookRecord of the book.
+
+        """
+        return cls.from_mapping(dict(zip(FIELDNAMES, row)))
+
+    def as_row(self):
+        """
+
+        Returns: the 10 information in the order of FIELDNAMES, as text: UNABLE_TO_SCRAP for the missing ones, the
+                product description decoded (see serializable_value).
+
+        """
+        row = list(_getting_values(self))
+        if type(row[DESCRIPTION]) is bytes:
+            row[DESCRIPTION] = serializable_value(row[DESCRIPTION])
+        if self.missing:
+            for position, field in enumerate(FIELDNAMES):
+                if self.missing & FIELD_BITS[field]:
+                    row[position] = UNABLE_TO_SCRAP
+        return row
+
+    def as_dict(self):
+        """
+
+        Returns: the dictionary of the 10 information as text, the one the sinks used to write.
+
+        """
+        return dict(zip(FIELDNAMES, self.as_row()))
+
+    def is_missing(self, field):
+        return bool(self.missing & FIELD_BITS[field])
+
+    def __getitem__(self, field):
+        bit = FIELD_BITS.get(field)
+        if bit is None:
+            raise KeyError(field)
+        if self.missing & bit:
+            return UNABLE_TO_SCRAP
+        return getattr(self, field)
+
+    def __iter__(self):
+        return iter(FIELDNAMES)
+
+    def __len__(self):
+        return len(FIELDNAMES)
+
+    def __setattr__(self, name, value):
+        # a record is shared by the sinks, the checkpoint and the change tracker: only the flags are set after it's
+        # built, by __init__.
+        if name != "missing" or hasattr(self, "missing"):
+            raise AttributeError("a BookRecord can't be modified")
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # pickled by its values, e.g. on its way back from a parsing process (see parsing_pool.py).
+        return _rebuilding_record, (_getting_values(self), self.missing)
+
+    def __repr__(self):
+        return "BookRecord(" + repr(dict(self)) + ")"
+
+
+def _rebuilding_record(values, missing):
+    return BookRecord(*values, missing=missing)
+
+
+def rows_from_records(book_records):
+    """
+
+    Args: book_records: an iterable of BookRecords.
+
+    Returns: the list of their rows (see BookRecord.as_row), e.g. for sqlite3's executemany or csv.writer's writerows.
+
+    """
+    return [book_record.as_row() for book_record in book_records]
+
+
+def encoding_json_lines(book_records):
+    """ Encodes a batch of records into JSON_LINE, without a dictionary nor a JSON encoder per book.
+
+    Args: book_records: an iterable of BookRecords.
+
+    Returns: the text of their JSON Lines, one object per book, each ending with a newline. It's exactly what
+            json.dumps(book_record.as_dict(), ensure_ascii=False) gives.
+
+    """
+    lines = []
+    for row in rows_from_records(book_records):
+        try:
+            lines.append(JSON_LINE % tuple(map(encode_basestring, row)))
+        except TypeError:
+            # an information which isn't text, e.g. absent (None): the JSON encoder knows what to do.
+            lines.append(_json_encoding(dict(zip(FIELDNAMES, row))) + "\n")
+    return "".join(lines)
+
+
+def decoding_json_lines(lines):
+    """
+
+    Args: lines: an iterable of JSON Lines, e.g. an open .jsonl file written by output_sinks.JsonLinesSink.
+
+    Yields: the BookRecords of the books.
+
+    """
+    for line in lines:
+        if line.strip():
+            yield BookRecord.from_mapping(_json_decoding(line))
@@ -2,65 +2,88 @@
 
 """
 
+import argparse
+import asyncio
 import csv
 import os
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from bs4 import BeautifulSoup
+from change_tracker import extracting_if_changed, adding_crawl_state_arguments, opening_crawl_state_from_arguments
+from checkpoint import CATEGORIES, PRODUCT_PAGES
+from http_client import fetch, is_error_page, download_file, enable_disk_cache, enable_archive, disable_archive
+from image_downloader import downloading_images
+from links_and_titles_scrapper import all_categories_titles
+from metrics import measuring, adding_metrics_arguments, collecting_metrics_from_arguments
+from output_files import (remove_suffix, cleaning_titles, category_folder, category_images_folder, category_csv_path,
+                          writing_atomically, DEFAULT_BASE_DIRECTORY)
+from output_sinks import FIELDNAMES
+from parsing_pool import extracting_books_in_pool, DEFAULT_IO_WORKERS, DEFAULT_PARSE_WORKERS, DEFAULT_QUEUE_SIZE
 
-from links_and_titles_scrapper import remove_suffix, all_categories_titles
+# How many product pages the asyncio engine downloads at the same time.
+DEFAULT_CONCURRENCY = 10
 
 
-def get_lists_from_csv(csv_file_name):
+def get_lists_from_csv(csv_file_name, base_directory=DEFAULT_BASE_DIRECTORY):
     """ Creates two lists from the given csv file.
 
     Args:
         csv_file_name: the name of one of the csv files created with the book_scrapper.py module.
+        base_directory: the folder holding the category's folder.
 
     Returns: two lists. One containing the links to all the books in the category. The other containing the titles
             of all the books in the category.
 
     """
-    # saving the folder where we started the process
-    current_folder = os.getcwd()
-
-    # going to the folder containing the file we need
-    folder_name = remove_suffix(csv_file_name, '_.csv')
-    if os.path.isdir(folder_name):
-        os.chdir(folder_name)
-
-    f = open(csv_file_name, 'r', encoding="windows-1252")
-    reader = csv.DictReader(f)
-    x = []
-    for key in reader:
-        x.append(key)
-    csv_dict = x[0]
+    with open(category_csv_path(csv_file_name, base_directory), 'r', encoding="windows-1252") as f:
+        reader = csv.DictReader(f)
+        # the file holds a single row: the links, under the titles' header.
+        csv_dict = next(reader)
     links = list(csv_dict.values())
     books = list(csv_dict.keys())
-    f.close()
-
-    # returning to the folder we were in when starting the process
-    os.chdir(current_folder)
 
     return links, books
 
 
-def cleaning_titles(book):
-    """ Removes the characters forbidden by the NTFS from the string.
+def saving_book(book_dict, book, sink=None, checkpoint=None, folder="", tracker=None):
+    """ Writes the book's information in its own csv file, or in the sink if one is given.
+
+    Args:
+        book_dict: the dictionary containing the 10 required information.
+        book: the title of the book, used for the csv file name.
+        sink: one of the output_sinks.py sinks, or None.
+        checkpoint: a CheckpointManifest recording the product pages done, or None. With a sink, the manifest must
+                    follow it (see CheckpointManifest.following_sink): the page is done once its batch is written.
+        folder: the folder of the csv file. By default, the current folder.
+        tracker: a ChangeTracker recording the books written, or None. With a sink, the tracker must follow it too
+                 (see ChangeTracker.following_sink).
+
     """
+    with measuring("write"):
+        if sink is None:
+            writing_header(book_dict, os.path.join(folder, cleaning_titles(book)))
+            if checkpoint is not None:
+                checkpoint.mark_done(PRODUCT_PAGES, book_dict["product_page_url"])
+            if tracker is not None:
+                tracker.recording([book_dict])
+        else:
+            sink.write(book_dict)
+
+
+def removing_done_books(links, books, checkpoint):
+    """
+
+    Args:
+        links: the links to the books' pages.
+        books: the titles of the books, in the same order as the links.
+        checkpoint: a CheckpointManifest, or None.
+
+    Returns: the links and titles of the books whose product page isn't done yet.
 
-    if not book.startswith(' '):
-        book_csv_file_name = book.replace(' ', '_') + ".csv"
-    book_csv_file_name = book_csv_file_name.replace(':', '_')
-    book_csv_file_name = book_csv_file_name.replace('/', '-')
-    book_csv_file_name = book_csv_file_name.replace('?', '-')
-    book_csv_file_name = book_csv_file_name.replace("<", '_')
-    book_csv_file_name = book_csv_file_name.replace('"', '_')
-    book_csv_file_name = book_csv_file_name.replace('>', '_')
-    book_csv_file_name = book_csv_file_name.replace('|', '-')
-    book_csv_file_name = book_csv_file_name.replace("*", '_')
-    return book_csv_file_name
+    """
+    if checkpoint is None:
+        return links, books
+    remaining = [(link, book) for link, book in zip(links, books) if not checkpoint.is_page_done(link)]
+    return [link for link, _ in remaining], [book for _, book in remaining]
 
 
 def writing_header(ten_information, book_csv_file_name):
@@ -68,161 +91,186 @@ def writing_header(ten_information, book_csv_file_name):
 
     Args:
         ten_information: the dictionary that will be written in the file.
-        book_csv_file_name: the name of the file we will write.
+        book_csv_file_name: the path of the file we will write. It's written atomically (see writing_atomically).
     """
 
-    with open(book_csv_file_name, 'w', encoding="windows-1252") as f:
-        header = ["product_page_url",
-                  "universal_product_code",
-                  "title",
-                  "price_including_tax",
-                  "price_excluding_tax",
-                  "number_available",
-                  "category",
-                  "review_rating",
-                  "product_description",
-                  "image_url"]
-        writer = csv.DictWriter(f, delimiter='\n', fieldnames=header)
+    with writing_atomically(book_csv_file_name, encoding="windows-1252") as f:
+        writer = csv.DictWriter(f, delimiter='\n', fieldnames=FIELDNAMES)
         writer.writeheader()
         writer.writerow(ten_information)
 
 
-def writing_book_information(csv_file_name):
+def writing_book_information(csv_file_name, sink=None, checkpoint=None, base_directory=DEFAULT_BASE_DIRECTORY,
+                             tracker=None):
     """
     First, we get each of the 10 required information as a key-value pair. Then, we write
     them as a dictionary.
 
-    Args: the name of one of the csv files created with the links_and_titles_scrapper.py module.
+    Args:
+        csv_file_name: the name of one of the csv files created with the links_and_titles_scrapper.py module.
+        sink: one of the output_sinks.py sinks. If given, the books are written in it instead of one csv file each.
+        checkpoint: a CheckpointManifest. If given, the product pages already done are skipped.
+        base_directory: the folder holding the category's folder.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are neither
+                 extracted nor written again.
 
-    Returns: The csv file containing the 10 required information.
+    Returns: the dictionaries of the books scrapped. Their information are written in the csv files (or the sink).
 
     """
-    # saving the folder where we started the process
-    current_folder = os.getcwd()
-
     # specifying the folder where to write the files
-    folder_name = remove_suffix(csv_file_name, '_.csv')
-    if not os.path.isdir(folder_name):
-        os.mkdir(os.path.join(os.getcwd(), folder_name))
-    os.chdir(os.path.join(os.getcwd(), folder_name))
+    folder_name = category_folder(csv_file_name, base_directory)
 
-    links = list(get_lists_from_csv(csv_file_name))[0]
-    books = list(get_lists_from_csv(csv_file_name))[1]
+    links, books = get_lists_from_csv(csv_file_name, base_directory)
+    links, books = removing_done_books(links, books, checkpoint)
 
     if len(links) == len(books):
         n = len(links)
     else:
         print("one list is bigger than the other")
 
+    book_dicts = []
     for i in range(n):
-        # cleaning all the titles that will be used as filenames.
-        book_csv_file_name = cleaning_titles(books[i])
-
         # requesting the HTML source code we will scrap
-        product_page_url = requests.get(links[i]).text
-        book_page = BeautifulSoup(product_page_url, 'lxml')
+        response = fetch(links[i])
+        if is_error_page(links[i], response):
+            continue
+        book_dict = extracting_if_changed(links[i], books[i], response, tracker)
+        if book_dict is None:
+            continue
 
-        # Here we get the product page URL (1)
-        book_dict = {"product_page_url": links[i]}
+        saving_book(book_dict, books[i], sink, checkpoint, folder_name, tracker)
+        book_dicts.append(book_dict)
 
-        # Here we get the universal product code of the book (2)
-        try:
-            upc = book_page.find('tr').text.rstrip().lstrip()
-            book_dict["universal_product_code"] = upc
-        except AttributeError:
-            if AttributeError:
-                book_dict["universal_product_code"] = "Unable to scrap this information"
-
-        # Here we get the title (3)
-        title = books[i]
-        book_dict["title"] = title
-
-        # I create a list with the table from which I'll take four useful information.
-        # The catch-exception block is long because four information depend on the existence of the "class" tag
-        try:
-            product_table = book_page.find('table', class_="table table-striped")
-            product_table = list(product_table)
-
-            # Useful info one : the price including tax (4)
-            price_including_tax = product_table[7].text.rstrip().lstrip()
-            price_including_tax = price_including_tax[-5:]
-            book_dict["price_including_tax"] = price_including_tax
-
-            # Useful info two : the price excluding tax (5)
-            price_excluding_tax = product_table[5].text.rstrip().lstrip()
-            price_excluding_tax = price_excluding_tax[-5:]
-            book_dict["price_excluding_tax"] = price_excluding_tax
-
-            # Useful info three : the number of books available (6)
-            number_available_text = product_table[11].text.split()
-            number_available_ugly_text = number_available_text[-2]
-            number_available = "".join([i for i in number_available_ugly_text if i != "("])
-            book_dict["number_available"] = number_available
-
-            # Useful info four : the ratings (9)
-            review_rating_tag = product_table[-2].text.rstrip().lstrip()
-            book_dict['review_rating'] = review_rating_tag
-
-        except TypeError:
-            if TypeError:
-                book_dict["price_including_tax"] = "Unable to scrap this information"
-                book_dict["price_excluding_tax"] = "Unable to scrap this information"
-                book_dict["number_available"] = "Unable to scrap this information"
-                book_dict['review_rating'] = "Unable to scrap this information"
-
-        # Here we get the product description (7)
-        errors = (IndexError, AttributeError)
-        try:
-            product_description = book_page.find_all('p')
-            book_dict["product_description"] = product_description[3].encode("windows-1252")
-        except errors:
-            if errors:
-                book_dict["product_description"] = "Unable to scrap this information"
+    return book_dicts
 
-        # Here we get the category (8)
-        try:
-            category_parent = book_page.find('ul')
-            categories = category_parent.find_all('li')
-            category_parent_list = list(categories)
-            category = category_parent_list[2].text.rstrip().lstrip()
-            book_dict["category"] = category
-        except errors:
-            if errors:
-                book_dict["category"] = "Unable to scrap this information"
-
-        # Here we get the image URL (10)
+
+async def scraping_books_concurrently(links, books, concurrency=DEFAULT_CONCURRENCY, tracker=None):
+    """ Asyncio version of the loop in writing_book_information(). The product pages are downloaded concurrently.
+
+    The shared HTTP client is blocking, so the downloads run in a thread pool while the event loop keeps at most
+    'concurrency' of them in flight. The extraction itself is done on the event loop as soon as a page arrives.
+
+    Args:
+        links: the links to the books' pages.
+        books: the titles of the books, in the same order as the links.
+        concurrency: the maximum number of product pages being downloaded at the same time.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are skipped.
+
+    Yields: (title, dictionary containing the 10 required information) tuples, in the order the pages arrive.
+
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scraping_one_book(executor, link, book):
+        async with semaphore:
+            response = await loop.run_in_executor(executor, fetch, link)
+        if is_error_page(link, response):
+            return book, None
+        return book, extracting_if_changed(link, book, response, tracker)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        tasks = [asyncio.ensure_future(scraping_one_book(executor, link, book)) for link, book in zip(links, books)]
         try:
-            image_url_parent = book_page.find(class_='item active')
-            image_url_list = list(image_url_parent)
-        except TypeError:
-            print("The HTML source code of this book doesn't seem to cointain the expected 'item active' class")
-        image_url_text = image_url_list[1]
-        image_url_text = str(image_url_text)
-        # The first [].notation refers to the list item to extract while the second is splitting the string
-        image_url = image_url_text.rsplit('src="')[1][:-3]
-        # We need to add an suffix in order to get the good webpage
-        s = "http://books.toscrape.com/"
-        image_url = image_url.replace('../../', s)
-        book_dict["image_url"] = image_url
-
-        writing_header(book_dict, book_csv_file_name)
-
-    # returning to the folder we were in when starting the process
-    os.chdir(current_folder)
-
-
-def all_books_filename(csv_file_name):
+            for next_book in asyncio.as_completed(tasks):
+                book, book_dict = await next_book
+                if book_dict is not None:
+                    yield book, book_dict
+        finally:
+            # if the caller stops early we don't want to leave pending downloads behind
+            for task in tasks:
+                task.cancel()
+
+
+def writing_book_information_async(csv_file_name, concurrency=DEFAULT_CONCURRENCY, sink=None, checkpoint=None,
+                                   base_directory=DEFAULT_BASE_DIRECTORY, tracker=None):
+    """ Same output as writing_book_information(), but the product pages are requested concurrently.
+
+    writing_book_information() stays available as the synchronous fallback.
+
+    Args:
+        csv_file_name: the name of one of the csv files created with the links_and_titles_scrapper.py module.
+        concurrency: the maximum number of product pages being downloaded at the same time.
+        sink: one of the output_sinks.py sinks. If given, the books are written in it instead of one csv file each.
+        checkpoint: a CheckpointManifest. If given, the product pages already done are skipped.
+        base_directory: the folder holding the category's folder.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are neither
+                 extracted nor written again.
+
+    Returns: the dictionaries of the books scrapped. Their information are written in the csv files (or the sink).
+
+    """
+    # specifying the folder where to write the files
+    folder_name = category_folder(csv_file_name, base_directory)
+
+    links, books = get_lists_from_csv(csv_file_name, base_directory)
+    if len(links) != len(books):
+        print("one list is bigger than the other")
+    links, books = removing_done_books(links, books, checkpoint)
+
+    book_dicts = []
+
+    async def writing_all_books():
+        async for book, book_dict in scraping_books_concurrently(links, books, concurrency, tracker):
+            saving_book(book_dict, book, sink, checkpoint, folder_name, tracker)
+            book_dicts.append(book_dict)
+
+    asyncio.run(writing_all_books())
+
+    return book_dicts
+
+
+def writing_book_information_multiprocess(csv_file_name, io_workers=DEFAULT_IO_WORKERS,
+                                          parse_workers=DEFAULT_PARSE_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                                          sink=None, checkpoint=None, base_directory=DEFAULT_BASE_DIRECTORY,
+                                          tracker=None):
+    """ Same output as writing_book_information(), but the pages are downloaded in threads and parsed in processes.
+
+    Useful when the parsing, not the network, is the bottleneck: it then uses all the cores.
+
+    Args:
+        csv_file_name: the name of one of the csv files created with the links_and_titles_scrapper.py module.
+        io_workers: the number of threads downloading the pages.
+        parse_workers: the number of processes parsing the pages. None means one per core.
+        queue_size: the number of downloaded pages allowed to wait for a parsing process.
+        sink: one of the output_sinks.py sinks. If given, the books are written in it instead of one csv file each.
+        checkpoint: a CheckpointManifest. If given, the product pages already done are skipped.
+        base_directory: the folder holding the category's folder.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are neither
+                 extracted nor written again.
+
+    Returns: the dictionaries of the books scrapped. Their information are written in the csv files (or the sink).
+
+    """
+    # specifying the folder where to write the files
+    folder_name = category_folder(csv_file_name, base_directory)
+
+    links, books = get_lists_from_csv(csv_file_name, base_directory)
+    if len(links) != len(books):
+        print("one list is bigger than the other")
+    links, books = removing_done_books(links, books, checkpoint)
+
+    book_dicts = []
+    for book, book_dict in extracting_books_in_pool(links, books, io_workers, parse_workers, queue_size, tracker):
+        saving_book(book_dict, book, sink, checkpoint, folder_name, tracker)
+        book_dicts.append(book_dict)
+
+    return book_dicts
+
+
+def all_books_filename(csv_file_name, base_directory=DEFAULT_BASE_DIRECTORY):
     """
 
     Args:
         csv_file_name: a category's csv filename
+        base_directory: the folder holding the category's folder.
 
     Returns: a list storing the csv filename of all the books in the category
 
     """
 
     # Getting the list of books from the first function defined in the script
-    books = list(get_lists_from_csv(csv_file_name))[1]
+    books = get_lists_from_csv(csv_file_name, base_directory)[1]
     n = len(books)
 
     # We are creating a list of all the book csv filenames
@@ -235,62 +283,87 @@ def all_books_filename(csv_file_name):
     return books_csv_name_list
 
 
-def down_image(folder_to_read_from, image_filename, folder_to_write_to):
+def images_to_download(book_dicts, folder):
+    """
+
+    Args:
+        book_dicts: the dictionaries of the books, as returned by the writing_book_information functions.
+        folder: the folder where to store the images.
+
+    Yields: the (image URL, image file path, product page URL) tuples expected by downloading_images, as the
+            dictionaries come. The image is named after the book, like with down_image.
+
+    """
+    for book_dict in book_dicts:
+        yield (book_dict["image_url"],
+               os.path.join(folder, remove_suffix(cleaning_titles(book_dict["title"]), '.csv') + '.jpg'),
+               book_dict["product_page_url"])
+
+
+def down_image(folder_to_read_from, image_filename, folder_to_write_to, base_directory=DEFAULT_BASE_DIRECTORY):
     """
-    First, we get to the directory where the book file we are searching is saved. From that file we extract the
+    First, we find the directory where the book file we are searching is saved. From that file we extract the
     image url's needed for the download. Second, we specify the folder where we will save the image and we
     download it.
 
     Args:
         folder_to_read_from: the folder where we will find the book csv file's.
         image_filename: the book's csv filename
-        folder_to_write_to: the folder where to store the downloaded image.
+        folder_to_write_to: the folder where to store the downloaded image, inside folder_to_read_from.
+        base_directory: the folder holding folder_to_read_from.
 
     Returns: downloads the jpg image and stores it in the designated folder.
 
     """
-    # saving the folder where we started the process
-    current_folder = os.getcwd()
-
     # specifying the folder where to search the image url's
-    if os.path.isdir(folder_to_read_from):
-        os.chdir(os.path.join(os.getcwd(), folder_to_read_from))
+    read_folder = os.path.join(base_directory, folder_to_read_from)
+    if not os.path.isdir(read_folder):
+        read_folder = base_directory
 
     # Taking the image URL from the book's csv file
-    with open(image_filename, 'r') as f:
+    with open(os.path.join(read_folder, image_filename), 'r') as f:
         lines = f.readlines()
+    image_url = lines[-2]
 
-        image_url = lines[-2]
-
-        # Creating the folder where we'll store all the images then moving to it
-        if not os.path.isdir(folder_to_write_to):
-            os.mkdir(os.path.join(os.getcwd(), folder_to_write_to))
-        os.chdir(os.path.join(os.getcwd(), folder_to_write_to))
-
-        # requesting the data in bytes and creating the image
-        image_name = remove_suffix(image_filename, '.csv') + '.jpg'
-        urllib.request.urlretrieve(image_url, image_name)
+    # Creating the folder where we'll store all the images
+    write_folder = os.path.join(read_folder, folder_to_write_to)
+    os.makedirs(write_folder, exist_ok=True)
 
-    # returning to the folder we were in when starting the process
-    os.chdir(current_folder)
+    # requesting the data in bytes and creating the image
+    image_name = remove_suffix(image_filename, '.csv') + '.jpg'
+    download_file(image_url.strip(), os.path.join(write_folder, image_name))
 
 
 if __name__ == "__main__":
-    # The all_categories_title function is imported from the links_and_titles_scrapper module
-    all_csv_category_titles = all_categories_titles(
-        "http://books.toscrape.com/catalogue/category/books/crime_51/index.html")
-    all_csv_category_titles.append("Crime_.csv")
-    for csv_file in all_csv_category_titles:
-        writing_book_information(csv_file)
-
-
-    # Downloading the books' image from the website.
-    # If your computer and/or connection aren't fast enough you might need to rerun the script multiple times
-    # Each time you need to rerun it, check the number of downloaded images and use the number as an index
-    for book_category in all_csv_category_titles:
-        books_file_name = list(get_lists_from_csv(book_category))[1]
-        for book in books_file_name:
-            book = cleaning_titles(book)
-            category_folder_name = remove_suffix(book_category, '_.csv')
-            image_category = category_folder_name + "_images"
-            down_image(category_folder_name, book, image_category)
+    parser = argparse.ArgumentParser(description="Scraps the 10 required information and the image of every book.")
+    adding_crawl_state_arguments(parser)
+    parser.add_argument("--archive",
+                        help="a .warc.gz file where the pages are appended as received, to be extracted again later "
+                             "without the network (see response_archive.py)")
+    adding_metrics_arguments(parser)
+    arguments = parser.parse_args()
+
+    # The pages and images are kept in this folder between runs. On a rerun, unchanged ones only cost a
+    # '304 Not Modified'.
+    enable_disk_cache(".http_cache")
+    if arguments.archive:
+        enable_archive(arguments.archive)
+
+    # If the run crashes, rerun the script with --resume: only the unfinished work is done again.
+    image_destination = os.path.abspath(DEFAULT_BASE_DIRECTORY)
+    with collecting_metrics_from_arguments(arguments), \
+            opening_crawl_state_from_arguments(arguments, image_destination) as (checkpoint, change_tracker):
+        # The all_categories_title function is imported from the links_and_titles_scrapper module
+        all_csv_category_titles = all_categories_titles()
+        for csv_file in all_csv_category_titles:
+            if checkpoint.is_done(CATEGORIES, csv_file):
+                continue
+            # writing_book_information(csv_file) does the same work one book at a time, if you need a fallback.
+            book_dicts = writing_book_information_async(csv_file, checkpoint=checkpoint, tracker=change_tracker)
+
+            # Downloading the books' images, straight from the information we just scrapped.
+            image_folder = category_images_folder(csv_file)
+            print(csv_file, downloading_images(images_to_download(book_dicts, image_folder), checkpoint=checkpoint))
+            checkpoint.mark_done(CATEGORIES, csv_file)
+        print(change_tracker)
+    disable_archive()
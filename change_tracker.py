@@ -0,0 +1,322 @@
+""" This script holds the change tracker, used to only rewrite the books that changed since the previous run.
+
+Most product pages don't change from one day to the next. For each product page, the tracker keeps (in an index file,
+from one run to the next) a hash of the page's bytes and a hash of the information extracted from it:
+    - a page whose bytes didn't change is neither extracted nor written again,
+    - a page whose bytes changed (an advert, a timestamp...) but whose information didn't is extracted, not written.
+So a daily run costs about as much as the number of books that changed, not the size of the catalogue.
+
+When the images are downloaded in the same run (see following_checkpoint), a book is only skipped once its image is
+downloaded too, to the same destination (a folder of loose files or a packed image store): a book whose image failed,
+was cut by a crash, or went elsewhere, is written again on the next run and its image downloaded again.
+
+Each book written again is compared with the previous run: the changes of its price, availability and rating are
+appended to a compact change log, one JSON line per book, keyed by its universal product code (UPC).
+
+Ex of change log line:
+    {"upc": "a897fe39b1053632", "date": "2021-03-02", "product_page_url": "...",
+     "changes": {"price_including_tax": ["£51.77", "£49.99"]}}
+
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from checkpoint import CheckpointManifest, DEFAULT_MANIFEST, IMAGES, PRODUCT_PAGES
+from output_sinks import FIELDNAMES, serializable_value
+from product_page_extractor import extracting_book_information
+
+DEFAULT_INDEX = "content_index.jsonl"
+DEFAULT_CHANGE_LOG = "change_log.jsonl"
+
+# The information compared from one run to the next, for the change log.
+TRACKED_FIELDS = ("price_including_tax", "price_excluding_tax", "number_available", "review_rating")
+
+
+def hashing_page(content):
+    """
+
+    Args: content: the raw bytes of a product page.
+
+    Returns: the page's SHA-256 hash, as an hexadecimal string.
+
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def hashing_record(book_dict):
+    """
+
+    Args: book_dict: the dictionary containing the 10 required information of a book.
+
+    Returns: the SHA-256 hash of the 10 information, as an hexadecimal string.
+
+    """
+    values = [serializable_value(book_dict[field]) for field in FIELDNAMES]
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ChangeTracker:
+    """ The hashes of the product pages and of their information, backed by an append-only index file, and the
+    change log.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX, change_log=DEFAULT_CHANGE_LOG):
+        """
+
+        Args:
+            path: the index file, kept from one run to the next. Remove it to write every book again.
+            change_log: the file where the changes of the books written again are appended.
+
+        """
+        self.path = os.path.abspath(path)
+        self.change_log = os.path.abspath(change_log)
+        # the last entry of each product page URL, see recording().
+        self._entries = {}
+        # the hashes of the pages extracted in this run, until their book is written.
+        self._page_hashes = {}
+        self.unchanged_pages = 0
+        self.unchanged_records = 0
+        self.changed = 0
+        # the CheckpointManifest recording the images downloaded, and where they go, see following_checkpoint().
+        self._checkpoint = None
+        self._image_destination = None
+        self._lock = threading.Lock()
+        self.reading()
+        # the first run has nothing to compare with: its books aren't logged as new.
+        self._logging_new_books = bool(self._entries)
+        self.compacting()
+        self._file = open(self.path, 'a', encoding="utf-8")
+        self._change_log_file = open(self.change_log, 'a', encoding="utf-8")
+
+    def reading(self):
+        """ Loads the index's lines, the last one of each URL wins. A torn last line, left by a crash, is skipped.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._entries[entry["url"]] = entry
+
+    def compacting(self):
+        """ Rewrites the index with one line per URL. The new file replaces the old one atomically.
+        """
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w', encoding="utf-8") as f:
+            for url in sorted(self._entries):
+                f.write(json.dumps(self._entries[url], ensure_ascii=False) + "\n")
+        os.replace(temporary_path, self.path)
+
+    def is_page_unchanged(self, url, content):
+        """
+
+        Args:
+            url: the URL of a product page.
+            content: the raw bytes of the page.
+
+        Returns: True if the page has the same bytes as when its book was last written.
+
+        """
+        page_hash = hashing_page(content)
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry["page_hash"] == page_hash and self.is_image_done(entry):
+                self.unchanged_pages += 1
+                return True
+            self._page_hashes[url] = page_hash
+            return False
+
+    def is_record_unchanged(self, book_dict):
+        """
+
+        Args: book_dict: the dictionary containing the 10 required information of a book, just extracted.
+
+        Returns: True if the information are the same as when the book was last written. The page's new hash is
+                recorded then, so the page itself is skipped next time.
+
+        """
+        url = book_dict["product_page_url"]
+        record_hash = hashing_record(book_dict)
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry["record_hash"] != record_hash or not self.is_image_done(entry):
+                return False
+            self.unchanged_records += 1
+            page_hash = self._page_hashes.pop(url, None)
+            if page_hash is not None and page_hash != entry["page_hash"]:
+                self.appending([dict(entry, page_hash=page_hash)])
+            return True
+
+    def recording(self, book_dicts):
+        """ Records the books once written: their hashes go to the index, their changes to the change log.
+
+        Args: book_dicts: the dictionaries of the books written.
+
+        """
+        date = datetime.date.today().isoformat()
+        with self._lock:
+            entries = []
+            changes = []
+            for book_dict in book_dicts:
+                url = book_dict["product_page_url"]
+                entry = {"url": url,
+                         "page_hash": self._page_hashes.pop(url, None),
+                         "record_hash": hashing_record(book_dict),
+                         "upc": book_dict["universal_product_code"]}
+                entry.update((field, serializable_value(book_dict[field])) for field in TRACKED_FIELDS)
+                if self._checkpoint is not None:
+                    entry["image_destination"] = (self._image_destination if self._checkpoint.is_done(IMAGES, url)
+                                                  else None)
+                previous = self._entries.get(url)
+                if previous is not None:
+                    fields = {field: [previous.get(field), entry[field]] for field in TRACKED_FIELDS
+                              if previous.get(field) != entry[field]}
+                elif self._logging_new_books:
+                    fields = {field: [None, entry[field]] for field in TRACKED_FIELDS}
+                else:
+                    fields = {}
+                if fields:
+                    changes.append({"upc": entry["upc"], "date": date, "product_page_url": url, "changes": fields})
+                entries.append(entry)
+            self.changed += len(entries)
+            self.appending(entries)
+            if changes:
+                self._change_log_file.write("".join(json.dumps(change, ensure_ascii=False) + "\n"
+                                                    for change in changes))
+                self._change_log_file.flush()
+
+    def appending(self, entries):
+        # The caller holds the lock.
+        self._file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._file.flush()
+        for entry in entries:
+            self._entries[entry["url"]] = entry
+
+    def following_sink(self, sink):
+        """ With an output sink, a book is only recorded once its batch is written. The sink tells us when.
+
+        Args: sink: one of the output_sinks.py sinks.
+
+        """
+        sink.flush_listeners.append(self.recording)
+
+    def following_checkpoint(self, checkpoint, image_destination):
+        """ When the images are downloaded in the same run, a book is only skipped next time if its image was
+        downloaded to the same destination. The checkpoint tells us when.
+
+        Args:
+            checkpoint: the CheckpointManifest the images are marked done in.
+            image_destination: where the images go e.g. the absolute path of the base folder of the loose files, or
+                               of the packed image store's folder. An image done elsewhere counts as not done.
+
+        """
+        self._checkpoint = checkpoint
+        self._image_destination = image_destination
+        checkpoint.done_listeners.append(self.marking_images_done)
+
+    def is_image_done(self, entry):
+        """
+
+        Args: entry: the index's entry of a book.
+
+        Returns: True if the book's image was done, to the destination of this run. Always True when the images aren't
+                followed.
+
+        """
+        return self._checkpoint is None or entry.get("image_destination") == self._image_destination
+
+    def marking_images_done(self, kind, urls):
+        """ Records the images of the books as downloaded, to the destination of this run.
+
+        Args:
+            kind: the kind of work done, see checkpoint.py. Only IMAGES matters.
+            urls: the product page URLs of the books.
+
+        """
+        if kind != IMAGES:
+            return
+        with self._lock:
+            entries = [dict(self._entries[url], image_destination=self._image_destination) for url in urls
+                       if url in self._entries and not self.is_image_done(self._entries[url])]
+            if entries:
+                self.appending(entries)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._change_log_file.close()
+            self.compacting()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "written: {}, unchanged pages: {}, unchanged information: {}".format(
+            self.changed, self.unchanged_pages, self.unchanged_records)
+
+
+def extracting_if_changed(link, book, response, tracker=None):
+    """ Extracts the book's information, unless the tracker knows its page or its information didn't change.
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book.
+        response: the requests.Response of the book's page.
+        tracker: a ChangeTracker, or None to always extract.
+
+    Returns: the dictionary containing the 10 required information, or None if the book doesn't need to be written.
+
+    """
+    if tracker is not None and tracker.is_page_unchanged(link, response.content):
+        return None
+    book_dict = extracting_book_information(link, book, response.text)
+    if tracker is not None and tracker.is_record_unchanged(book_dict):
+        return None
+    return book_dict
+
+
+def adding_crawl_state_arguments(parser):
+    """ Adds the checkpoint's and the tracker's options to a script's argparse parser. See
+    opening_crawl_state_from_arguments.
+    """
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the categories, product pages and images done by the previous (crashed) run")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="the checkpoint manifest's file")
+    parser.add_argument("--index", default=DEFAULT_INDEX,
+                        help="the hashes of the books written, kept between runs: only the books that changed are "
+                             "written again. Remove the file to write every book")
+    parser.add_argument("--change-log", default=DEFAULT_CHANGE_LOG,
+                        help="file where the price, availability and rating changes are appended")
+
+
+@contextmanager
+def opening_crawl_state_from_arguments(arguments, image_destination):
+    """ Opens the checkpoint manifest and the change tracker with the options added by adding_crawl_state_arguments.
+
+    Every category, product page and image done is recorded in the manifest. If the run crashes, rerun the script
+    with --resume: only the unfinished work is done again. A product page is only skipped by --resume, and a book only
+    skipped as unchanged, once its image is done too.
+
+    Args:
+        arguments: the parsed arguments.
+        image_destination: where the images go, see ChangeTracker.following_checkpoint.
+
+    Yields: a (CheckpointManifest, ChangeTracker) tuple.
+
+    """
+    with CheckpointManifest(arguments.manifest, resume=arguments.resume) as checkpoint, \
+            ChangeTracker(arguments.index, arguments.change_log) as tracker:
+        checkpoint.page_kinds = (PRODUCT_PAGES, IMAGES)
+        tracker.following_checkpoint(checkpoint, image_destination)
+        yield checkpoint, tracker
@@ -0,0 +1,140 @@
+""" This script holds the checkpoint manifest, used to resume a crawl where it stopped.
+
+Each time a category, a product page or an image is done, one line is appended to the manifest and flushed to the
+disk. A crash can only tear the last line, which is ignored when the manifest is read back. So after a crash, the
+crawl can be rerun with --resume and only the unfinished work is done again.
+
+"""
+
+import json
+import os
+import threading
+
+# The kinds of work recorded in the manifest.
+CATEGORIES = "categories"
+PRODUCT_PAGES = "product_pages"
+IMAGES = "images"
+
+DEFAULT_MANIFEST = "checkpoint_manifest.jsonl"
+
+
+class CheckpointManifest:
+    """ The set of categories, product pages and images already done, backed by an append-only file.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST, resume=True):
+        """
+
+        Args:
+            path: the manifest's file.
+            resume: if False, the existing manifest is discarded and the crawl starts from scratch.
+
+        """
+        # kept absolute, so the path still means the same file if the caller changes the current folder.
+        self.path = os.path.abspath(path)
+        self._done = {CATEGORIES: set(), PRODUCT_PAGES: set(), IMAGES: set()}
+        # The kinds of work, keyed by product page URL, needed for a product page to be skipped. When the images are
+        # downloaded in the same run, add IMAGES: a page whose image is missing gets scrapped again.
+        self.page_kinds = (PRODUCT_PAGES,)
+        # Functions called with (kind, keys) each time new work is recorded as done, e.g. by a ChangeTracker.
+        self.done_listeners = []
+        self._lock = threading.Lock()
+        if resume:
+            self.reading()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.compacting()
+        self._file = open(self.path, 'a', encoding="utf-8")
+
+    def reading(self):
+        """ Loads the manifest's lines. A torn last line, left by a crash, is skipped.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._done.setdefault(entry["kind"], set()).add(entry["key"])
+
+    def compacting(self):
+        """ Rewrites the manifest without duplicates nor torn lines. The new file replaces the old one atomically.
+        """
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w', encoding="utf-8") as f:
+            for kind, keys in self._done.items():
+                for key in sorted(keys):
+                    f.write(json.dumps({"kind": kind, "key": key}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def is_done(self, kind, key):
+        """
+
+        Args:
+            kind: CATEGORIES, PRODUCT_PAGES or IMAGES.
+            key: what identifies the work e.g. the category's csv file name or the product page's URL.
+
+        Returns: True if this work was recorded as done.
+
+        """
+        with self._lock:
+            return key in self._done.get(kind, ())
+
+    def is_page_done(self, product_page_url):
+        """
+
+        Args: product_page_url: the URL of a book's page.
+
+        Returns: True if every kind of work in page_kinds is done for this page.
+
+        """
+        return all(self.is_done(kind, product_page_url) for kind in self.page_kinds)
+
+    def mark_done(self, kind, key):
+        """ Records the work as done, on the disk right away.
+
+        Args:
+            kind: CATEGORIES, PRODUCT_PAGES or IMAGES.
+            key: what identifies the work e.g. the category's csv file name or the product page's URL.
+
+        """
+        self.marking_many_done(kind, [key])
+
+    def marking_many_done(self, kind, keys):
+        """ Same as mark_done, for several keys written in one go.
+        """
+        with self._lock:
+            new_keys = [key for key in keys if key not in self._done.setdefault(kind, set())]
+            if not new_keys:
+                return
+            self._file.write("".join(json.dumps({"kind": kind, "key": key}) + "\n" for key in new_keys))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._done[kind].update(new_keys)
+        # called outside the lock: a listener may ask the manifest what's done.
+        for listener in self.done_listeners:
+            listener(kind, new_keys)
+
+    def following_sink(self, sink):
+        """ With an output sink, a product page is only done once its batch is written. The sink tells us when.
+
+        Args: sink: one of the output_sinks.py sinks.
+
+        """
+        sink.flush_listeners.append(
+            lambda records: self.marking_many_done(PRODUCT_PAGES, [record["product_page_url"] for record in records]))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.compacting()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
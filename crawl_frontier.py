@@ -0,0 +1,372 @@
+""" This script holds the crawl frontier: the work left to do, shared by several worker processes.
+
+The frontier is a SQLite database. Each row is one piece of work, identified by its URL:
+    - a listing page of a category (CATEGORIES): its books' pages and its next page are added to the frontier,
+    - a product page (PRODUCT_PAGES): the book's information is written, its image added to the frontier,
+    - an image (IMAGES): it's downloaded. Several books may share an image URL: the image's work is identified by its
+      URL and the path where it's written (see image_work_url), so each book gets its file.
+A URL is only ever added once (the table is the visited set), so two workers finding the same book don't scrap it
+twice.
+
+A worker doesn't take work, it leases it for a while. If the worker dies, its lease expires and the work goes back to
+another worker. The work is only marked done by the worker holding its lease, once: a worker whose lease expired (it
+was too slow) can't mark the work done again after the worker that took it over.
+
+Ex:
+    python crawl_frontier.py seed
+    python crawl_frontier.py work --processes 4
+    python crawl_frontier.py status
+
+SQLite locks the whole file while a worker leases or completes work, which is quick. The frontier is in WAL mode, so
+the workers reading it don't wait for the one writing: WAL needs the shared memory of a single host, so the frontier
+must stay on a local disk and its workers on the same machine, not on a network file system shared by several.
+
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import Process
+from urllib.parse import quote, urldefrag, urljoin
+
+from book_scrapper import saving_book, DEFAULT_CONCURRENCY
+from checkpoint import CATEGORIES, PRODUCT_PAGES, IMAGES
+from http_client import fetch, download_file, close_client
+from links_and_titles_scrapper import (requesting_page, extracting_books_from_listing, all_categories_links,
+                                       category_csv_file_name_from_name, CATALOGUE_FIRST_PAGE)
+from output_files import category_folder, DEFAULT_BASE_DIRECTORY
+from pipeline import images_to_download_by_category
+from product_page_extractor import extracting_book_information
+
+DEFAULT_FRONTIER = "crawl_frontier.sqlite"
+# Seconds a worker keeps its work before it goes back to the others.
+DEFAULT_LEASE_SECONDS = 300
+# Number of pieces of work leased at once by a worker.
+DEFAULT_BATCH_SIZE = 20
+# A piece of work failing this many times is given up (see CrawlFrontier.failing).
+MAX_ATTEMPTS = 5
+
+# The states of a piece of work.
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# The images are leased first, then the product pages, then the listing pages: the work in progress is finished
+# before more is discovered, so the frontier stays small.
+PRIORITIES = {IMAGES: 0, PRODUCT_PAGES: 1, CATEGORIES: 2}
+
+
+class CrawlFrontier:
+    """ The work of the crawl, in a SQLite database shared by the workers.
+    """
+
+    def __init__(self, path=DEFAULT_FRONTIER, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+
+        Args:
+            path: the frontier's database. It's created if needed.
+            lease_seconds: how long a worker keeps its work before it goes back to the others.
+
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # we open our own transactions (BEGIN IMMEDIATE), so two workers never lease the same work.
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        with self.transaction():
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS frontier (url TEXT PRIMARY KEY, kind TEXT, priority INTEGER, payload TEXT, "
+                "state TEXT, lease_owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, priority)")
+
+    @contextmanager
+    def transaction(self):
+        """ A 'BEGIN IMMEDIATE' transaction: it takes SQLite's write lock at once, so no other worker changes the
+        frontier between our reads and our writes. Committed when the 'with' block ends without error, rolled back
+        otherwise.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def adding(self, kind, items):
+        """ Adds the work never seen before. The URLs already in the frontier, whatever their state, are ignored.
+
+        Args:
+            kind: CATEGORIES, PRODUCT_PAGES or IMAGES.
+            items: an iterable of (URL, dictionary the worker needs to do the work) tuples.
+
+        Returns: the number of pieces of work added.
+
+        """
+        rows = [(url, kind, PRIORITIES[kind], json.dumps(payload, ensure_ascii=False), PENDING)
+                for url, payload in items]
+        with self.transaction():
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO frontier (url, kind, priority, payload, state) VALUES (?, ?, ?, ?, ?)", rows)
+            return self._connection.total_changes - before
+
+    def leasing(self, worker, count=DEFAULT_BATCH_SIZE):
+        """ Takes the pending work, and the work whose lease expired, for lease_seconds. The expired work already leased
+        MAX_ATTEMPTS times is marked failed instead: a piece of work killing its workers isn't taken forever.
+
+        Args:
+            worker: what identifies the worker e.g. 'hostname:pid'.
+            count: the maximum number of pieces of work taken.
+
+        Returns: a list of (URL, kind, payload dictionary) tuples. Empty when there's nothing to do right now.
+
+        """
+        now = time.time()
+        with self.transaction():
+            self._connection.execute(
+                "UPDATE frontier SET state = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?", (FAILED, LEASED, now, MAX_ATTEMPTS))
+            rows = self._connection.execute(
+                "SELECT url, kind, payload FROM frontier WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY priority LIMIT ?", (PENDING, LEASED, now, count)).fetchall()
+            self._connection.executemany(
+                "UPDATE frontier SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE url = ?", [(LEASED, worker, now + self.lease_seconds, url) for url, _, _ in rows])
+        return [(url, kind, json.loads(payload)) for url, kind, payload in rows]
+
+    def completing(self, url, worker):
+        """ Marks the work done, if the worker still holds its lease.
+
+        Args:
+            url: the URL of the work.
+            worker: the worker which did it.
+
+        Returns: True if the work is now marked done by this worker. False if its lease expired and another worker
+                took the work over: that one will mark it done.
+
+        """
+        with self.transaction():
+            cursor = self._connection.execute(
+                "UPDATE frontier SET state = ?, lease_expires = NULL WHERE url = ? AND state = ? AND lease_owner = ?",
+                (DONE, url, LEASED, worker))
+            return cursor.rowcount == 1
+
+    def failing(self, url, worker):
+        """ Gives the work back, to be retried by any worker. After MAX_ATTEMPTS, it's marked failed for good.
+
+        Args:
+            url: the URL of the work.
+            worker: the worker which failed it.
+
+        """
+        with self.transaction():
+            self._connection.execute(
+                "UPDATE frontier SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_owner = NULL, "
+                "lease_expires = NULL WHERE url = ? AND state = ? AND lease_owner = ?",
+                (MAX_ATTEMPTS, FAILED, PENDING, url, LEASED, worker))
+
+    def counting(self):
+        """
+
+        Returns: a dictionary giving the number of pieces of work of each (kind, state).
+
+        """
+        with self.transaction():
+            rows = self._connection.execute("SELECT kind, state, COUNT(*) FROM frontier GROUP BY kind, state")
+            return {(kind, state): count for kind, state, count in rows}
+
+    def is_finished(self):
+        """
+
+        Returns: True if there's no work pending or leased anymore.
+
+        """
+        with self.transaction():
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM frontier WHERE state IN (?, ?)", (PENDING, LEASED)).fetchone()[0] == 0
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def seeding(frontier, url=CATALOGUE_FIRST_PAGE):
+    """ Adds the first webpage of each category to the frontier.
+
+    Args:
+        frontier: a CrawlFrontier.
+        url: any listing page of the website, whose sidebar lists the categories.
+
+    Returns: the number of categories added (0 if the frontier was already seeded).
+
+    """
+    return frontier.adding(CATEGORIES, [(category_url, {}) for category_url in all_categories_links(url)])
+
+
+def crawling_listing_page(frontier, url):
+    """ Adds the books of a category's webpage, and its next webpage, to the frontier. An error page raises
+    requests.HTTPError: the work is given back to be retried, instead of the rest of the category being lost.
+    """
+    page = requesting_page(url)
+    frontier.adding(PRODUCT_PAGES, [(link, {"title": book}) for book, link in extracting_books_from_listing(page, url)])
+    next_tag = page.select_one("li.next a")
+    if next_tag is not None:
+        frontier.adding(CATEGORIES, [(urljoin(url, next_tag.get('href')), {})])
+
+
+def image_work_url(image_url, path):
+    """
+
+    Args:
+        image_url: the URL of the image.
+        path: the path of the image's file, relative to the base folder.
+
+    Returns: the URL identifying the image's work in the frontier: the path goes in the fragment, never sent to the
+            website, so the work stays a URL of the image.
+
+    """
+    return image_url + "#" + quote(path)
+
+
+def scraping_product_page(frontier, url, payload, base_directory):
+    """ Writes the book's csv file in its category's folder, and adds its image to the frontier. An error page raises
+    requests.HTTPError: no csv file is written from it.
+    """
+    book = payload["title"]
+    response = fetch(url)
+    response.raise_for_status()
+    book_dict = extracting_book_information(url, book, response.text)
+    folder = category_folder(category_csv_file_name_from_name(book_dict["category"]), base_directory)
+    saving_book(book_dict, book, folder=folder)
+    # the image's path is relative to the base folder, given to each worker.
+    frontier.adding(IMAGES, [(image_work_url(image_url, path), {"path": path})
+                             for image_url, path, _ in images_to_download_by_category([book_dict], "")])
+
+
+def downloading_image(url, payload, base_directory):
+    """ Downloads the image, unless it's already on the disk.
+
+    Args:
+        url: the URL of the image's work, see image_work_url.
+        payload: the dictionary holding the path of the image's file.
+        base_directory: the folder the path is relative to.
+
+    """
+    path = os.path.join(base_directory, payload["path"])
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    download_file(urldefrag(url).url, path)
+
+
+def doing_work(frontier, worker, url, kind, payload, base_directory):
+    """ Does one piece of work, then marks it done (or gives it back if it failed).
+
+    Every piece of work can be done twice without harm (the files are written atomically, the frontier ignores the
+    URLs already seen): if our lease expired in the meantime, the worker which took it over does the same.
+
+    Returns: True if we marked the work done.
+
+    """
+    try:
+        if kind == CATEGORIES:
+            crawling_listing_page(frontier, url)
+        elif kind == PRODUCT_PAGES:
+            scraping_product_page(frontier, url, payload, base_directory)
+        else:
+            downloading_image(url, payload, base_directory)
+    except Exception as error:
+        print("Unable to do " + url + ": " + repr(error))
+        frontier.failing(url, worker)
+        return False
+    return frontier.completing(url, worker)
+
+
+def working(frontier_path=DEFAULT_FRONTIER, base_directory=DEFAULT_BASE_DIRECTORY, concurrency=DEFAULT_CONCURRENCY,
+            lease_seconds=DEFAULT_LEASE_SECONDS, idle_seconds=1.0):
+    """ Leases work from the frontier and does it in a pool of threads, until there's no work left anywhere.
+
+    Args:
+        frontier_path: the frontier's database.
+        base_directory: the folder where the categories' folders and images are written.
+        concurrency: the number of pieces of work done at the same time.
+        lease_seconds: how long we keep our work before it goes back to the other workers.
+        idle_seconds: how long we wait before asking again, when the others still hold all the work left.
+
+    Returns: the number of pieces of work we marked done.
+
+    """
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    # A forked worker inherits the parent's pooled connections: two processes reading the same socket would mix up
+    # their answers. We start with our own.
+    close_client()
+    done = 0
+    with CrawlFrontier(frontier_path, lease_seconds) as frontier, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            work = frontier.leasing(worker, max(DEFAULT_BATCH_SIZE, 2 * concurrency))
+            if not work:
+                if frontier.is_finished():
+                    return done
+                # the others may still add work, or die and leave it to us once their lease expires.
+                time.sleep(idle_seconds)
+                continue
+            done += sum(executor.map(lambda item: doing_work(frontier, worker, *item, base_directory), work))
+
+
+def working_in_processes(processes, **options):
+    """ Starts several workers on this machine, and waits for them.
+
+    Args:
+        processes: the number of worker processes.
+        options: the arguments of working().
+
+    """
+    workers = [Process(target=working, kwargs=options) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scraps the website with workers sharing a crawl frontier.")
+    parser.add_argument("command", choices=("seed", "work", "status"),
+                        help="seed: add the categories to the frontier. work: do the work of the frontier. "
+                             "status: count the work of each kind and state")
+    parser.add_argument("--frontier", default=DEFAULT_FRONTIER, help="the frontier's SQLite database")
+    parser.add_argument("--directory", default=DEFAULT_BASE_DIRECTORY,
+                        help="folder where the categories' folders and images are written")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of pages and images downloaded at the same time by each process")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="seconds after which the work of a dead worker goes back to the others")
+    arguments = parser.parse_args()
+
+    if arguments.command == "seed":
+        with CrawlFrontier(arguments.frontier) as crawl_frontier:
+            print(seeding(crawl_frontier), "categories added")
+    elif arguments.command == "work":
+        working_in_processes(arguments.processes, frontier_path=arguments.frontier,
+                             base_directory=arguments.directory, concurrency=arguments.concurrency,
+                             lease_seconds=arguments.lease)
+    with CrawlFrontier(arguments.frontier) as crawl_frontier:
+        for (kind, state), count in sorted(crawl_frontier.counting().items()):
+            print(kind, state, count)
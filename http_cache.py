@@ -0,0 +1,195 @@
+""" This script holds the on-disk HTTP cache used to avoid downloading the whole website again at each run.
+
+Each response body is saved in its own file, named after the hash of its URL. An SQLite index keeps, for each URL, the
+ETag and Last-Modified headers sent by the server. When the page is requested again, we ask the server if it changed
+(If-None-Match/If-Modified-Since). If it didn't, the server only answers '304 Not Modified' and we read the body
+from the disk.
+
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds during which a cached response is used without asking the server. 0 means we always revalidate.
+DEFAULT_TTL = 0
+# Total size in bytes of the cached bodies. Beyond it, the least recently used responses are removed.
+DEFAULT_MAX_SIZE = 500 * 1024 * 1024
+
+# Those headers describe the body as it was sent on the network. The cached body is already decoded.
+HEADERS_NOT_TO_STORE = ("content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive")
+
+
+class DiskCache:
+    """ Response cache keyed by URL, stored in a folder.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        # kept absolute, so the path still means the same file if the caller changes the current folder.
+        self.directory = os.path.abspath(directory)
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), check_same_thread=False)
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                            url TEXT PRIMARY KEY,
+                                            filename TEXT NOT NULL,
+                                            etag TEXT,
+                                            last_modified TEXT,
+                                            headers TEXT NOT NULL,
+                                            size INTEGER NOT NULL,
+                                            stored_at REAL NOT NULL,
+                                            accessed_at REAL NOT NULL)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def lookup(self, url):
+        """
+
+        Args: url: the URL of the page.
+
+        Returns: a dictionary with the cached response's metadata, or None if the URL isn't cached.
+
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT filename, etag, last_modified, headers, stored_at FROM responses WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        filename, etag, last_modified, headers, stored_at = row
+        path = os.path.join(self.directory, filename)
+        if not os.path.isfile(path):
+            # the body was removed behind our back, the entry is useless.
+            self.remove(url)
+            return None
+        return {"url": url, "path": path, "etag": etag, "last_modified": last_modified,
+                "headers": json.loads(headers), "stored_at": stored_at}
+
+    def is_fresh(self, entry):
+        """
+
+        Args: entry: the dictionary returned by lookup().
+
+        Returns: True if the response can still be used without asking the server.
+
+        """
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def conditional_headers(self, entry):
+        """
+
+        Args: entry: the dictionary returned by lookup().
+
+        Returns: the headers asking the server to answer '304 Not Modified' if the page didn't change.
+
+        """
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read_body(self, entry):
+        """
+
+        Args: entry: the dictionary returned by lookup().
+
+        Returns: the cached body, in bytes.
+
+        """
+        with open(entry["path"], 'rb') as f:
+            body = f.read()
+        self.touch(entry["url"])
+        return body
+
+    def store(self, url, body, headers):
+        """ Saves the body of a '200 OK' response, then removes the oldest responses if the cache is too big.
+
+        Args:
+            url: the URL of the page.
+            body: the body of the response, in bytes.
+            headers: the headers of the response.
+
+        """
+        filename = hashlib.sha256(url.encode("utf-8")).hexdigest() + ".body"
+        path = os.path.join(self.directory, filename)
+        # writing to a temporary file first, so a crash never leaves a half-written body behind.
+        temporary_path = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(body)
+        os.replace(temporary_path, path)
+
+        headers_to_store = {name: value for name, value in headers.items()
+                            if name.lower() not in HEADERS_NOT_TO_STORE}
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (url, filename, headers.get("ETag"), headers.get("Last-Modified"),
+                                      json.dumps(headers_to_store), len(body), now, now))
+        self.evict()
+
+    def revalidated(self, url, headers):
+        """ The server answered '304 Not Modified': the cached response is fresh again.
+
+        Args:
+            url: the URL of the page.
+            headers: the headers of the '304 Not Modified' response. They may contain a new ETag.
+
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE responses SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), "
+                "stored_at = ?, accessed_at = ? WHERE url = ?",
+                (headers.get("ETag"), headers.get("Last-Modified"), now, now, url))
+
+    def touch(self, url):
+        """ Marks the response as recently used, so it is the last one to be evicted.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url))
+
+    def remove(self, url):
+        """ Removes the response from the index and its body from the disk.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT filename FROM responses WHERE url = ?", (url,)).fetchone()
+            self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+        if row is not None:
+            try:
+                os.remove(os.path.join(self.directory, row[0]))
+            except FileNotFoundError:
+                pass
+
+    def total_size(self):
+        """
+
+        Returns: the size in bytes of all the cached bodies.
+
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self):
+        """ Removes the least recently used responses until the cache fits in max_size.
+        """
+        excess = self.total_size() - self.max_size
+        if excess <= 0:
+            return
+        with self._lock:
+            rows = self._connection.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+        for url, size in rows:
+            if excess <= 0:
+                break
+            self.remove(url)
+            excess -= size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,392 @@
+""" This script holds the HTTP client shared by all the scrappers.
+
+Every page and image goes through a single requests.Session. The session keeps its connections alive in a pool, so
+scrapping hundreds of pages from the same website doesn't cost a new TCP/TLS handshake per page.
+
+Every request also goes through the rate limiter (see rate_limiter.py): it limits the requests in flight per host,
+adapting to how the website answers, and retries the failed ones.
+
+The pages fetched can be appended to a response archive (see enable_archive), and answered from it later instead of the
+website (see enable_replay): then no request is sent at all.
+
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from http_cache import DiskCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
+from metrics import measuring
+from rate_limiter import RateLimiter, DEFAULT_INITIAL_CONCURRENCY, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RETRIES
+from response_archive import ResponseArchive
+
+# Number of connections kept alive per host. It should be at least as big as the number of concurrent downloads.
+DEFAULT_POOL_SIZE = 20
+# Timeouts in seconds: the first one to open the connection, the second one to wait for the server's answer.
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# Size in bytes of the pieces in which the images are written to the disk.
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_timeout = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+_session_lock = threading.Lock()
+_disk_cache = None
+_archive = None
+_replay_archive = None
+_rate_limiter = RateLimiter()
+
+# Functions called after each request with (URL, seconds taken, number of bytes received). The benchmarks use them.
+request_hooks = []
+
+
+def creating_session(pool_size):
+    """
+
+    Args: pool_size: the number of connections kept alive per host.
+
+    Returns: a requests.Session using keep-alive connections and accepting compressed responses.
+
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    return session
+
+
+def configure_client(pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                     read_timeout=DEFAULT_READ_TIMEOUT):
+    """ Replaces the shared session with a new one. Call it before scrapping if the defaults don't suit you.
+
+    Args:
+        pool_size: the number of connections kept alive per host.
+        connect_timeout: seconds to wait for the connection to open.
+        read_timeout: seconds to wait for the server's answer.
+
+    """
+    global _session, _timeout
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = creating_session(pool_size)
+        _timeout = (connect_timeout, read_timeout)
+
+
+def get_session():
+    """
+
+    Returns: the shared requests.Session. It is created with the default settings on first use.
+
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = creating_session(DEFAULT_POOL_SIZE)
+    return _session
+
+
+def close_client():
+    """ Closes all the pooled connections. The next request will open a new session.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def enable_disk_cache(directory, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+    """ From now on, every page and image is saved in (and revalidated against) an on-disk cache.
+
+    Args:
+        directory: the folder where the cache is stored. It is reused from one run to the next.
+        ttl: seconds during which a cached response is used without asking the server.
+        max_size: total size in bytes of the cache. Beyond it, the least recently used responses are removed.
+
+    """
+    global _disk_cache
+    disable_disk_cache()
+    _disk_cache = DiskCache(directory, ttl, max_size)
+
+
+def enable_archive(path):
+    """ From now on, every page fetched is appended to a response archive, to be extracted again later without the
+    network (see enable_replay).
+
+    Args: path: the archive's file (see response_archive.py). An existing archive is appended to.
+
+    Returns: the ResponseArchive.
+
+    """
+    global _archive
+    disable_archive()
+    _archive = ResponseArchive(path)
+    return _archive
+
+
+def disable_archive():
+    """ Stops appending the pages to the archive, and closes it.
+    """
+    global _archive
+    if _archive is not None:
+        _archive.close()
+        _archive = None
+
+
+def enable_replay(path):
+    """ From now on, the pages are answered from a response archive instead of the website: no request is sent. A page
+    missing from the archive gets a '404 Not in the archive' response, an image download fails.
+
+    Args: path: the archive's file, written with enable_archive.
+
+    Returns: the ResponseArchive.
+
+    """
+    global _replay_archive
+    disable_replay()
+    _replay_archive = ResponseArchive(path, read_only=True)
+    return _replay_archive
+
+
+def disable_replay():
+    """ Sends the requests to the website again.
+    """
+    global _replay_archive
+    if _replay_archive is not None:
+        _replay_archive.close()
+        _replay_archive = None
+
+
+def configure_rate_limiter(initial_concurrency=DEFAULT_INITIAL_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                           max_retries=DEFAULT_MAX_RETRIES):
+    """ Replaces the rate limiter with a new one. Call it before scrapping if the defaults don't suit you.
+
+    Args:
+        initial_concurrency: the number of requests in flight per host, at the start.
+        max_concurrency: the maximum number of requests in flight per host.
+        max_retries: the number of times a failed request is retried.
+
+    """
+    global _rate_limiter
+    _rate_limiter = RateLimiter(initial_concurrency, max_concurrency, max_retries)
+
+
+def requesting(url, headers=None):
+    """ Sends a GET request through the rate limiter, with retries.
+
+    Args:
+        url: the URL to request.
+        headers: extra headers for this request.
+
+    Returns: the requests.Response, its body already downloaded.
+
+    """
+    return _rate_limiter.sending(url, lambda: get_session().get(url, timeout=_timeout, headers=headers))
+
+
+def disable_disk_cache():
+    """ Stops using the on-disk cache. The files already cached are kept.
+    """
+    global _disk_cache
+    if _disk_cache is not None:
+        _disk_cache.close()
+        _disk_cache = None
+
+
+def building_response(url, status_code, reason, headers, body):
+    """
+
+    Args:
+        url: the URL of the page.
+        status_code, reason: the HTTP status of the response e.g. 200, 'OK'.
+        headers: a dictionary of the response's headers.
+        body: the body of the page, as bytes.
+
+    Returns: a requests.Response, built without a request, so the callers can't tell the difference.
+
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = body
+    return response
+
+
+def building_cached_response(url, entry, body):
+    """
+
+    Args:
+        url: the URL of the page.
+        entry: the cache's metadata of the page.
+        body: the cached body of the page.
+
+    Returns: a requests.Response built from the cache.
+
+    """
+    return building_response(url, 200, "OK", entry["headers"], body)
+
+
+def replaying(url, archive):
+    """
+
+    Args:
+        url: the URL of the page.
+        archive: the ResponseArchive answering instead of the website.
+
+    Returns: the requests.Response of the page, as archived. '404 Not in the archive' if it isn't.
+
+    """
+    archived = archive.replaying(url)
+    if archived is None:
+        return building_response(url, 404, "Not in the archive", {}, b"")
+    return building_response(url, *archived)
+
+
+def fetching_through_cache(url, cache):
+    """ Requests the page only if the cached version is missing or outdated.
+
+    Args:
+        url: the URL of the page to request.
+        cache: the DiskCache to use.
+
+    Returns: the requests.Response of the page.
+
+    """
+    entry = cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        return building_cached_response(url, entry, cache.read_body(entry))
+
+    headers = cache.conditional_headers(entry) if entry is not None else {}
+    response = requesting(url, headers)
+    if response.status_code == 304 and entry is not None:
+        cache.revalidated(url, response.headers)
+        return building_cached_response(url, entry, cache.read_body(entry))
+    if response.status_code == 200:
+        cache.store(url, response.content, response.headers)
+    return response
+
+
+def calling_request_hooks(url, started_at, size):
+    """
+
+    Args:
+        url: the URL requested.
+        started_at: the time.perf_counter() value when the request started.
+        size: the number of bytes received.
+
+    """
+    if request_hooks:
+        elapsed = time.perf_counter() - started_at
+        for hook in request_hooks:
+            hook(url, elapsed, size)
+
+
+def fetch(url, use_disk_cache=True):
+    """
+
+    Args:
+        url: the URL of the page to request.
+        use_disk_cache: if False, the on-disk cache is neither read nor written, e.g. for the images kept elsewhere.
+
+    Returns: the requests.Response of the page.
+
+    """
+    started_at = time.perf_counter()
+    with measuring("fetch") as measure:
+        cache = _disk_cache if use_disk_cache else None
+        if _replay_archive is not None:
+            response = replaying(url, _replay_archive)
+        elif cache is not None:
+            response = fetching_through_cache(url, cache)
+        else:
+            response = requesting(url)
+        measure.size = len(response.content)
+        measure.failed = response.status_code >= 400
+    archive = _archive
+    if archive is not None and _replay_archive is None:
+        archive.recording(url, response)
+    calling_request_hooks(url, started_at, measure.size)
+    return response
+
+
+def is_error_page(url, response):
+    """ Logs the error pages (e.g. a 404, a 5xx once the retries are exhausted, or a page missing from the archive when
+    replaying), so the callers skip them instead of extracting 'Unable to scrap' information from them.
+
+    Args:
+        url: the URL of the page.
+        response: the requests.Response of the page.
+
+    Returns: True if the page is an error and must be skipped.
+
+    """
+    if response.status_code == 200:
+        return False
+    print("Unable to scrap " + url + ": " + str(response.status_code) + " " + (response.reason or ""))
+    return True
+
+
+def download_file(url, filename):
+    """ Streams the content of the URL to the disk, one chunk at a time.
+
+    The content goes to a temporary file first, renamed once complete. So if the file exists, it is complete.
+    When the on-disk cache is enabled, the file goes through it (and is written in one go) instead.
+
+    Args:
+        url: the URL of the file to download (e.g. a book's image).
+        filename: the path of the file we will write.
+
+    Returns: the SHA-256 hash of the file's content, in hexadecimal.
+
+    """
+    started_at = time.perf_counter()
+    size = 0
+    content_hash = hashlib.sha256()
+    if _replay_archive is not None:
+        raise requests.ConnectionError(url + ": no network while replaying an archive, and no image in it")
+    temporary_filename = filename + "." + str(threading.get_ident()) + ".part"
+    cache = _disk_cache
+    with measuring("image_download") as measure:
+        try:
+            if cache is not None:
+                response = fetching_through_cache(url, cache)
+                response.raise_for_status()
+                content_hash.update(response.content)
+                size = len(response.content)
+                with open(temporary_filename, 'wb') as f:
+                    f.write(response.content)
+            else:
+                def streaming_to_file():
+                    # a retry starts the file and the hash over.
+                    nonlocal content_hash, size
+                    content_hash = hashlib.sha256()
+                    size = 0
+                    with get_session().get(url, timeout=_timeout, stream=True) as response:
+                        if response.status_code == 200:
+                            with open(temporary_filename, 'wb') as f:
+                                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                                    content_hash.update(chunk)
+                                    f.write(chunk)
+                                    size += len(chunk)
+                    return response
+
+                _rate_limiter.sending(url, streaming_to_file).raise_for_status()
+            os.replace(temporary_filename, filename)
+        finally:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+        measure.size = size
+    calling_request_hooks(url, started_at, size)
+    return content_hash.hexdigest()
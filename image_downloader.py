@@ -0,0 +1,129 @@
+""" This script downloads the books' images concurrently, straight from the scrapped information.
+
+The images are streamed to the disk by a bounded pool of threads. An image is never downloaded twice:
+    - the files already on the disk are skipped (they are only renamed to their final name once complete),
+    - several books sharing the same image URL get a single download, the other files are links to it,
+    - two different URLs giving the same bytes (same SHA-256 hash) end up as links to a single file.
+
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import IMAGES
+from http_client import download_file
+from memory_limit import waiting_for_room
+
+# Number of images downloaded at the same time.
+DEFAULT_MAX_WORKERS = 10
+
+
+def linking_file(existing_path, new_path):
+    """ Makes new_path point to the content of existing_path, with a hard link when the file system allows it.
+    """
+    try:
+        os.link(existing_path, new_path)
+    except OSError:
+        shutil.copyfile(existing_path, new_path)
+
+
+class ImageDownloadStats:
+    """ What downloading_images did, for the logs.
+    """
+
+    def __init__(self):
+        self.downloaded = 0
+        self.skipped = 0
+        self.linked = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def adding(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def __repr__(self):
+        return "downloaded: {}, skipped (already on the disk): {}, linked (duplicates): {}, failed: {}".format(
+            self.downloaded, self.skipped, self.linked, self.failed)
+
+
+def downloading_images(images, max_workers=DEFAULT_MAX_WORKERS, checkpoint=None):
+    """ Downloads the images concurrently, skipping and deduplicating them as explained above.
+
+    The images are read from the iterable as the downloads go, so it can be a generator fed by the scrapping: at
+    most a few images per thread are waiting at any time.
+
+    Args:
+        images: an iterable of (image URL, path of the file to write, product page URL) tuples.
+        max_workers: the number of images downloaded at the same time.
+        checkpoint: a CheckpointManifest. If given, each product page whose image is on the disk is marked done.
+
+    Returns: an ImageDownloadStats.
+
+    """
+    stats = ImageDownloadStats()
+    path_by_hash = {}
+    hashes_lock = threading.Lock()
+    # The first download of each URL. Its result is the path of the file holding the image, None if it failed.
+    downloads = {}
+
+    def making_folder(path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def downloading_one_url(image_url, path, product_page_url):
+        if os.path.exists(path):
+            stats.adding(skipped=1)
+        else:
+            making_folder(path)
+            try:
+                content_hash = download_file(image_url, path)
+            except Exception as error:
+                print("Unable to download " + image_url + ": " + repr(error))
+                stats.adding(failed=1)
+                return None
+            stats.adding(downloaded=1)
+            with hashes_lock:
+                same_content = path_by_hash.setdefault(content_hash, path)
+            if same_content != path:
+                os.remove(path)
+                linking_file(same_content, path)
+                stats.adding(linked=1)
+        if checkpoint is not None:
+            checkpoint.mark_done(IMAGES, product_page_url)
+        return path
+
+    def linking_to_download(download, path, product_page_url):
+        # The download was submitted before us, so a thread already works on it: we never wait for long.
+        source = download.result()
+        if source is None:
+            stats.adding(failed=1)
+            return
+        if source != path:
+            if os.path.exists(path):
+                stats.adding(skipped=1)
+            else:
+                making_folder(path)
+                linking_file(source, path)
+                stats.adding(linked=1)
+        if checkpoint is not None:
+            checkpoint.mark_done(IMAGES, product_page_url)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for image_url, path, product_page_url in images:
+            if image_url in downloads:
+                pending.add(executor.submit(linking_to_download, downloads[image_url], path, product_page_url))
+            else:
+                downloads[image_url] = executor.submit(downloading_one_url, image_url, path, product_page_url)
+                pending.add(downloads[image_url])
+            done, pending = waiting_for_room(pending, 4 * max_workers)
+            for future in done:
+                future.result()
+        for future in pending:
+            future.result()
+    return stats
@@ -0,0 +1,335 @@
+""" This script holds the packed image store: the books' images appended to a few big files, instead of one file each.
+
+A thousand small JPEGs cost a thousand inodes, and their names (the books' titles) can collide. The store instead
+appends the images' bytes to segment files (segment-00000.pack, segment-00001.pack...) and keeps an index, in a SQLite
+database, of where each image is:
+    - blobs: the SHA-256 hash of an image's bytes -> its segment, offset and length. The same bytes are stored once.
+    - images: the image's URL and the book's UPC -> the path of the loose file it replaces, and the hash of its bytes.
+      Several books can share the same image URL: each one gets its row, and its loose file when exported.
+
+The bytes are appended and flushed before their index row is committed: after a crash, the bytes without an index row
+are cut off the segment when the store is opened again. The images are read through mmap, without being copied.
+When the loose files are needed (e.g. to look at them), exporting() writes them back, where down_image would have.
+The images are downloaded without the on-disk cache of http_client.py: they would each be a loose file there again.
+
+A store has a single writing process at a time. Several threads can write to it.
+
+Ex:
+    python pipeline.py --image-store images.pack
+    python image_store.py export images.pack --directory .
+
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import IMAGES
+from http_client import fetch
+from image_downloader import ImageDownloadStats, DEFAULT_MAX_WORKERS
+from links_and_titles_scrapper import category_csv_file_name_from_name
+from memory_limit import waiting_for_room
+from metrics import measuring
+from output_files import category_images_folder, cleaning_titles, remove_suffix, DEFAULT_BASE_DIRECTORY
+
+# A new segment file is started once the current one reaches this size in bytes.
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+SEGMENT_NAME = "segment-{:05d}.pack"
+INDEX_NAME = "index.sqlite"
+
+
+class PackedImageStore:
+    """ The images, appended to segment files and indexed by URL, UPC and hash of their bytes.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        """
+
+        Args:
+            directory: the folder holding the segments and the index. It's created if needed.
+            segment_size: the size in bytes beyond which a new segment file is started.
+
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(directory, INDEX_NAME), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, segment INTEGER, offset INTEGER, "
+                "length INTEGER)")
+            self.creating_images_table()
+        self._lock = threading.Lock()
+        # segment number -> mmap of the segment, remapped when the segment has grown since.
+        self._maps = {}
+        self._segment, end = self._connection.execute(
+            "SELECT COALESCE(MAX(segment), 0), COALESCE(MAX(offset + length), 0) FROM blobs "
+            "WHERE segment = (SELECT MAX(segment) FROM blobs)").fetchone()
+        self._file = open(self.segment_path(self._segment), 'ab')
+        # the bytes appended after the last committed index row belong to no image: a crash left them.
+        self._file.truncate(end)
+        self._file.seek(end)
+
+    def creating_images_table(self):
+        """ Creates the images' index, keyed by URL and UPC. The caller holds a transaction.
+
+        A store written when the index was keyed by URL only is moved to the new index. A book without UPC gets ''.
+        """
+        upc_key = self._connection.execute("SELECT pk FROM pragma_table_info('images') WHERE name = 'upc'").fetchone()
+        if upc_key == (0,):
+            self._connection.execute("ALTER TABLE images RENAME TO images_by_url")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS images (url TEXT, upc TEXT, path TEXT, hash TEXT, PRIMARY KEY (url, upc))")
+        if upc_key == (0,):
+            self._connection.execute(
+                "INSERT INTO images SELECT url, COALESCE(upc, ''), path, hash FROM images_by_url")
+            self._connection.execute("DROP TABLE images_by_url")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS images_upc ON images (upc)")
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+    def adding(self, content, url, upc=None, path=None):
+        """ Stores the image, unless the same bytes are already stored, and indexes it.
+
+        Args:
+            content: the image's bytes.
+            url: the image's URL.
+            upc: the universal product code of the book, or None.
+            path: the path of the loose file, relative to the base folder, used by exporting(). None means no path.
+
+        Returns: True if the bytes were appended, False if the same bytes were already stored.
+
+        """
+        upc = upc or ""
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            stored = self._connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            appended = stored is None
+            with self._connection:
+                if appended:
+                    if self._file.tell() > 0 and self._file.tell() + len(content) > self.segment_size:
+                        self._file.close()
+                        self._segment += 1
+                        self._file = open(self.segment_path(self._segment), 'ab')
+                    offset = self._file.tell()
+                    self._file.write(content)
+                    self._file.flush()
+                    self._connection.execute("INSERT INTO blobs (hash, segment, offset, length) VALUES (?, ?, ?, ?)",
+                                             (content_hash, self._segment, offset, len(content)))
+                self._connection.execute("INSERT OR REPLACE INTO images (url, upc, path, hash) VALUES (?, ?, ?, ?)",
+                                         (url, upc, path, content_hash))
+        return appended
+
+    def has(self, url, upc=None):
+        """
+
+        Args:
+            url: the image's URL.
+            upc: the universal product code of the book, or None for any book.
+
+        Returns: True if the image of this URL is stored, for this book.
+
+        """
+        with self._lock:
+            if upc is None:
+                return self._connection.execute("SELECT 1 FROM images WHERE url = ?", (url,)).fetchone() is not None
+            return self._connection.execute("SELECT 1 FROM images WHERE url = ? AND upc = ?",
+                                            (url, upc)).fetchone() is not None
+
+    def sharing(self, url, upc=None, path=None):
+        """ Indexes the image of another book with the same URL for this book too, without downloading it again.
+
+        Args:
+            url: the image's URL.
+            upc: the universal product code of the book, or None.
+            path: the path of the book's loose file, relative to the base folder, or None.
+
+        Returns: True if the URL's image was stored for another book, and now for this one. False otherwise.
+
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR REPLACE INTO images (url, upc, path, hash) "
+                "SELECT url, ?, ?, hash FROM images WHERE url = ? LIMIT 1", (upc or "", path, url))
+            return cursor.rowcount == 1
+
+    def locating(self, url=None, upc=None):
+        """
+
+        Args: url or upc: the image's URL, or the universal product code of its book.
+
+        Returns: the (segment, offset, length, hash) of the image's bytes, or None if it isn't stored.
+
+        """
+        column, key = ("url", url) if url is not None else ("upc", upc)
+        with self._lock:
+            return self._connection.execute(
+                "SELECT blobs.segment, blobs.offset, blobs.length, blobs.hash FROM images JOIN blobs "
+                "ON images.hash = blobs.hash WHERE images." + column + " = ? LIMIT 1", (key,)).fetchone()
+
+    def mapping(self, segment, end):
+        """
+
+        Returns: a mmap of the segment, covering at least its 'end' first bytes.
+
+        """
+        with self._lock:
+            segment_map = self._maps.get(segment)
+            if segment_map is None or len(segment_map) < end:
+                # the old map isn't closed: the memoryviews given before may still use it. It goes once they're gone.
+                with open(self.segment_path(segment), 'rb') as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = segment_map
+            return segment_map
+
+    def reading(self, url=None, upc=None):
+        """ Reads the image without copying its bytes: the memoryview points into the segment's mmap.
+
+        Args: url or upc: the image's URL, or the universal product code of its book.
+
+        Returns: a memoryview of the image's bytes, or None if it isn't stored. Use bytes() on it to get a copy.
+
+        """
+        location = self.locating(url, upc)
+        if location is None:
+            return None
+        segment, offset, length, _ = location
+        return memoryview(self.mapping(segment, offset + length))[offset:offset + length]
+
+    def exporting(self, base_directory=DEFAULT_BASE_DIRECTORY):
+        """ Writes each image with a path back to a loose file, where down_image would have. The existing files are
+        kept.
+
+        Args: base_directory: the folder the images' paths are relative to.
+
+        Returns: the number of files written.
+
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT images.path, blobs.segment, blobs.offset, blobs.length FROM images JOIN blobs "
+                "ON images.hash = blobs.hash WHERE images.path IS NOT NULL").fetchall()
+        written = 0
+        for path, segment, offset, length in rows:
+            path = os.path.join(base_directory, path)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            temporary_path = path + ".part"
+            with open(temporary_path, 'wb') as f:
+                f.write(memoryview(self.mapping(segment, offset + length))[offset:offset + length])
+            os.replace(temporary_path, path)
+            written += 1
+        return written
+
+    def counting(self):
+        """
+
+        Returns: a (number of images, number of distinct images, total bytes stored) tuple.
+
+        """
+        with self._lock:
+            images = self._connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            blobs, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+        return images, blobs, size
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._connection.close()
+            self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def images_to_store(book_dicts):
+    """
+
+    Args: book_dicts: the dictionaries of the books, as returned by the writing_book_information functions.
+
+    Yields: (image URL, UPC, path of the loose file relative to the base folder, product page URL) tuples, as the
+            dictionaries come. The path is the one down_image would use, in the book's category's images folder.
+
+    """
+    for book_dict in book_dicts:
+        folder = category_images_folder(category_csv_file_name_from_name(book_dict["category"]), "")
+        yield (book_dict["image_url"],
+               book_dict["universal_product_code"],
+               os.path.join(folder, remove_suffix(cleaning_titles(book_dict["title"]), '.csv') + '.jpg'),
+               book_dict["product_page_url"])
+
+
+def storing_images(images, store, max_workers=DEFAULT_MAX_WORKERS, checkpoint=None):
+    """ Same as image_downloader.downloading_images, the images going to the packed store instead of loose files.
+
+    Args:
+        images: an iterable of (image URL, UPC, path relative to the base folder, product page URL) tuples, e.g.
+                images_to_store().
+        store: a PackedImageStore.
+        max_workers: the number of images downloaded at the same time.
+        checkpoint: a CheckpointManifest. If given, each product page whose image is stored is marked done.
+
+    Returns: an ImageDownloadStats. The images already stored for their book are 'skipped'. The ones whose URL or
+            bytes were already stored for another book are 'linked'.
+
+    """
+    stats = ImageDownloadStats()
+
+    def storing_one_image(image_url, upc, path, product_page_url):
+        if store.has(image_url, upc or ""):
+            stats.adding(skipped=1)
+        elif store.sharing(image_url, upc, path):
+            stats.adding(linked=1)
+        else:
+            try:
+                with measuring("image_download") as measure:
+                    # the store replaces the loose files: the disk cache mustn't write each image as one again.
+                    response = fetch(image_url, use_disk_cache=False)
+                    response.raise_for_status()
+                    measure.size = len(response.content)
+            except Exception as error:
+                print("Unable to download " + image_url + ": " + repr(error))
+                stats.adding(failed=1)
+                return
+            if store.adding(response.content, image_url, upc, path):
+                stats.adding(downloaded=1)
+            else:
+                stats.adding(linked=1)
+        if checkpoint is not None:
+            checkpoint.mark_done(IMAGES, product_page_url)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for image in images:
+            pending.add(executor.submit(storing_one_image, *image))
+            done, pending = waiting_for_room(pending, 4 * max_workers)
+            for future in done:
+                future.result()
+        for future in pending:
+            future.result()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exports or describes a packed image store.")
+    parser.add_argument("command", choices=("export", "stats"),
+                        help="export: write the images back to loose files. stats: count the images stored")
+    parser.add_argument("store", help="the store's folder")
+    parser.add_argument("--directory", default=DEFAULT_BASE_DIRECTORY,
+                        help="folder where the categories' images folders are written by export")
+    arguments = parser.parse_args()
+
+    with PackedImageStore(arguments.store) as image_store:
+        if arguments.command == "export":
+            print(image_store.exporting(arguments.directory), "files written")
+        print("images: {}, distinct images: {}, bytes stored: {}".format(*image_store.counting()))
@@ -7,53 +7,87 @@ CSV file.
 
 import csv
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urljoin
 
 import requests
 from bs4 import BeautifulSoup
 
+from http_client import fetch, enable_disk_cache
+from memory_limit import is_memory_exceeded, memory_releasers
+from metrics import measuring
+from output_files import remove_suffix, category_folder, writing_atomically, DEFAULT_BASE_DIRECTORY
+from request_cache import coalescing_lru_cache
 
-def remove_suffix(input_string, suffix):
-    """ Equivalent of the 3.9 Python removesuffix string method (this script is written in the 3.8 version).
-    """
-    if suffix and input_string.endswith(suffix):
-        return input_string[:-len(suffix)]
-    return input_string
+# How many listing pages the fan-out discovery mode requests at the same time.
+DEFAULT_MAX_WORKERS = 8
+# The first page of the catalogue: it lists the books of every category, and links to all the categories.
+CATALOGUE_FIRST_PAGE = "http://books.toscrape.com/catalogue/page-1.html"
 
 
+@coalescing_lru_cache()
 def requesting_page(url):
-    """
+    """ Each page is requested and parsed only once per run, the following calls get the cached page. An error page
+    (after the retries) raises requests.HTTPError instead: it's neither parsed nor cached, the next call requests it
+    again.
 
     Args: URL to the page.
 
-    Returns: the HTML source code. 'page' is an instance of bs4.BeautifulSoup class.
+    Returns: the HTML source code. 'page' is an instance of bs4.BeautifulSoup class. It is shared between the
+            callers, don't modify it.
 
     """
-    response = requests.get(url)
-    page = BeautifulSoup(response.content, features='lxml')
+    response = fetch(url)
+    response.raise_for_status()
+    with measuring("parse") as measure:
+        measure.size = len(response.content)
+        page = BeautifulSoup(response.content, features='lxml')
     return page
 
 
-def get_titles(url):
+# Up to DEFAULT_MAXSIZE parsed pages are kept: above the memory ceiling, they're dropped first.
+memory_releasers.append(requesting_page.cache_clear)
+
+
+def extracting_books_from_listing(page, page_url):
+    """ Reads the books of a category's webpage in a single pass over its 'product_pod' articles.
+
+    Args:
+        page: The HTML source code of the webpage. 'page' is an instance of bs4.BeautifulSoup class.
+        page_url: The URL of the webpage, used to complete the abbreviated links.
+
+    Returns: (title, link) tuples, one per book, in the order of the webpage. The links are absolute.
+
+    """
+    books = []
+    # each article holds the book's image and its title, both linking to the book. The title's link is enough.
+    for title_tag in page.select("article.product_pod h3 a"):
+        books.append((title_tag.get('title', title_tag.text), urljoin(page_url, title_tag.get('href'))))
+    return books
+
+
+def listing_books(url):
     """
 
     Args: The URL to a book category's webpage.
 
-    Returns: The titles of all the books in the category.
+    Returns: (title, link) tuples for all the books in the webpage (see extracting_books_from_listing).
 
     """
+    return extracting_books_from_listing(requesting_page(url), url)
 
-    page = requesting_page(url)
 
-    # to get all the book titles in the first page, we search for the title attributes.
-    content = page.find_all('a')
-    all_titles_in_first_page = []
-    for link in content:
-        all_titles_in_first_page.append(link.get('title', 'No title attribute'))
+def get_titles(url):
+    """
 
-    # the previous list contains a tags w/o title attributes, we need to remove them.
-    all_titles_in_first_page = [i for i in all_titles_in_first_page if i != 'No title attribute']
+    Args: The URL to a book category's webpage.
 
-    return all_titles_in_first_page
+    Returns: The titles of all the books in the webpage.
+
+    """
+    return [title for title, _ in listing_books(url)]
 
 
 def get_links(url):
@@ -73,28 +107,15 @@ def get_links(url):
 
 
 def cleaning_links(url):
-    """Takes abbreviated links as they're referenced in the HTML source code and returns their explicit version.
+    """
 
     Args: The URL to a book category's webpage.
 
     Returns: The links to all the books from the webpage ready to use.
 
     """
-    all_links_raw_format = get_links(url)
-
-    # The first 54 links refer to the homepage or the book categories.
-    books_in_first_page_raw_format = all_links_raw_format[54:]
-
-    # In the HTML source code the links are abbreviated, that's why we use the replace method to get the full links.
-    prefix_to_url = 'http://books.toscrape.com/catalogue/'
-    books_in_first_page_good_format = [i.replace('../../../', prefix_to_url) for i in books_in_first_page_raw_format]
-
-    # There's two links per book in the HTML source code. We therefore need to remove the doubles.
-    almost_clean_list = books_in_first_page_good_format[:-1]
-    links_in_first_page_clean_list = []
-    [links_in_first_page_clean_list.append(i) for i in almost_clean_list if i not in links_in_first_page_clean_list]
-
-    return links_in_first_page_clean_list
+    links, _ = completing_lists(listing_books(url), [], [], set())
+    return links
 
 
 def getting_next_page_link(prefix, page):
@@ -114,38 +135,25 @@ def getting_next_page_link(prefix, page):
     return link_to_next_page
 
 
-def completing_list_w_links(prefix, list_w_links, content):
-    """Gets the links to the books contained in the other webpages contained in the category.
-
-    This function need to be nested in the right function. It appends to an already existing list of links. It also
-    presuppose that the page've been already scrapped in order to have all the a tags from the HTML source code.
+def completing_lists(books, list_w_links, list_w_titles, seen_links):
+    """Appends the books of a webpage to the lists of links and titles, skipping the links already seen.
 
     Args:
-        prefix: to complete the abbreviated links scrapped from the HTML source code.
-        list_w_links: The links in the first webpage of the book category.
-        content: instance of the class bs4.BeautifulSoup. An iterable containing all the a tags.
+        books: (title, link) tuples, as returned by extracting_books_from_listing.
+        list_w_links: The links already collected in the category.
+        list_w_titles: The titles already collected, in the same order as the links.
+        seen_links: The set of the links already collected. Checking a set takes the same time whatever its size,
+                    a list would be read from the start for each book.
 
-    Returns: The useful links to the books contained in the webpage.
+    Returns: the two lists, completed.
 
     """
-    next_page_links_raw_format = [link.get('href').replace('../../../', prefix) for link in content][54:-2]
-    [list_w_links.append(link) for link in next_page_links_raw_format if link not in list_w_links]
-
-
-def completing_list_w_titles(list_w_titles, content):
-    """Similarly to completing_list_w_links, this function needs to be nested in the right function.
-
-    Args:
-        list_w_titles: The links from which to extract the titles.
-        content: instance of the class bs4.BeautifulSoup. An iterable containing all the a tags.
-
-    Returns: The titles to the books contained in the webpage.
-
-    """
-    for link in content:
-        list_w_titles.append(link.get('title', 'No title attribute'))
-    list_w_titles = [i for i in list_w_titles if i != 'No title attribute']
-    return list_w_titles
+    for title, link in books:
+        if link not in seen_links:
+            seen_links.add(link)
+            list_w_links.append(link)
+            list_w_titles.append(title)
+    return list_w_links, list_w_titles
 
 
 def next_pages_links_and_titles(url):
@@ -167,22 +175,22 @@ def next_pages_links_and_titles(url):
     # at each iteration.
     second_page_links = []
     all_titles_in_second_page = []
+    seen_in_second_pages = set()
 
     next_page_links = []
     all_titles_in_next_pages = []
+    seen_in_next_pages = set()
 
     books = "just to get this variable assigned before the while loop. I use it to end the loop when needed"
     while books is not None:
         if page.find(class_="next") is not None:
             # What follows is getting me the page number two (or other even number) HTML source code.
             link_to_second_page = getting_next_page_link(prefix_for_next_pages_links, page)
-            response = requests.get(link_to_second_page)
-            second_page = BeautifulSoup(response.content, features='lxml')
-            content = second_page.find_all('a')
+            second_page = requesting_page(link_to_second_page)
 
             # The following gets me the the page number two (or other even number) links and titles.
-            completing_list_w_links(prefix_for_next_pages_links, second_page_links, content)
-            all_titles_in_second_page = completing_list_w_titles(all_titles_in_second_page, content)
+            completing_lists(extracting_books_from_listing(second_page, link_to_second_page), second_page_links,
+                             all_titles_in_second_page, seen_in_second_pages)
 
             # What's above solves the problem for even nr pages i.e. 2, 4, 6...
             # What's below ensures I get the titles and links for odd nr pages i.e. 3, 5, 7...
@@ -191,13 +199,10 @@ def next_pages_links_and_titles(url):
                 # I split the linkToNextPage string into a 3-item list then reconstruct the right link.
                 link_to_next_page = getting_next_page_link(prefix_for_next_pages_links, second_page)
                 # getting the HTML source codes.
-                response = requests.get(link_to_next_page)
-                next_page = BeautifulSoup(response.content, features='lxml')
-                content = next_page.find_all('a')
-                # getting the links.
-                completing_list_w_links(prefix_for_next_pages_links, next_page_links, content)
-                # getting the titles
-                all_titles_in_next_pages = completing_list_w_titles(all_titles_in_next_pages, content)
+                next_page = requesting_page(link_to_next_page)
+                # getting the links and the titles.
+                completing_lists(extracting_books_from_listing(next_page, link_to_next_page), next_page_links,
+                                 all_titles_in_next_pages, seen_in_next_pages)
                 # Vital lines for the while loop:
                 page = next_page
             # The two else statements are necessary :
@@ -210,22 +215,82 @@ def next_pages_links_and_titles(url):
     return second_page_links, all_titles_in_second_page, next_page_links, all_titles_in_next_pages
 
 
-def put_together_the_dict(url):
+def getting_number_of_pages(page):
+    """ Reads the total number of webpages in the category from the pager ("Page 1 of N").
+
+    Args: page: The HTML source code of one of the category's webpages.
+
+    Returns: The number of webpages in the category. Categories with a single webpage don't have a pager, hence 1.
+
     """
+    current_page_tag = page.find(class_="current")
+    if current_page_tag is None:
+        return 1
+    return int(current_page_tag.text.split()[-1])
 
-    Args: the URL of the page to scrap.
+
+def fan_out_pages_links_and_titles(url, max_workers=DEFAULT_MAX_WORKERS):
+    """Same output as next_pages_links_and_titles, but the webpages are requested in parallel.
+
+    Instead of following the "next" link one webpage at a time, we read the number of webpages from the first one
+    and request all the others at once.
+
+    Args:
+        url: the URL of the page to scrap.
+        max_workers: the maximum number of webpages requested at the same time.
+
+    Returns: the same four lists as next_pages_links_and_titles.
+
+    """
+    page = requesting_page(url)
+    # Same WARNING as in next_pages_links_and_titles: this works only for the url ending w/'index'.
+    prefix_for_next_pages_links = remove_suffix(url, "/index.html")
+    number_of_pages = getting_number_of_pages(page)
+    links_to_next_pages = [prefix_for_next_pages_links + "/page-" + str(i) + ".html"
+                           for i in range(2, number_of_pages + 1)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        next_pages = list(executor.map(requesting_page, links_to_next_pages))
+
+    second_page_links = []
+    all_titles_in_second_page = []
+    seen_in_second_pages = set()
+    next_page_links = []
+    all_titles_in_next_pages = []
+    seen_in_next_pages = set()
+
+    # executor.map keeps the order of the webpages, so the lists are filled exactly like in the while loop:
+    # even nr pages i.e. 2, 4, 6... in the first two lists, odd nr pages i.e. 3, 5, 7... in the last two.
+    for page_number, (link_to_next_page, next_page) in enumerate(zip(links_to_next_pages, next_pages), start=2):
+        books = extracting_books_from_listing(next_page, link_to_next_page)
+        if page_number % 2 == 0:
+            completing_lists(books, second_page_links, all_titles_in_second_page, seen_in_second_pages)
+        else:
+            completing_lists(books, next_page_links, all_titles_in_next_pages, seen_in_next_pages)
+
+    return second_page_links, all_titles_in_second_page, next_page_links, all_titles_in_next_pages
+
+
+def put_together_the_dict(url, fan_out=False):
+    """
+
+    Args:
+        url: the URL of the page to scrap.
+        fan_out: if True, the category's webpages are requested in parallel (see fan_out_pages_links_and_titles).
 
     Returns: the header and the dictionnary we will write to the csv file. The dictionnary contains the
             links and titles of all the books in the category.
 
     """
     # collecting all the relevant data.
-    first_page_links = cleaning_links(url)
-    first_page_titles = get_titles(url)
-    even_nr_pages_links = next_pages_links_and_titles(url)[0]
-    even_nr_pages_titles = next_pages_links_and_titles(url)[1]
-    odd_nr_pages_links = next_pages_links_and_titles(url)[2]
-    odd_nr_pages_titles = next_pages_links_and_titles(url)[3]
+    if fan_out:
+        next_pages_links_and_titles_function = fan_out_pages_links_and_titles
+    else:
+        next_pages_links_and_titles_function = next_pages_links_and_titles
+    # the first webpage is parsed once, for both its links and its titles.
+    first_page_links, first_page_titles = completing_lists(listing_books(url), [], [], set())
+    even_nr_pages_links, even_nr_pages_titles, odd_nr_pages_links, odd_nr_pages_titles = \
+        next_pages_links_and_titles_function(url)
 
     # getting the header of the csv file together. The csv file will be written in the next function.
     first_page_titles.extend(even_nr_pages_titles)
@@ -244,85 +309,130 @@ def put_together_the_dict(url):
     return header, all_books_dict
 
 
-def writing_titles_and_links_to_file(url):
+def category_csv_file_name(url):
     """
 
-    Args: The URL of the page to scrap.
+    Args: The URL of a book category's first webpage e.g. '.../category/books/mystery_3/index.html'.
 
-    Returns: The csv file where the titles and links of all the books in the category will be stored.
+    Returns: The name of the category's csv file e.g. 'Mystery_.csv'. Without the '_.csv' suffix, it's the name of the
+            category's folder.
 
     """
-    # saving the folder where we started the process
-    current_folder = os.getcwd()
-
-    # create the csv file title
     csv_file_name = url.split('/')[-2].title()
     suffix = ".csv"
-    csv_file_name = ''.join([i for i in csv_file_name if not i.isdigit()]) + suffix
+    return ''.join([i for i in csv_file_name if not i.isdigit()]) + suffix
 
-    # getting the header and the dict from the previous function
-    header = put_together_the_dict(url)[0]
-    all_books_dict = put_together_the_dict(url)[1]
 
-    # making the category folder where we will store the books csv file'
-    folder_name = remove_suffix(csv_file_name, '_.csv')
-    if not os.path.isdir(folder_name):
-        os.mkdir(os.path.join(os.getcwd(), folder_name))
-    os.chdir(os.path.join(os.getcwd(), folder_name))
+def category_csv_file_name_from_name(category):
+    """
+
+    Args: The name of a category as written on a product page e.g. 'Historical Fiction'.
 
-    # writing the csv file
-    with open(csv_file_name, 'w', encoding="windows-1252") as f:
+    Returns: The same csv file name as category_csv_file_name gives from the category's URL e.g.
+            'Historical-Fiction_.csv'.
+
+    """
+    return category.lower().replace(' ', '-').title() + "_.csv"
+
+
+def writing_titles_and_links_to_file(url, fan_out=False, base_directory=DEFAULT_BASE_DIRECTORY):
+    """
+
+    Args:
+        url: The URL of the page to scrap.
+        fan_out: if True, the category's webpages are requested in parallel (see fan_out_pages_links_and_titles).
+        base_directory: The folder where the category's folder is created. The current folder is never changed, so
+                        several categories can be written at the same time.
+
+    Returns: The csv file where the titles and links of all the books in the category will be stored.
+
+    """
+    # create the csv file title
+    csv_file_name = category_csv_file_name(url)
+
+    # getting the header and the dict from the previous function
+    header, all_books_dict = put_together_the_dict(url, fan_out)
+
+    # writing the csv file in the category folder, where we will store the books csv files too.
+    csv_path = os.path.join(category_folder(csv_file_name, base_directory), csv_file_name)
+    with writing_atomically(csv_path, encoding="windows-1252") as f:
         writer = csv.DictWriter(f, delimiter=',', fieldnames=header)
         writer.writeheader()
         writer.writerow(all_books_dict)
 
-    # returning to the folder we were in when starting the process
-    os.chdir(current_folder)
 
-# The following is used for test purposes.
+def all_categories_links(url=CATALOGUE_FIRST_PAGE):
+    """ Gets all the categories' link from the website, in the sidebar shown on every webpage.
 
+    Args: The URL from which to scrap the links. Any webpage with the sidebar works, e.g. the catalogue's first one
+        or a category's one.
 
-def all_categories_links(url):
-    """ Gets all the categories' link from the website.
-    Use the crime category (the last one) URL's as input. The source code of a category doesn't have the auto-ref.
-    Therefore, a loop using the below function will stop at the category which URL was used.
+    Returns: list with the link to all the categories of the site.
 
-    Args: The URL from which to scrap the links.
-        (ideally : https://books.toscrape.com/catalogue/category/books/crime_51/index.html)
+    """
+    page = requesting_page(url)
+    # the links are relative to the webpage. On a category's webpage, its own link is just 'index.html'.
+    return [urljoin(url, link.get('href')) for link in page.select("div.side_categories ul li ul li a")]
 
-    Returns: list with the link to all the categories of the site (except the crime category).
 
+def all_categories_titles(url=CATALOGUE_FIRST_PAGE):
     """
-    all_links = get_links(url)
-    all_categories_raw_format = all_links[4:54]
-    prefix = "http://books.toscrape.com/catalogue/category/books/"
-    all_categories = [i.replace("../", prefix) for i in all_categories_raw_format]
-    all_categories.remove("index.html")
-    return all_categories
 
+    Args: The URL from which to scrap the links (see all_categories_links).
+
+    Returns: All the csv file names e.g. 'Travel_.csv', one per category.
 
-def all_categories_titles(url):
     """
-    WARNING : To avoid a bug I removed the last item (the inexistent auto-ref to the URL's in the HTML code)
-    Consequently, in order to obtain the full list :
-    1-use the last category's URL. 2-manually add the last category's csv file name
+    return [category_csv_file_name(link) for link in all_categories_links(url)]
+
+
+def discovering_whole_catalogue(url=CATALOGUE_FIRST_PAGE, max_workers=DEFAULT_MAX_WORKERS):
+    """ Lists every book of the website from the catalogue's pages (catalogue/page-N.html), 20 books each, instead of
+    crawling the 50 categories one by one.
 
-    Args: The URL from which to scrap the links.
-        (ideally : https://books.toscrape.com/catalogue/category/books/crime_51/index.html)
+    The first page gives the number of pages, then the other pages are requested in parallel, a few pages ahead of
+    the books read: when the following stages are slower, the parsed pages don't pile up in memory. While the memory
+    is above the ceiling (see memory_limit.py), the pages are requested one at a time. The category of each book isn't
+    known here: it's read from its product page. A page answered with an error (e.g. missing from the archive when
+    replaying) is logged and skipped, the other pages don't depend on it.
+
+    Args:
+        url: the URL of the catalogue's first page.
+        max_workers: the maximum number of pages requested at the same time.
 
-    Returns: All the csv file names (except 'Crime_.csv')
+    Yields: (title, link) tuples, page after page, in the order of the catalogue.
 
     """
-    list_all_categories_links = all_categories_links(url)
-    all_categories_csv_file_name = []
-    for link in list_all_categories_links[:-1]:
-        all_categories_csv_file_name.append(
-            "".join([i for i in link.split('/')[-2] if not i.isdigit()]).title() + ".csv")
-    return all_categories_csv_file_name
+    try:
+        first_page = requesting_page(url)
+    except requests.HTTPError as error:
+        # without it, the number of pages isn't known.
+        print("Unable to scrap " + url + ": " + str(error))
+        return
+    for book in extracting_books_from_listing(first_page, url):
+        yield book
+    links_to_next_pages = (urljoin(url, "page-" + str(i) + ".html")
+                           for i in range(2, getting_number_of_pages(first_page) + 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the pages requested, in order. Each page read is replaced by the next ones to request.
+        pending = deque((link, executor.submit(requesting_page, link))
+                        for link in islice(links_to_next_pages, 2 * max_workers))
+        while pending:
+            link_to_next_page, next_page = pending.popleft()
+            try:
+                books = extracting_books_from_listing(next_page.result(), link_to_next_page)
+            except requests.HTTPError as error:
+                print("Unable to scrap " + link_to_next_page + ": " + str(error))
+                books = []
+            window = 1 if is_memory_exceeded() else 2 * max_workers
+            pending.extend((link, executor.submit(requesting_page, link))
+                           for link in islice(links_to_next_pages, max(0, window - len(pending))))
+            for book in books:
+                yield book
 
 
 if __name__ == '__main__':
-    all_categories_links = all_categories_links("https://books.toscrape.com/catalogue/category/books/crime_51/index.html")
-    all_categories_links.append("https://books.toscrape.com/catalogue/category/books/crime_51/index.html")
-    for category_link in all_categories_links:
-        writing_titles_and_links_to_file(category_link)
+    # The pages are kept in this folder between runs. On a rerun, unchanged pages only cost a '304 Not Modified'.
+    enable_disk_cache(".http_cache")
+    for category_link in all_categories_links():
+        writing_titles_and_links_to_file(category_link, fan_out=True)
@@ -0,0 +1,146 @@
+""" This script holds the memory ceiling of the bounded-memory mode.
+
+Between two stages of the pipeline, a bounded number of items waits (backpressure). That keeps the memory flat in
+most runs, but a stage holding big items (parsed pages, images...) can still push the process' memory too high. With
+a ceiling, the stages stop taking new work while the resident memory (RSS) of the process is above it: they first
+wait for the work in progress to finish, and its memory to be released. The caches registered in memory_releasers are
+emptied too.
+
+The RSS is read from /proc/self/statm, so the ceiling only works on Linux. Elsewhere, is_memory_exceeded() is always
+False.
+
+Ex:
+    set_memory_ceiling(512 * 1024 * 1024)
+    scraping_catalogue(...)
+
+"""
+
+import gc
+import os
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Seconds during which an RSS reading is reused: reading it for every item would cost more than the items.
+DEFAULT_CHECK_INTERVAL = 0.05
+# Minimum seconds between two full garbage collections, when the ceiling is exceeded. A collection costs a lot more
+# than the reading of the RSS.
+GC_INTERVAL = 1.0
+
+_ceiling = None
+
+# Functions called without arguments when the ceiling is exceeded, before the garbage collection. They drop what can
+# be computed again, e.g. the cache of the parsed pages (see links_and_titles_scrapper.requesting_page).
+memory_releasers = []
+
+
+def current_rss():
+    """
+
+    Returns: the resident memory of the process in bytes, or None if it can't be read on this system.
+
+    """
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryCeiling:
+    """ The maximum resident memory of the process, checked at most every check_interval seconds.
+    """
+
+    def __init__(self, max_bytes, check_interval=DEFAULT_CHECK_INTERVAL):
+        """
+
+        Args:
+            max_bytes: the resident memory above which the stages stop taking new work.
+            check_interval: seconds during which an RSS reading is reused.
+
+        """
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        # how many times the ceiling was found exceeded, for the logs.
+        self.throttled = 0
+        self._checked_at = 0.0
+        self._collected_at = 0.0
+        self._exceeded = False
+        self._lock = threading.Lock()
+
+    def is_exceeded(self):
+        """
+
+        Returns: True if the resident memory is above the ceiling, even once the garbage collector ran (at most every
+                GC_INTERVAL seconds).
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self.check_interval:
+                return self._exceeded
+            self._checked_at = now
+            rss = current_rss()
+            if rss is not None and rss > self.max_bytes and now - self._collected_at >= GC_INTERVAL:
+                self._collected_at = now
+                for releasing in memory_releasers:
+                    releasing()
+                # the parse trees are full of reference cycles: only the garbage collector frees them.
+                gc.collect()
+                rss = current_rss()
+            self._exceeded = rss is not None and rss > self.max_bytes
+            if self._exceeded:
+                self.throttled += 1
+            return self._exceeded
+
+
+def set_memory_ceiling(max_bytes, check_interval=DEFAULT_CHECK_INTERVAL):
+    """ From now on, the stages stop taking new work while the resident memory is above max_bytes.
+
+    Args:
+        max_bytes: the ceiling in bytes, or None to remove it.
+        check_interval: seconds during which an RSS reading is reused.
+
+    """
+    global _ceiling
+    _ceiling = MemoryCeiling(max_bytes, check_interval) if max_bytes is not None else None
+
+
+def get_memory_ceiling():
+    """
+
+    Returns: the current MemoryCeiling, or None.
+
+    """
+    return _ceiling
+
+
+def is_memory_exceeded():
+    """
+
+    Returns: True if there's a ceiling and the resident memory is above it. Costs next to nothing without a ceiling.
+
+    """
+    ceiling = _ceiling
+    return ceiling is not None and ceiling.is_exceeded()
+
+
+def waiting_for_room(pending, max_pending):
+    """ Backpressure: the stages stop reading their input while too many items are waiting for a thread, or while
+    the memory is above the ceiling. Then we wait for at least one of the pending futures to finish.
+
+    Args:
+        pending: the set of the futures submitted and not finished yet.
+        max_pending: the number of pending futures from which we wait.
+
+    Returns: a (done, pending) tuple of sets, like concurrent.futures.wait. done is empty when there was room.
+
+    Ex:
+        done, pending = waiting_for_room(pending, 2 * concurrency)
+        for future in done:
+            ...
+
+    """
+    if len(pending) >= max_pending or is_memory_exceeded():
+        return wait(pending, return_when=FIRST_COMPLETED)
+    return set(), pending
@@ -0,0 +1,392 @@
+""" This script measures where a run spends its time: network, parsing, extraction, writing or images.
+
+The scrappers wrap each step in measuring(stage). When the metrics are enabled, each stage records its count, its
+errors, the bytes it handled and a histogram of its durations. When they're not, measuring() costs next to nothing.
+
+The stages are:
+    - fetch: a page requested through http_client.fetch (cached or not),
+    - parse: an HTML page turned into a tree (BeautifulSoup or lxml),
+    - extract: the 10 required information taken from a product page, its parse included,
+    - write: a book written to its csv file or to a sink,
+    - image_download: an image streamed to the disk.
+With writing_book_information_multiprocess, the parse and extract stages run in other processes: they aren't
+recorded, only the fetch and write ones are.
+
+The results can be written as a JSON summary at the end of a run, and as a Prometheus textfile (for the node exporter's
+textfile collector) every few seconds during a long run. A stage can also be profiled with cProfile: one .prof file
+per stage, to read with pstats or snakeviz.
+
+Ex:
+    with collecting_metrics(json_path="metrics.json", textfile_path="scrapper.prom", profile_stages=("extract",)):
+        scraping_categories(...)
+
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from output_files import writing_atomically
+
+STAGES = ("fetch", "parse", "extract", "write", "image_download")
+
+# Upper bounds in seconds of the histogram's buckets. The last bucket, +Inf, holds the slower ones.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds between two writes of the Prometheus textfile.
+DEFAULT_EXPORT_INTERVAL = 15.0
+DEFAULT_PROFILE_DIRECTORY = "profiles"
+
+_metrics = None
+
+
+class Measure:
+    """ What a measured block can tell about itself: the bytes it handled and whether it failed.
+    """
+
+    __slots__ = ("size", "failed")
+
+    def __init__(self):
+        self.size = 0
+        self.failed = False
+
+
+# Given to the blocks when the metrics are disabled. Whatever they write in it is ignored.
+_NOT_MEASURED = Measure()
+
+
+class StageMetrics:
+    """ The count, errors, bytes and duration histogram of one stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # one counter per bucket of LATENCY_BUCKETS, plus the +Inf one. They aren't cumulative.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def recording(self, seconds, size, failed):
+        self.count += 1
+        self.seconds += seconds
+        self.bytes += size
+        if failed:
+            self.errors += 1
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+
+    def quantile(self, fraction):
+        """
+
+        Args: fraction: e.g. 0.99 for the 99th percentile.
+
+        Returns: the estimated duration in seconds, interpolated within its bucket like Prometheus'
+                histogram_quantile does. None if nothing was recorded.
+
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(LATENCY_BUCKETS):
+                    # nothing better to say about the +Inf bucket than its lower bound.
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                return lower + (LATENCY_BUCKETS[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self):
+        return {"count": self.count,
+                "errors": self.errors,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "mean_seconds": self.seconds / self.count if self.count else None,
+                "p50_seconds": self.quantile(0.5),
+                "p90_seconds": self.quantile(0.9),
+                "p99_seconds": self.quantile(0.99),
+                "histogram": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets))}
+
+
+class Metrics:
+    """ The metrics of every stage, shared by all the threads.
+    """
+
+    def __init__(self, profile_stages=()):
+        """
+
+        Args: profile_stages: the stages to profile with cProfile.
+
+        """
+        self.started_at = time.time()
+        self.stages = {stage: StageMetrics() for stage in STAGES}
+        self.profile_stages = set(profile_stages)
+        # one profiler per stage and thread: a cProfile.Profile can only follow its own thread.
+        self._profilers = {}
+        self._thread_profilers = threading.local()
+        # the profiler running in each thread: only one can. On 3.11 and below, enabling a second one silently
+        # replaces the first, and disabling it stops the first too.
+        self._running_profiler = threading.local()
+        self._lock = threading.Lock()
+
+    def recording(self, stage, seconds, size=0, failed=False):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageMetrics()
+            self.stages[stage].recording(seconds, size, failed)
+
+    def profiler(self, stage):
+        """
+
+        Returns: this thread's cProfile.Profile for the stage.
+
+        """
+        profilers = self._thread_profilers.__dict__
+        if stage not in profilers:
+            profilers[stage] = cProfile.Profile()
+            with self._lock:
+                self._profilers.setdefault(stage, []).append(profilers[stage])
+        return profilers[stage]
+
+    def starting_profiler(self, stage):
+        """ Enables this thread's profiler for the stage, unless another profiler already runs in this thread (e.g. a
+        measured stage within a profiled one): the outer one keeps running and the stage's time is counted in it.
+
+        Returns: the cProfile.Profile enabled, to give to stopping_profiler(), or None if none was.
+
+        """
+        if stage not in self.profile_stages or getattr(self._running_profiler, "profiler", None) is not None:
+            return None
+        profiler = self.profiler(stage)
+        try:
+            profiler.enable()
+        except ValueError:
+            # a profiler we don't know of runs in this thread, e.g. python -m cProfile on 3.12 and above.
+            return None
+        self._running_profiler.profiler = profiler
+        return profiler
+
+    def stopping_profiler(self, profiler):
+        """
+
+        Args: profiler: the value returned by starting_profiler().
+
+        """
+        if profiler is not None:
+            profiler.disable()
+            self._running_profiler.profiler = None
+
+    def summary(self):
+        """
+
+        Returns: a dictionary ready to be written in JSON: the run's duration and each stage's summary.
+
+        """
+        with self._lock:
+            return {"started_at": self.started_at,
+                    "elapsed_seconds": time.time() - self.started_at,
+                    "stages": {stage: stage_metrics.summary() for stage, stage_metrics in self.stages.items()}}
+
+    def writing_json_summary(self, path):
+        with writing_atomically(path) as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def writing_prometheus_textfile(self, path):
+        """ Writes the metrics in Prometheus' text format. The file is replaced atomically, as the textfile collector
+        requires.
+        """
+        lines = ["# HELP scrapper_stage_total Number of operations of the stage.",
+                 "# TYPE scrapper_stage_total counter",
+                 "# HELP scrapper_stage_errors_total Number of failed operations of the stage.",
+                 "# TYPE scrapper_stage_errors_total counter",
+                 "# HELP scrapper_stage_bytes_total Number of bytes handled by the stage.",
+                 "# TYPE scrapper_stage_bytes_total counter",
+                 "# HELP scrapper_stage_seconds Duration of the stage's operations.",
+                 "# TYPE scrapper_stage_seconds histogram"]
+        with self._lock:
+            for stage, stage_metrics in self.stages.items():
+                label = 'stage="' + stage + '"'
+                lines.append("scrapper_stage_total{" + label + "} " + str(stage_metrics.count))
+                lines.append("scrapper_stage_errors_total{" + label + "} " + str(stage_metrics.errors))
+                lines.append("scrapper_stage_bytes_total{" + label + "} " + str(stage_metrics.bytes))
+                cumulative = 0
+                for bound, bucket_count in zip([repr(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                                               stage_metrics.buckets):
+                    cumulative += bucket_count
+                    lines.append("scrapper_stage_seconds_bucket{" + label + ',le="' + bound + '"} ' + str(cumulative))
+                lines.append("scrapper_stage_seconds_sum{" + label + "} " + repr(stage_metrics.seconds))
+                lines.append("scrapper_stage_seconds_count{" + label + "} " + str(stage_metrics.count))
+        with writing_atomically(path) as f:
+            f.write("\n".join(lines) + "\n")
+
+    def writing_profiles(self, directory=DEFAULT_PROFILE_DIRECTORY):
+        """ Writes one <stage>.prof file per profiled stage, merging the profiles of all the threads.
+
+        Returns: the paths of the files written.
+
+        """
+        paths = []
+        with self._lock:
+            profilers = {stage: list(stage_profilers) for stage, stage_profilers in self._profilers.items()}
+        for stage, stage_profilers in profilers.items():
+            stats = None
+            for profiler in stage_profilers:
+                profiler.create_stats()
+                if not profiler.stats:
+                    continue
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            if stats is not None:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, stage + ".prof")
+                stats.dump_stats(path)
+                paths.append(path)
+        return paths
+
+
+def enable_metrics(profile_stages=()):
+    """ Starts recording the metrics, from scratch.
+
+    Args: profile_stages: the stages to profile with cProfile.
+
+    Returns: the Metrics being recorded.
+
+    """
+    global _metrics
+    _metrics = Metrics(profile_stages)
+    return _metrics
+
+
+def disable_metrics():
+    """ Stops recording the metrics.
+    """
+    global _metrics
+    _metrics = None
+
+
+def get_metrics():
+    """
+
+    Returns: the Metrics being recorded, or None if they're disabled.
+
+    """
+    return _metrics
+
+
+@contextmanager
+def measuring(stage):
+    """ Measures the 'with' block as one operation of the stage. A block raising an exception counts as an error.
+
+    Ex:
+        with measuring("fetch") as measure:
+            response = ...
+            measure.size = len(response.content)
+
+    Args: stage: one of STAGES.
+
+    """
+    metrics = _metrics
+    if metrics is None:
+        yield _NOT_MEASURED
+        return
+    measure = Measure()
+    profiler = metrics.starting_profiler(stage)
+    started_at = time.perf_counter()
+    try:
+        yield measure
+    except BaseException:
+        measure.failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started_at
+        metrics.stopping_profiler(profiler)
+        metrics.recording(stage, seconds, measure.size, measure.failed)
+
+
+class TextfileExporter(threading.Thread):
+    """ Writes the Prometheus textfile every few seconds, in the background, until stopped.
+    """
+
+    def __init__(self, metrics, path, interval=DEFAULT_EXPORT_INTERVAL):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.metrics.writing_prometheus_textfile(self.path)
+
+    def stopping(self):
+        """ Stops the thread, and writes the textfile one last time.
+        """
+        self._stop_event.set()
+        self.join()
+        self.metrics.writing_prometheus_textfile(self.path)
+
+
+@contextmanager
+def collecting_metrics(json_path=None, textfile_path=None, interval=DEFAULT_EXPORT_INTERVAL, profile_stages=(),
+                       profile_directory=DEFAULT_PROFILE_DIRECTORY):
+    """ Records the metrics during the 'with' block, and writes them where asked.
+
+    Args:
+        json_path: the file of the JSON summary, written when the block ends. None for no summary.
+        textfile_path: the Prometheus textfile, written every 'interval' seconds. None for no textfile.
+        interval: the seconds between two writes of the textfile.
+        profile_stages: the stages to profile with cProfile. Their .prof files go to profile_directory.
+        profile_directory: the folder of the .prof files.
+
+    Yields: the Metrics being recorded.
+
+    """
+    metrics = enable_metrics(profile_stages)
+    exporter = None
+    if textfile_path:
+        exporter = TextfileExporter(metrics, textfile_path, interval)
+        exporter.start()
+    try:
+        yield metrics
+    finally:
+        disable_metrics()
+        if exporter is not None:
+            exporter.stopping()
+        if json_path:
+            metrics.writing_json_summary(json_path)
+        if profile_stages:
+            metrics.writing_profiles(profile_directory)
+
+
+def adding_metrics_arguments(parser):
+    """ Adds the metrics' options to a script's argparse parser. See collecting_metrics_from_arguments.
+    """
+    parser.add_argument("--metrics", help="file where to write the JSON summary of the metrics, at the end of the run")
+    parser.add_argument("--prometheus", help="Prometheus textfile where to write the metrics during the run")
+    parser.add_argument("--prometheus-interval", type=float, default=DEFAULT_EXPORT_INTERVAL,
+                        help="seconds between two writes of the Prometheus textfile")
+    parser.add_argument("--profile", nargs="+", choices=STAGES, default=[],
+                        help="stages to profile with cProfile, one .prof file each")
+    parser.add_argument("--profile-directory", default=DEFAULT_PROFILE_DIRECTORY, help="folder of the .prof files")
+
+
+@contextmanager
+def collecting_metrics_from_arguments(arguments):
+    """ collecting_metrics with the options added by adding_metrics_arguments. Without any of them, it does nothing.
+    """
+    if not (arguments.metrics or arguments.prometheus or arguments.profile):
+        yield None
+        return
+    with collecting_metrics(arguments.metrics, arguments.prometheus, arguments.prometheus_interval,
+                            arguments.profile, arguments.profile_directory) as metrics:
+        yield metrics
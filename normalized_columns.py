@@ -0,0 +1,321 @@
+""" This script turns blocks of scrapped books into typed columns, for analytics.
+
+The extractors give each information as a string, the way it reads on the website: '51.77' for a price, '22' for the
+number available, the product description as windows-1252 bytes of its HTML tag. Instead of cleaning each book one by
+one, a block of books is turned into columns, and each column is converted in one go:
+    - the prices become floats (NaN when missing),
+    - the number available becomes an int (-1 when missing),
+    - the rating becomes an enum code: its number of stars ('Three' -> 3, see RATINGS), -1 when missing,
+    - the description becomes plain UTF-8 text, without its HTML tag and entities.
+The numbers are stored in array.array columns: compact, typed, and shared without copy with NumPy (numpy.frombuffer).
+
+The columns can be exported as a NumPy structured array, an Arrow table or a Parquet file when numpy or pyarrow are
+installed, and as a column-oriented JSON file otherwise.
+
+Ex:
+    python normalized_columns.py books.jsonl --parquet books.parquet
+
+"""
+
+import argparse
+import html
+import json
+import math
+import re
+from array import array
+from itertools import islice, repeat
+
+try:
+    import numpy
+except ImportError:
+    # only needed by to_numpy_structured_array and writing_npy.
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # only needed by to_arrow_table and writing_parquet.
+    pyarrow = None
+
+from output_sinks import FIELDNAMES
+
+UNKNOWN = -1
+
+# The ratings, as the extractors read them in the class of the stars. A rating's code is its number of stars.
+RATINGS = ("One", "Two", "Three", "Four", "Five")
+RATING_CODES = {name: code for code, name in enumerate(RATINGS, 1)}
+
+# The typed columns, with their array.array type code. The other columns are text.
+FLOAT_COLUMNS = ("price_including_tax", "price_excluding_tax")
+INT_COLUMNS = {"number_available": 'l'}
+
+# Number of books converted together.
+DEFAULT_BLOCK_SIZE = 1000
+
+# Everything but the digits and the decimal point goes, except the separator of the joined column.
+SEPARATOR = "\x1e"
+NUMBER_CHARACTERS = "0123456789." + SEPARATOR
+PARAGRAPH_TAG = re.compile(r"^\s*<p[^>]*>|</p>\s*$")
+
+
+class _KeepingOnly(dict):
+    """ A str.translate table deleting every character but the given ones.
+    """
+
+    def __init__(self, kept):
+        super().__init__((ord(character), character) for character in kept)
+
+    def __missing__(self, code):
+        return None
+
+
+_numbers_only = _KeepingOnly(NUMBER_CHARACTERS)
+
+
+def numbers_in_column(values):
+    """ Keeps only the digits and decimal points of each value, for the whole column at once: the values are joined,
+    translated and split again, without a Python loop over them.
+
+    Args: values: a list of strings.
+
+    Returns: the list of the cleaned strings e.g. ['51.77', '', '22'].
+
+    """
+    return SEPARATOR.join(values).translate(_numbers_only).split(SEPARATOR)
+
+
+def float_column(values):
+    """
+
+    Args: values: the raw prices of the block e.g. ['51.77', '1,051.77', 'Unable to scrap this information'].
+
+    Returns: an array of floats, NaN for the values which aren't a number.
+
+    """
+    numbers = numbers_in_column(values)
+    try:
+        return array('d', map(float, numbers))
+    except ValueError:
+        # a value without digits, or with several points: only then we go value by value.
+        return array('d', (float_or_nan(number) for number in numbers))
+
+
+def float_or_nan(number):
+    try:
+        return float(number)
+    except ValueError:
+        return math.nan
+
+
+def int_column(values, type_code='l'):
+    """
+
+    Args:
+        values: the raw numbers available of the block e.g. ['22', 'Unable to scrap this information'].
+        type_code: the array.array type code of the column.
+
+    Returns: an array of ints, -1 for the values which aren't a number.
+
+    """
+    numbers = numbers_in_column(values)
+    try:
+        return array(type_code, map(int, numbers))
+    except ValueError:
+        return array(type_code, (int(number) if number.isdigit() else UNKNOWN for number in numbers))
+
+
+def rating_column(values):
+    """
+
+    Args: values: the raw ratings of the block e.g. ['Three', 'Unable to scrap this information'].
+
+    Returns: an array of signed bytes: the codes of the ratings (see RATINGS), -1 if unknown.
+
+    """
+    return array('b', map(RATING_CODES.get, values, repeat(UNKNOWN, len(values))))
+
+
+def text_column(values):
+    """
+
+    Args: values: raw descriptions of the block, as windows-1252 bytes (the extractors) or text (the sinks).
+
+    Returns: the descriptions as text, without their paragraph tag and HTML entities.
+
+    """
+    texts = [value.decode("windows-1252", errors="replace") if isinstance(value, bytes) else value
+             for value in values]
+    return [html.unescape(PARAGRAPH_TAG.sub("", text)) for text in texts]
+
+
+def normalizing_block(book_dicts):
+    """ Turns a block of books into typed columns.
+
+    Args: book_dicts: a list of dictionaries containing the 10 required information.
+
+    Returns: a dictionary of columns, by information name, in the order of FIELDNAMES. The prices are array('d'),
+            the number available array('l'), the rating array('b') (see RATINGS), the other columns lists of str.
+
+    """
+    columns = {}
+    for field in FIELDNAMES:
+        values = [book_dict.get(field) for book_dict in book_dicts]
+        if field == "product_description":
+            columns[field] = text_column(["" if value is None else value for value in values])
+            continue
+        values = ["" if value is None else str(value) for value in values]
+        if field in FLOAT_COLUMNS:
+            columns[field] = float_column(values)
+        elif field == "review_rating":
+            columns[field] = rating_column(values)
+        elif field in INT_COLUMNS:
+            columns[field] = int_column(values, INT_COLUMNS[field])
+        else:
+            columns[field] = values
+    return columns
+
+
+def normalizing_books(book_dicts, block_size=DEFAULT_BLOCK_SIZE):
+    """ The batch stage: reads the books by blocks and turns each block into typed columns.
+
+    Args:
+        book_dicts: an iterable of dictionaries containing the 10 required information, e.g. a sink's records.
+        block_size: the number of books converted together.
+
+    Yields: the dictionaries of columns (see normalizing_block), one per block.
+
+    """
+    book_dicts = iter(book_dicts)
+    while True:
+        block = list(islice(book_dicts, block_size))
+        if not block:
+            return
+        yield normalizing_block(block)
+
+
+def concatenating_blocks(blocks):
+    """
+
+    Args: blocks: an iterable of dictionaries of columns, e.g. normalizing_books().
+
+    Returns: a single dictionary of columns holding all the blocks, one after the other.
+
+    """
+    columns = None
+    for block in blocks:
+        if columns is None:
+            columns = block
+        else:
+            for field, column in block.items():
+                columns[field].extend(column)
+    return columns if columns is not None else normalizing_block([])
+
+
+def to_numpy_structured_array(columns):
+    """
+
+    Args: columns: a dictionary of columns (see normalizing_block).
+
+    Returns: a numpy structured array, one record per book. The numbers are copied from the arrays without a
+            Python loop, the text columns become fixed-width unicode fields.
+
+    """
+    if numpy is None:
+        raise ImportError("to_numpy_structured_array needs numpy: pip install numpy")
+    typed = {}
+    for field, column in columns.items():
+        if isinstance(column, array):
+            typed[field] = numpy.frombuffer(column, dtype=column.typecode) if len(column) else \
+                numpy.array([], dtype=column.typecode)
+        else:
+            typed[field] = numpy.array(column, dtype=str)
+    records = numpy.empty(len(columns[FIELDNAMES[0]]), dtype=[(field, typed[field].dtype) for field in columns])
+    for field, column in typed.items():
+        records[field] = column
+    return records
+
+
+def to_arrow_table(columns):
+    """
+
+    Args: columns: a dictionary of columns (see normalizing_block).
+
+    Returns: a pyarrow.Table. The NaN prices and the -1 numbers become nulls, the rating a dictionary column of
+            RATINGS' names.
+
+    """
+    if pyarrow is None:
+        raise ImportError("to_arrow_table needs pyarrow: pip install pyarrow")
+    arrays = {}
+    for field, column in columns.items():
+        if field == "review_rating":
+            indices = pyarrow.array([None if code == UNKNOWN else code - 1 for code in column], pyarrow.int8())
+            arrays[field] = pyarrow.DictionaryArray.from_arrays(indices, pyarrow.array(RATINGS))
+        elif field in FLOAT_COLUMNS:
+            arrays[field] = pyarrow.array([None if math.isnan(price) else price for price in column],
+                                          pyarrow.float64())
+        elif field in INT_COLUMNS:
+            arrays[field] = pyarrow.array([None if number == UNKNOWN else number for number in column],
+                                          pyarrow.int64())
+        else:
+            arrays[field] = pyarrow.array(column, pyarrow.string())
+    return pyarrow.table(arrays)
+
+
+def writing_parquet(columns, path):
+    """ Writes the columns (see normalizing_block) to a Parquet file.
+    """
+    if pyarrow is None:
+        raise ImportError("writing_parquet needs pyarrow: pip install pyarrow")
+    pyarrow.parquet.write_table(to_arrow_table(columns), path)
+
+
+def writing_npy(columns, path):
+    """ Writes the columns (see normalizing_block) to a .npy file, as a numpy structured array.
+    """
+    if numpy is None:
+        raise ImportError("writing_npy needs numpy: pip install numpy")
+    numpy.save(path, to_numpy_structured_array(columns))
+
+
+def writing_column_json(columns, path):
+    """ Writes the columns (see normalizing_block) to a column-oriented JSON file: {"field": [values...], ...}. It needs
+    nothing but the standard library. The NaN prices become nulls.
+    """
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump({field: [None if isinstance(value, float) and math.isnan(value) else value for value in column]
+                   for field, column in columns.items()}, f, ensure_ascii=False)
+
+
+def reading_json_lines(path):
+    """
+
+    Args: path: a JSON Lines file written by output_sinks.JsonLinesSink.
+
+    Yields: the dictionaries of the books.
+
+    """
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Turns the books of a JSON Lines output into typed columns.")
+    parser.add_argument("books", help="a .jsonl file written with pipeline.py --output")
+    parser.add_argument("--parquet", help="Parquet file where to write the columns (needs pyarrow)")
+    parser.add_argument("--npy", help=".npy file where to write the numpy structured array (needs numpy)")
+    parser.add_argument("--json", help="column-oriented JSON file where to write the columns")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="number of books converted together")
+    arguments = parser.parse_args()
+
+    all_columns = concatenating_blocks(normalizing_books(reading_json_lines(arguments.books), arguments.block_size))
+    if arguments.parquet:
+        writing_parquet(all_columns, arguments.parquet)
+    if arguments.npy:
+        writing_npy(all_columns, arguments.npy)
+    if arguments.json:
+        writing_column_json(all_columns, arguments.json)
+    print(len(all_columns[FIELDNAMES[0]]), "books")
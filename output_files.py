@@ -0,0 +1,107 @@
+""" This script builds the paths of the files written by the scrappers, and writes them atomically.
+
+The scrappers used to move to the category's folder with os.chdir, and back. The current folder is shared by the whole
+process, so two categories scrapped at the same time (threads, asyncio tasks) would write in each other's folder.
+Instead, every path is now built from an explicit base folder, and the current folder is never changed.
+
+Each file is first written under a temporary name, then renamed to its final name in one step. A reader, or a crash,
+never sees half a file.
+
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+# The folder where the scrappers write by default: the current one, when they are called.
+DEFAULT_BASE_DIRECTORY = "."
+
+
+def remove_suffix(input_string, suffix):
+    """ Equivalent of the 3.9 Python removesuffix string method (this script is written in the 3.8 version).
+    """
+    if suffix and input_string.endswith(suffix):
+        return input_string[:-len(suffix)]
+    return input_string
+
+
+def cleaning_titles(book):
+    """ Removes the characters forbidden by the NTFS from the string.
+    """
+
+    if not book.startswith(' '):
+        book_csv_file_name = book.replace(' ', '_') + ".csv"
+    book_csv_file_name = book_csv_file_name.replace(':', '_')
+    book_csv_file_name = book_csv_file_name.replace('/', '-')
+    book_csv_file_name = book_csv_file_name.replace('?', '-')
+    book_csv_file_name = book_csv_file_name.replace("<", '_')
+    book_csv_file_name = book_csv_file_name.replace('"', '_')
+    book_csv_file_name = book_csv_file_name.replace('>', '_')
+    book_csv_file_name = book_csv_file_name.replace('|', '-')
+    book_csv_file_name = book_csv_file_name.replace("*", '_')
+    return book_csv_file_name
+
+
+def category_folder(csv_file_name, base_directory=DEFAULT_BASE_DIRECTORY):
+    """
+
+    Args:
+        csv_file_name: the name of a category's csv file e.g. 'Mystery_.csv'.
+        base_directory: the folder holding the categories' folders.
+
+    Returns: the path of the category's folder e.g. './Mystery'. It holds the category's csv file and the books' ones.
+
+    """
+    return os.path.join(base_directory, remove_suffix(csv_file_name, '_.csv'))
+
+
+def category_images_folder(csv_file_name, base_directory=DEFAULT_BASE_DIRECTORY):
+    """
+
+    Returns: the path of the folder holding the category's images, inside the category's folder like down_image
+            writes them e.g. './Mystery/Mystery_images'.
+
+    """
+    folder = category_folder(csv_file_name, base_directory)
+    return os.path.join(folder, os.path.basename(folder) + "_images")
+
+
+def category_csv_path(csv_file_name, base_directory=DEFAULT_BASE_DIRECTORY):
+    """
+
+    Returns: the path of the category's csv file, in the category's folder if there's one. The older runs wrote it
+            right in the base folder.
+
+    """
+    path = os.path.join(category_folder(csv_file_name, base_directory), csv_file_name)
+    if os.path.exists(path):
+        return path
+    return os.path.join(base_directory, csv_file_name)
+
+
+@contextmanager
+def writing_atomically(path, encoding="utf-8"):
+    """ Opens a temporary file, next to the final one, to write text in it. When the 'with' block ends without error,
+    the temporary file replaces the final one. Otherwise, it's removed and the final file is untouched.
+
+    Args:
+        path: the final file. Its folder is created if needed.
+        encoding: the encoding of the text.
+
+    Ex:
+        with writing_atomically("Mystery/Mystery_.csv", encoding="windows-1252") as f:
+            f.write(...)
+
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # one temporary name per process and thread, so concurrent writers of the same file don't mix their lines.
+    temporary_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary_path, 'w', encoding=encoding) as f:
+            yield f
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
@@ -0,0 +1,142 @@
+""" This script holds the output sinks: they write the books' information into one consolidated file.
+
+Instead of one small csv file per book, every book goes into a single JSON Lines file or a single SQLite database.
+The books are buffered and written by batches, so a full run costs a handful of writes instead of a thousand files.
+
+Ex:
+    with opening_sink("books.sqlite") as sink:
+        writing_book_information_async("Christian_.csv", sink=sink)
+
+"""
+
+import os
+import sqlite3
+import threading
+
+# FIELDNAMES and serializable_value are imported from here by the other scripts.
+from book_record import BookRecord, FIELDNAMES, encoding_json_lines, rows_from_records, serializable_value
+
+# Number of books kept in memory before being written.
+DEFAULT_BATCH_SIZE = 100
+
+
+class OutputSink:
+    """ Base class of the sinks. The subclasses only need to define writing_batch().
+
+    Use it as a context manager, or don't forget to call close(): the last batch is written then.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.written = 0
+        # functions called with each batch of records, once it is written.
+        self.flush_listeners = []
+        self._batch = []
+        self._lock = threading.Lock()
+
+    def write(self, book_dict):
+        """
+
+        Args: book_dict: the dictionary containing the 10 required information of a book, or its BookRecord.
+
+        """
+        # the batch holds compact records (see book_record.py), read like dictionaries by the flush listeners.
+        record = BookRecord.from_mapping(book_dict)
+        with self._lock:
+            self._batch.append(record)
+            if len(self._batch) >= self.batch_size:
+                self._flushing()
+
+    def flush(self):
+        """ Writes the books waiting in the batch.
+        """
+        with self._lock:
+            self._flushing()
+
+    def _flushing(self):
+        if self._batch:
+            self.writing_batch(self._batch)
+            self.written += len(self._batch)
+            for listener in self.flush_listeners:
+                listener(self._batch)
+            self._batch = []
+
+    def writing_batch(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonLinesSink(OutputSink):
+    """ One JSON object per line, appended to the file.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self._file = open(path, 'a', encoding="utf-8")
+
+    def writing_batch(self, records):
+        self._file.write(encoding_json_lines(records))
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class SqliteSink(OutputSink):
+    """ One row per book in the 'books' table, indexed on the universal product code.
+
+    A book scrapped twice (same product page URL) replaces the previous row.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            columns = ", ".join(field + " TEXT" for field in FIELDNAMES[1:])
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS books (product_page_url TEXT PRIMARY KEY, " + columns + ")")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS books_upc ON books (universal_product_code)")
+        self._insert = "INSERT OR REPLACE INTO books (" + ", ".join(FIELDNAMES) + ") VALUES (" \
+                       + ", ".join("?" for _ in FIELDNAMES) + ")"
+
+    def writing_batch(self, records):
+        with self._connection:
+            self._connection.executemany(self._insert, rows_from_records(records))
+
+    def close(self):
+        super().close()
+        self._connection.close()
+
+
+# The available sinks, by file extension.
+SINKS = {".jsonl": JsonLinesSink,
+         ".sqlite": SqliteSink,
+         ".db": SqliteSink}
+
+
+def opening_sink(path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+
+    Args:
+        path: the file where the books will be written. Its extension chooses the sink (see SINKS).
+        batch_size: the number of books kept in memory before being written.
+
+    Returns: the sink writing to the file.
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError("No output sink for '" + extension + "' files. Use one of: " + ", ".join(SINKS))
+    return SINKS[extension](path, batch_size)
@@ -0,0 +1,135 @@
+""" This script separates the downloading of the books' pages from their parsing.
+
+A few threads download the pages (network I/O) and put their raw bytes in a bounded queue. A pool of processes takes
+them from the queue and extracts the 10 required information, so the parsing uses all the cores and never blocks the
+next download. When the parsing can't keep up, the queue fills up and the downloading threads wait (backpressure).
+
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from http_client import fetch, is_error_page
+from product_page_extractor import extracting_book_information
+
+# Number of threads downloading the pages.
+DEFAULT_IO_WORKERS = 10
+# Number of processes parsing the pages. None means one per core.
+DEFAULT_PARSE_WORKERS = None
+# Number of downloaded pages waiting to be parsed. Beyond it, the downloading threads wait.
+DEFAULT_QUEUE_SIZE = 50
+
+# Put in the queue when every page has been downloaded.
+_END_OF_PAGES = object()
+
+
+def decoding_and_extracting(link, book, content, encoding):
+    """ Runs in the parsing processes. It must stay a module-level function to be sent to them.
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book.
+        content: the raw bytes of the book's page.
+        encoding: the encoding of the page, as guessed by requests.
+
+    Returns: a (title, dictionary containing the 10 required information) tuple.
+
+    """
+    # Decoding the bytes exactly like requests' response.text does, so the information are the same.
+    page_source = str(content, encoding, errors='replace')
+    return book, extracting_book_information(link, book, page_source)
+
+
+def downloading_page(link, book, pages, stop):
+    """ Runs in the downloading threads. Puts the raw bytes of the page in the queue. An error page is logged and
+    skipped: it never reaches the parsing processes.
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book.
+        pages: the bounded queue read by the parsing stage.
+        stop: an event set when the parsing stage gives up, so we don't wait forever on a full queue.
+
+    """
+    if stop.is_set():
+        return
+    try:
+        response = fetch(link)
+        if is_error_page(link, response):
+            return
+        encoding = response.encoding or response.apparent_encoding
+        item = (link, book, response.content, encoding)
+    except Exception as error:
+        item = error
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def extracting_books_in_pool(links, books, io_workers=DEFAULT_IO_WORKERS, parse_workers=DEFAULT_PARSE_WORKERS,
+                             queue_size=DEFAULT_QUEUE_SIZE, tracker=None):
+    """ Downloads the books' pages in threads and extracts their information in a pool of processes.
+
+    Args:
+        links: the links to the books' pages.
+        books: the titles of the books, in the same order as the links.
+        io_workers: the number of threads downloading the pages.
+        parse_workers: the number of processes parsing the pages. None means one per core.
+        queue_size: the number of downloaded pages allowed to wait for a parsing process.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are skipped: the
+                 unchanged pages aren't even sent to the parsing processes.
+
+    Yields: (title, dictionary containing the 10 required information) tuples, as soon as they are parsed.
+
+    """
+    if parse_workers is None:
+        parse_workers = os.cpu_count() or 1
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    downloaders = ThreadPoolExecutor(max_workers=io_workers)
+    downloads = [downloaders.submit(downloading_page, link, book, pages, stop) for link, book in zip(links, books)]
+
+    def signaling_the_end():
+        wait(downloads)
+        while not stop.is_set():
+            try:
+                pages.put(_END_OF_PAGES, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    threading.Thread(target=signaling_the_end, daemon=True).start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=parse_workers) as parsers:
+            # Each process gets at most two pages in advance, the others stay in the bounded queue.
+            max_pending = 2 * parse_workers
+            pending = set()
+            while True:
+                item = pages.get()
+                if item is _END_OF_PAGES:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if tracker is not None and tracker.is_page_unchanged(item[0], item[2]):
+                    continue
+                pending.add(parsers.submit(decoding_and_extracting, *item))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if tracker is None or not tracker.is_record_unchanged(future.result()[1]):
+                            yield future.result()
+            for future in as_completed(pending):
+                if tracker is None or not tracker.is_record_unchanged(future.result()[1]):
+                    yield future.result()
+    finally:
+        stop.set()
+        for download in downloads:
+            download.cancel()
+        downloaders.shutdown(wait=True)
@@ -0,0 +1,335 @@
+""" This script scraps the whole website as a chain of generators, from the categories' webpages to the images.
+
+Nothing is written to the disk only to be read back: the links found on a category's webpage go straight to the
+product pages' download, their information straight to the output (csv files or a sink), and their image URL straight
+to the images' download. Each stage only holds a few books at a time, so the memory doesn't grow with the catalogue
+and the first book is written a few seconds after the start.
+
+    discovering_books -> scraping_books -> saving_books -> images_to_download -> downloading_images
+
+Ex: python pipeline.py --output books.sqlite
+
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+
+import requests
+
+from book_scrapper import saving_book, images_to_download, DEFAULT_CONCURRENCY
+from change_tracker import extracting_if_changed, adding_crawl_state_arguments, opening_crawl_state_from_arguments
+from checkpoint import CATEGORIES
+from http_client import fetch, is_error_page, enable_disk_cache, enable_archive, enable_replay, disable_archive
+from image_downloader import downloading_images
+from image_store import PackedImageStore, images_to_store, storing_images
+from links_and_titles_scrapper import (requesting_page, extracting_books_from_listing, category_csv_file_name,
+                                       category_csv_file_name_from_name, all_categories_links,
+                                       discovering_whole_catalogue, CATALOGUE_FIRST_PAGE)
+from memory_limit import waiting_for_room, set_memory_ceiling, get_memory_ceiling
+from metrics import adding_metrics_arguments, collecting_metrics_from_arguments
+from output_files import category_folder, category_images_folder, DEFAULT_BASE_DIRECTORY
+from output_sinks import opening_sink
+
+
+def discovering_books(category_url):
+    """ Follows the 'next' links of the category, one webpage at a time. A webpage the website (or the archive, when
+    replaying) answers with an error is logged and ends the category: its 'next' link can't be read.
+
+    Args: category_url: the URL of the category's first webpage.
+
+    Yields: (title, link) tuples, as soon as the webpage holding them is parsed.
+
+    """
+    url = category_url
+    while url is not None:
+        try:
+            page = requesting_page(url)
+        except requests.HTTPError as error:
+            print("Unable to scrap " + url + ": " + str(error))
+            return
+        for book in extracting_books_from_listing(page, url):
+            yield book
+        next_tag = page.select_one("li.next a")
+        url = urljoin(url, next_tag.get('href')) if next_tag is not None else None
+
+
+def fetching_and_extracting(link, book, tracker=None):
+    """
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book.
+        tracker: a ChangeTracker, or None.
+
+    Returns: a (title, dictionary containing the 10 required information) tuple. The dictionary is None when the
+            tracker knows the book didn't change, or when the page is an error (e.g. missing from the archive when
+            replaying) or couldn't be fetched at all: it's logged and skipped, not extracted. The page isn't marked
+            done, so --resume tries it again.
+
+    """
+    try:
+        response = fetch(link)
+    except requests.RequestException as error:
+        print("Unable to scrap " + link + ": " + str(error))
+        return book, None
+    if is_error_page(link, response):
+        return book, None
+    return book, extracting_if_changed(link, book, response, tracker)
+
+
+def scraping_books(books, concurrency=DEFAULT_CONCURRENCY, checkpoint=None, tracker=None):
+    """ Downloads and extracts the product pages in a pool of threads.
+
+    Args:
+        books: an iterable of (title, link) tuples, e.g. discovering_books().
+        concurrency: the number of product pages downloaded at the same time.
+        checkpoint: a CheckpointManifest. If given, the product pages already done are skipped.
+        tracker: a ChangeTracker. If given, the books that didn't change since the previous run are skipped.
+
+    Yields: (title, dictionary containing the 10 required information) tuples, in the order the pages arrive.
+
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for book, link in books:
+            if checkpoint is not None and checkpoint.is_page_done(link):
+                continue
+            pending.add(executor.submit(fetching_and_extracting, link, book, tracker))
+            done, pending = waiting_for_room(pending, 2 * concurrency)
+            for future in done:
+                if future.result()[1] is not None:
+                    yield future.result()
+        for future in as_completed(pending):
+            if future.result()[1] is not None:
+                yield future.result()
+
+
+def saving_books(scrapped_books, folder, sink=None, checkpoint=None, tracker=None):
+    """ Writes each book (see book_scrapper.saving_book) and passes it on.
+
+    Args:
+        scrapped_books: an iterable of (title, dictionary containing the 10 required information) tuples.
+        folder: the folder of the books' csv files, when there's no sink.
+        sink: one of the output_sinks.py sinks, or None.
+        checkpoint: a CheckpointManifest recording the product pages done, or None.
+        tracker: a ChangeTracker recording the books written, or None.
+
+    Yields: the dictionaries of the books, once written.
+
+    """
+    for book, book_dict in scrapped_books:
+        saving_book(book_dict, book, sink, checkpoint, folder, tracker)
+        yield book_dict
+
+
+def scraping_category(category_url, concurrency=DEFAULT_CONCURRENCY, sink=None, checkpoint=None,
+                      base_directory=DEFAULT_BASE_DIRECTORY, tracker=None, image_store=None, with_images=True):
+    """ Runs the whole chain for one category.
+
+    Args:
+        category_url: the URL of the category's first webpage.
+        concurrency: the number of product pages (and images) downloaded at the same time.
+        sink: one of the output_sinks.py sinks. If None, each book gets its csv file in the category's folder.
+        checkpoint: a CheckpointManifest. If given, the work already done is skipped and the new one recorded.
+        base_directory: the folder where the category's folders are created. The current folder is never changed, so
+                        several categories can be scrapped at the same time.
+        tracker: a ChangeTracker. If given, only the books that changed since the previous run are written.
+        image_store: a PackedImageStore. If given, the images go to it instead of the category's images folder.
+        with_images: if False, the chain stops once the books are written, e.g. when replaying an archive.
+
+    Returns: the ImageDownloadStats of the category, or the number of books written without the images.
+
+    """
+    csv_file_name = category_csv_file_name(category_url)
+    books = discovering_books(category_url)
+    scrapped_books = scraping_books(books, concurrency, checkpoint, tracker)
+    book_dicts = saving_books(scrapped_books, category_folder(csv_file_name, base_directory), sink, checkpoint,
+                              tracker)
+    if not with_images:
+        return counting_books(book_dicts)
+    if image_store is not None:
+        return storing_images(images_to_store(book_dicts), image_store, concurrency, checkpoint)
+    images = images_to_download(book_dicts, category_images_folder(csv_file_name, base_directory))
+    return downloading_images(images, concurrency, checkpoint)
+
+
+def saving_books_by_category(scrapped_books, sink=None, checkpoint=None, base_directory=DEFAULT_BASE_DIRECTORY,
+                             tracker=None):
+    """ Same as saving_books, for books of any category: each csv file goes to the folder of the book's category.
+
+    Args:
+        scrapped_books: an iterable of (title, dictionary containing the 10 required information) tuples.
+        sink: one of the output_sinks.py sinks, or None.
+        checkpoint: a CheckpointManifest recording the product pages done, or None.
+        base_directory: the folder where the categories' folders are created.
+        tracker: a ChangeTracker recording the books written, or None.
+
+    Yields: the dictionaries of the books, once written.
+
+    """
+    for book, book_dict in scrapped_books:
+        folder = category_folder(category_csv_file_name_from_name(book_dict["category"]), base_directory)
+        saving_book(book_dict, book, sink, checkpoint, folder, tracker)
+        yield book_dict
+
+
+def counting_books(book_dicts):
+    """ Runs the chain without its images' stage.
+
+    Args: book_dicts: an iterable of the dictionaries of the books, e.g. saving_books().
+
+    Returns: the number of books written.
+
+    """
+    return sum(1 for _ in book_dicts)
+
+
+def images_to_download_by_category(book_dicts, base_directory=DEFAULT_BASE_DIRECTORY):
+    """ Same as book_scrapper.images_to_download, each image going to the folder of the book's category.
+    """
+    for book_dict in book_dicts:
+        csv_file_name = category_csv_file_name_from_name(book_dict["category"])
+        yield from images_to_download([book_dict], category_images_folder(csv_file_name, base_directory))
+
+
+def scraping_catalogue(url=CATALOGUE_FIRST_PAGE, concurrency=DEFAULT_CONCURRENCY, sink=None, checkpoint=None,
+                       base_directory=DEFAULT_BASE_DIRECTORY, tracker=None, image_store=None, with_images=True):
+    """ Runs the whole chain for every book of the website, found on the catalogue's pages (see
+    discovering_whole_catalogue): about 50 listing requests instead of a crawl of each category.
+
+    Args:
+        url: the URL of the catalogue's first page.
+        concurrency: the number of pages (and images) downloaded at the same time.
+        sink: one of the output_sinks.py sinks. If None, each book gets its csv file in its category's folder.
+        checkpoint: a CheckpointManifest. If given, the work already done is skipped and the new one recorded.
+        base_directory: the folder where the categories' folders are created.
+        tracker: a ChangeTracker. If given, only the books that changed since the previous run are written.
+        image_store: a PackedImageStore. If given, the images go to it instead of the categories' images folders.
+        with_images: if False, the chain stops once the books are written, e.g. when replaying an archive.
+
+    Returns: the ImageDownloadStats of the whole website, or the number of books written without the images.
+
+    """
+    books = discovering_whole_catalogue(url, concurrency)
+    scrapped_books = scraping_books(books, concurrency, checkpoint, tracker)
+    book_dicts = saving_books_by_category(scrapped_books, sink, checkpoint, base_directory, tracker)
+    if not with_images:
+        return counting_books(book_dicts)
+    if image_store is not None:
+        return storing_images(images_to_store(book_dicts), image_store, concurrency, checkpoint)
+    return downloading_images(images_to_download_by_category(book_dicts, base_directory), concurrency, checkpoint)
+
+
+def scraping_categories(category_urls, concurrency=DEFAULT_CONCURRENCY, sink=None, checkpoint=None,
+                        base_directory=DEFAULT_BASE_DIRECTORY, tracker=None, image_store=None, with_images=True):
+    """ Runs the whole chain for each category, skipping the ones the checkpoint records as done.
+
+    Args: same as scraping_category, with the URLs of the categories' first webpages.
+
+    """
+    for category_url in category_urls:
+        csv_file_name = category_csv_file_name(category_url)
+        if checkpoint is not None and checkpoint.is_done(CATEGORIES, csv_file_name):
+            continue
+        print(csv_file_name, scraping_category(category_url, concurrency, sink, checkpoint, base_directory, tracker,
+                                               image_store, with_images))
+        if sink is not None:
+            # the category is only done once its last books are written.
+            sink.flush()
+        if checkpoint is not None:
+            checkpoint.mark_done(CATEGORIES, csv_file_name)
+
+
+def scraping_website(by_category=False, concurrency=DEFAULT_CONCURRENCY, sink=None, checkpoint=None,
+                     base_directory=DEFAULT_BASE_DIRECTORY, tracker=None, image_store=None, with_images=True):
+    """ Scraps every book of the website, from the catalogue's pages or category by category.
+
+    Args:
+        by_category: if True, the categories' webpages are crawled one by one (see scraping_categories). Otherwise,
+                     the books are found on the catalogue's pages (see scraping_catalogue).
+        others: same as scraping_catalogue.
+
+    """
+    if by_category:
+        scraping_categories(all_categories_links(), concurrency, sink, checkpoint, base_directory, tracker,
+                            image_store, with_images)
+    else:
+        print("All the categories", scraping_catalogue(CATALOGUE_FIRST_PAGE, concurrency, sink, checkpoint,
+                                                       base_directory, tracker, image_store, with_images))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scraps the 10 required information and the image of every book.")
+    parser.add_argument("--output", help="a .jsonl, .sqlite or .db file where to write all the books, instead of "
+                                         "one csv file per book")
+    parser.add_argument("--by-category", action="store_true",
+                        help="crawl the categories' webpages one by one, instead of the catalogue's pages")
+    parser.add_argument("--directory", default=DEFAULT_BASE_DIRECTORY,
+                        help="folder where the categories' folders and images are written")
+    parser.add_argument("--image-store",
+                        help="folder of a packed image store (see image_store.py) where to write the images, instead "
+                             "of one jpg file per book")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of pages and images downloaded at the same time")
+    parser.add_argument("--max-rss", type=int,
+                        help="memory ceiling in megabytes: above it, no new page or image is requested until the "
+                             "work in progress is done")
+    adding_crawl_state_arguments(parser)
+    parser.add_argument("--archive",
+                        help="a .warc.gz file where the listing and product pages are appended as received, to be "
+                             "replayed later (see response_archive.py)")
+    parser.add_argument("--replay",
+                        help="a .warc.gz file written with --archive: the books are extracted again from its pages, "
+                             "without the network nor the images. Every book is written")
+    adding_metrics_arguments(parser)
+    arguments = parser.parse_args()
+
+    if arguments.max_rss:
+        set_memory_ceiling(arguments.max_rss * 1024 * 1024)
+
+    if arguments.replay:
+        # No request is sent: the re-extraction of the whole catalogue only costs the parsing. The checkpoint and the
+        # content index belong to the crawls, they're left alone.
+        replayed_archive = enable_replay(arguments.replay)
+        print("Replaying {} pages".format(replayed_archive.counting()[0]))
+        with collecting_metrics_from_arguments(arguments):
+            if arguments.output:
+                with opening_sink(arguments.output) as output_sink:
+                    scraping_website(arguments.by_category, arguments.concurrency, output_sink,
+                                     base_directory=arguments.directory, with_images=False)
+            else:
+                scraping_website(arguments.by_category, arguments.concurrency, base_directory=arguments.directory,
+                                 with_images=False)
+        sys.exit()
+
+    # The pages and images are kept in this folder between runs. On a rerun, unchanged ones only cost a
+    # '304 Not Modified'.
+    enable_disk_cache(".http_cache")
+    if arguments.archive:
+        enable_archive(arguments.archive)
+
+    # A book whose image went to the loose files isn't skipped when the images now go to a packed store, and back.
+    image_destination = os.path.abspath(arguments.image_store or arguments.directory)
+    with collecting_metrics_from_arguments(arguments), \
+            opening_crawl_state_from_arguments(arguments, image_destination) as (crawl_checkpoint, change_tracker):
+        packed_images = PackedImageStore(arguments.image_store) if arguments.image_store else None
+        try:
+            if arguments.output:
+                with opening_sink(arguments.output) as output_sink:
+                    crawl_checkpoint.following_sink(output_sink)
+                    change_tracker.following_sink(output_sink)
+                    scraping_website(arguments.by_category, arguments.concurrency, output_sink, crawl_checkpoint,
+                                     arguments.directory, change_tracker, packed_images)
+            else:
+                scraping_website(arguments.by_category, arguments.concurrency, None, crawl_checkpoint,
+                                 arguments.directory, change_tracker, packed_images)
+        finally:
+            if packed_images is not None:
+                packed_images.close()
+            disable_archive()
+        print(change_tracker)
+        if get_memory_ceiling() is not None:
+            print("Throttled by the memory ceiling", get_memory_ceiling().throttled, "times")
@@ -0,0 +1,397 @@
+""" This script extracts the 10 required information from the HTML source code of a book's page.
+
+Two extractors give the same result on the website's pages:
+    - extracting_book_information_with_soup builds a whole BeautifulSoup tree and walks it several times, taking the
+      information by their position (the 4th p tag, the 8th child of the table...). It is the reference, and the
+      fallback. An information it can't read gives UNABLE_TO_SCRAP too.
+    - extracting_book_information_fast parses the page with lxml and applies BOOK_SCHEMA: a declarative list of the
+      information, each with the XPath expression finding it (compiled once, when the module is imported) and the
+      function reading it. The table's rows are found by their header instead of their position. An information
+      missing from the page gives UNABLE_TO_SCRAP, without stopping the others.
+
+"""
+
+import re
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from book_record import BookRecord, UNABLE_TO_SCRAP
+from metrics import measuring
+
+TEXT_NODES = etree.XPath(".//text()")
+HAS_PRESERVED_WHITESPACE = etree.XPath("boolean(//pre | //textarea)")
+
+# BeautifulSoup replaces the strings made only of those characters by a single newline or space.
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# A price, with its thousands separators if any e.g. '51.77' or '1,051.77'.
+PRICE = re.compile(r"\d+(?:[.,]\d+)*")
+
+_html_parser = etree.HTMLParser()
+
+
+def price_from_text(text):
+    """
+
+    Args: text: the text of a price's cell e.g. 'Price (incl. tax)\n£51.77'.
+
+    Returns: the price without its currency e.g. '51.77'. The 5 last characters were kept before, which cut the prices
+            of 100 and more.
+
+    """
+    numbers = PRICE.findall(text)
+    return numbers[-1] if numbers else text[-5:]
+
+
+def rating_from_classes(classes):
+    """
+
+    Args: classes: the classes of the stars' p tag e.g. ['star-rating', 'Three'].
+
+    Returns: the rating, as the website writes it in the class e.g. 'Three'.
+
+    """
+    return [name for name in classes if name != "star-rating"][0]
+
+
+def reading_or_unable_to_scrap(reading):
+    """
+
+    Args: reading: a function reading one information from the page.
+
+    Returns: the information, or UNABLE_TO_SCRAP if it isn't on the page (the function raised). It never raises.
+
+    """
+    try:
+        return reading()
+    except (IndexError, AttributeError, TypeError, ValueError, UnicodeError):
+        return UNABLE_TO_SCRAP
+
+
+def extracting_book_information_with_soup(link, book, page_source):
+    """ Extracts the 10 required information from the HTML source code of a book's page, using BeautifulSoup.
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book, as written in the category's csv file.
+        page_source: the HTML source code of the book's page.
+
+    Returns: a dictionary containing the 10 required information.
+
+    """
+    with measuring("parse") as measure:
+        measure.size = len(page_source)
+        book_page = BeautifulSoup(page_source, 'lxml')
+
+    # Here we get the product page URL (1)
+    book_dict = {"product_page_url": link}
+
+    # Here we get the universal product code of the book (2)
+    book_dict["universal_product_code"] = reading_or_unable_to_scrap(
+        lambda: book_page.find('tr').text.rstrip().lstrip())
+
+    # Here we get the title (3)
+    title = book
+    book_dict["title"] = title
+
+    # I create a list with the table from which I'll take four useful information. Each one is read on its own: a
+    # partial table only costs the information missing from it.
+    product_table = book_page.find('table', class_="table table-striped")
+    product_table = list(product_table) if product_table is not None else []
+
+    # Useful info one : the price including tax (4)
+    book_dict["price_including_tax"] = reading_or_unable_to_scrap(
+        lambda: price_from_text(product_table[7].text.rstrip().lstrip()))
+
+    # Useful info two : the price excluding tax (5)
+    book_dict["price_excluding_tax"] = reading_or_unable_to_scrap(
+        lambda: price_from_text(product_table[5].text.rstrip().lstrip()))
+
+    # Useful info three : the number of books available (6)
+    def reading_number_available_text():
+        number_available_ugly_text = product_table[11].text.split()[-2]
+        return "".join([i for i in number_available_ugly_text if i != "("])
+    book_dict["number_available"] = reading_or_unable_to_scrap(reading_number_available_text)
+
+    # Useful info four : the rating, read in the class of the stars (9). The 'Number of reviews' row of the table,
+    # read before, is not the rating: it's 0 for every book.
+    book_dict['review_rating'] = reading_or_unable_to_scrap(
+        lambda: rating_from_classes(book_page.find(class_="product_main").find('p', class_="star-rating")['class']))
+
+    # Here we get the product description (7)
+    book_dict["product_description"] = reading_or_unable_to_scrap(
+        lambda: book_page.find_all('p')[3].encode("windows-1252"))
+
+    # Here we get the category (8)
+    book_dict["category"] = reading_or_unable_to_scrap(
+        lambda: list(book_page.find('ul').find_all('li'))[2].text.rstrip().lstrip())
+
+    # Here we get the image URL (10)
+    def reading_image_url_text():
+        image_url_text = str(list(book_page.find(class_='item active'))[1])
+        # The first [].notation refers to the list item to extract while the second is splitting the string
+        image_url = image_url_text.rsplit('src="')[1][:-3]
+        # We need to add an suffix in order to get the good webpage
+        return image_url.replace('../../', "http://books.toscrape.com/")
+    book_dict["image_url"] = reading_or_unable_to_scrap(reading_image_url_text)
+
+    # The tree is full of reference cycles (parents and children): without this, only the garbage collector would
+    # free it, long after. The information above are copies, they don't point into the tree.
+    book_page.decompose()
+    return book_dict
+
+
+def string_like_soup(text):
+    """
+
+    Args: text: a string from the lxml tree.
+
+    Returns: the same string as BeautifulSoup stores it. Whitespace-only strings become a single newline or space.
+
+    """
+    if text.strip(ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def text_like_soup(node):
+    """
+
+    Args: node: an lxml element or a string.
+
+    Returns: the same string as node.text with BeautifulSoup.
+
+    """
+    if isinstance(node, str):
+        return string_like_soup(node)
+    return "".join([string_like_soup(text) for text in TEXT_NODES(node)])
+
+
+def escaping_like_soup(text):
+    """ BeautifulSoup's 'minimal' formatter: only &, < and > are replaced by entities.
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def description_like_soup(paragraph):
+    """
+
+    Args: paragraph: the lxml element of the description's p tag.
+
+    Returns: the same bytes as Tag.encode("windows-1252") with BeautifulSoup.
+
+    """
+    if len(paragraph) or paragraph.attrib:
+        # Only plain paragraphs are written by hand. The others are rare enough to be handed to BeautifulSoup.
+        fragment = etree.tostring(paragraph, method="html", encoding="unicode", with_tail=False)
+        return BeautifulSoup(fragment, 'lxml').p.encode("windows-1252")
+    markup = "<p>" + escaping_like_soup(string_like_soup(paragraph.text or "")) + "</p>"
+    return markup.encode("windows-1252", "xmlcharrefreplace")
+
+
+def reading_text(node):
+    """
+
+    Args: node: an lxml element.
+
+    Returns: its text, as BeautifulSoup gives it, without the whitespace around.
+
+    """
+    return text_like_soup(node).strip()
+
+
+def reading_price(node):
+    """
+
+    Args: node: the table's row of a price e.g. 'Price (incl. tax)\n£51.77'.
+
+    Returns: the price without its currency e.g. '51.77'.
+
+    """
+    return price_from_text(reading_text(node))
+
+
+def reading_number_available(node):
+    """
+
+    Args: node: the table's row of the availability e.g. 'Availability\nIn stock (22 available)'.
+
+    Returns: the number available e.g. '22'.
+
+    """
+    return text_like_soup(node).split()[-2].replace("(", "")
+
+
+def reading_rating(class_attribute):
+    """
+
+    Args: class_attribute: the class attribute of the stars' p tag e.g. 'star-rating Three'.
+
+    Returns: the rating e.g. 'Three'.
+
+    """
+    return rating_from_classes(class_attribute.split())
+
+
+def reading_image_url(src):
+    """
+
+    Args: src: the src attribute of the book's image e.g. '../../media/cache/fe/72/fe72f0532301ec28892ae.jpg'.
+
+    Returns: the absolute URL of the image.
+
+    """
+    return src.replace('../../', "http://books.toscrape.com/")
+
+
+class SchemaField:
+    """ One information of the extraction schema: where it is on the page, and how to read it.
+    """
+
+    def __init__(self, name, selector, reading):
+        """
+
+        Args:
+            name: the name of the information, one of FIELDNAMES.
+            selector: the XPath expression of the nodes holding the information. It's compiled once, here.
+            reading: the function turning the first node found into the information.
+
+        """
+        self.name = name
+        self.selector = selector
+        self.reading = reading
+        # smart_strings=False: the strings found don't keep a reference to the whole tree.
+        self.selecting = etree.XPath(selector, smart_strings=False)
+
+    def extracting(self, node):
+        """
+
+        Args: node: the lxml node the selector starts from, or None if it isn't on the page.
+
+        Returns: the information, or UNABLE_TO_SCRAP if it isn't on the page or can't be read. It never raises.
+
+        """
+        if node is None:
+            return UNABLE_TO_SCRAP
+        try:
+            return self.reading(self.selecting(node)[0])
+        except (IndexError, ValueError, AttributeError, TypeError, UnicodeError):
+            return UNABLE_TO_SCRAP
+
+    def adding(self, node, book_dict):
+        book_dict[self.name] = self.extracting(node)
+
+    def __repr__(self):
+        return "SchemaField(" + repr(self.name) + ", " + repr(self.selector) + ")"
+
+
+class SchemaSection:
+    """ A part of the page holding several information, e.g. the product information table. It's found once per
+    page, then the selectors of its fields start from it instead of the whole page.
+    """
+
+    def __init__(self, selector, fields):
+        """
+
+        Args:
+            selector: the XPath expression of the section. The first node found is the section.
+            fields: the SchemaFields of the section, their selectors relative to it.
+
+        """
+        self.selector = selector
+        self.fields = tuple(fields)
+        self.selecting = etree.XPath(selector)
+
+    def adding(self, node, book_dict):
+        sections = self.selecting(node) if node is not None else []
+        section = sections[0] if sections else None
+        for field in self.fields:
+            field.adding(section, book_dict)
+
+    def __repr__(self):
+        return "SchemaSection(" + repr(self.selector) + ", " + repr(self.fields) + ")"
+
+
+# True for a tag having the class among others, like BeautifulSoup's class_ argument.
+HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+# A row of the product information table, found by its header instead of its position.
+PRODUCT_ROW = ".//tr[normalize-space(th)='{}']"
+
+# The 8 information found on the book's page, in the order of the BeautifulSoup extractor. The product page URL and
+# the title are given by the callers. '[@class]' first: most tags have no class, that spares normalize-space().
+BOOK_SCHEMA = (
+    SchemaSection("(//table[@class][normalize-space(@class)='table table-striped'])[1]", (
+        SchemaField("universal_product_code", PRODUCT_ROW.format("UPC"), reading_text),
+        SchemaField("price_including_tax", PRODUCT_ROW.format("Price (incl. tax)"), reading_price),
+        SchemaField("price_excluding_tax", PRODUCT_ROW.format("Price (excl. tax)"), reading_price),
+        SchemaField("number_available", PRODUCT_ROW.format("Availability"), reading_number_available),
+    )),
+    SchemaField("review_rating", "(//div[@class][" + HAS_CLASS.format("product_main") + "])[1]//p["
+                + HAS_CLASS.format("star-rating") + "][1]/@class", reading_rating),
+    SchemaField("product_description", "id('product_description')/following-sibling::p[1]", description_like_soup),
+    SchemaField("category", "(//ul[@class][normalize-space(@class)='breadcrumb'])[1]/li[3]", reading_text),
+    SchemaField("image_url", "(//img[../@class][normalize-space(../@class)='item active'])[1]/@src",
+                reading_image_url),
+)
+
+
+def extracting_with_schema(book_page, book_dict, schema=BOOK_SCHEMA):
+    """ Applies the schema to the page.
+
+    Args:
+        book_page: the lxml tree of the book's page.
+        book_dict: the dictionary where the information are added.
+        schema: a sequence of SchemaFields and SchemaSections.
+
+    Returns: the dictionary.
+
+    """
+    for item in schema:
+        item.adding(book_page, book_dict)
+    return book_dict
+
+
+def extracting_book_information_fast(link, book, page_source):
+    """ Extracts the 10 required information from the HTML source code of a book's page, using lxml and BOOK_SCHEMA.
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book, as written in the category's csv file.
+        page_source: the HTML source code of the book's page.
+
+    Returns: a dictionary containing the 10 required information, like extracting_book_information_with_soup. The
+            information missing from the page are UNABLE_TO_SCRAP.
+
+    """
+    # BeautifulSoup guesses the encoding of bytes its own way, we leave it the job.
+    if not isinstance(page_source, str):
+        return extracting_book_information_with_soup(link, book, page_source)
+    try:
+        with measuring("parse") as measure:
+            measure.size = len(page_source)
+            book_page = etree.fromstring(page_source, _html_parser)
+    except (ValueError, etree.LxmlError):
+        book_page = None
+    if book_page is None or HAS_PRESERVED_WHITESPACE(book_page):
+        # BeautifulSoup keeps the whitespace untouched in pre and textarea tags. Not worth handling here.
+        return extracting_book_information_with_soup(link, book, page_source)
+
+    return extracting_with_schema(book_page, {"product_page_url": link, "title": book})
+
+
+def extracting_book_information(link, book, page_source):
+    """ The extractor used by the scrappers: extracting_book_information_fast, measured as the 'extract' stage (see
+    metrics.py).
+
+    Args:
+        link: the URL of the book's page.
+        book: the title of the book, as written in the category's csv file.
+        page_source: the HTML source code of the book's page.
+
+    Returns: the BookRecord of the 10 required information (see book_record.py), read like a dictionary.
+
+    """
+    with measuring("extract") as measure:
+        measure.size = len(page_source)
+        return BookRecord.from_mapping(extracting_book_information_fast(link, book, page_source))
@@ -0,0 +1,236 @@
+""" This script holds the per-host rate limiter used by the HTTP client, and its retry policy.
+
+Each host gets a window: the number of requests allowed in flight at the same time. The window follows the AIMD rule
+(additive increase, multiplicative decrease), like TCP's congestion window:
+    - each answer arriving quickly and without error widens the window by about one request per round,
+    - a 429 (Too Many Requests), a 5xx, a network error or answers getting much slower than usual halve it.
+So we go as fast as the website allows, and back off as soon as it struggles.
+
+The failed requests are retried after an exponential backoff with random jitter (so the retries of several threads
+don't hit the website at the same moment), or after the delay asked by the website's Retry-After header.
+
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Requests in flight per host, at the start and at most.
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 32
+MIN_CONCURRENCY = 1
+# The window is multiplied by this factor when the website struggles.
+DECREASE_FACTOR = 0.5
+# Answers slower than both LATENCY_TOLERANCE times the fastest one and LATENCY_SLACK seconds more mean the website
+# struggles.
+LATENCY_TOLERANCE = 2.0
+LATENCY_SLACK = 0.05
+# Weight of the latest answer in the average latency.
+LATENCY_SMOOTHING = 0.1
+
+# The answers worth retrying: the website is overloaded or temporarily broken.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 4
+# Seconds: the first backoff is up to BACKOFF_BASE, then it doubles at each retry, up to BACKOFF_MAX.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# We never wait longer than this for a Retry-After header.
+MAX_RETRY_AFTER = 300.0
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """ Exponential backoff with 'full jitter': a random delay between 0 and base * 2 ** attempt.
+
+    Args:
+        attempt: the number of attempts already failed, minus one.
+        base: the maximum delay of the first retry.
+        maximum: the maximum delay of any retry.
+
+    Returns: the number of seconds to wait before the next attempt.
+
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def retry_after_delay(response):
+    """
+
+    Args: response: a requests.Response.
+
+    Returns: the number of seconds asked by its Retry-After header (a number of seconds or a date), or None.
+
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError):
+            return None
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+class HostLimiter:
+    """ The AIMD window of one host.
+    """
+
+    def __init__(self, initial_concurrency=DEFAULT_INITIAL_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        # the host asked us (Retry-After) to wait until this time.monotonic() value.
+        self.paused_until = 0.0
+        self.fastest_latency = None
+        self.average_latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquiring(self):
+        """ Waits for a free place in the window, and takes it.
+        """
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def releasing(self, latency=None, congested=False):
+        """ Gives the place back, and adjusts the window.
+
+        Args:
+            latency: the seconds taken by the request, None if it failed.
+            congested: True if the host answered 429, 5xx, or didn't answer.
+
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.measuring(latency)
+                congested = congested or self.is_slow()
+            if congested:
+                self.decreasing()
+            else:
+                # about one more request per round: the window grows by one once 'limit' requests succeeded.
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def measuring(self, latency):
+        if self.fastest_latency is None or latency < self.fastest_latency:
+            self.fastest_latency = latency
+        if self.average_latency is None:
+            self.average_latency = latency
+        else:
+            self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+
+    def is_slow(self):
+        threshold = max(self.fastest_latency * LATENCY_TOLERANCE, self.fastest_latency + LATENCY_SLACK)
+        return self.average_latency > threshold
+
+    def decreasing(self):
+        # The requests already in flight will report the same trouble: we decrease once per round, not per request.
+        now = time.monotonic()
+        if now - self._last_decrease < (self.average_latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE_FACTOR)
+
+    def pausing(self, seconds):
+        """ Stops sending requests to the host for the given number of seconds (Retry-After).
+        """
+        with self._condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """ Holds a place in the window during the 'with' block. The block reports the outcome with the yielded
+        dictionary's 'congested' key. A block raising an exception counts as congested.
+        """
+        self.acquiring()
+        started_at = time.perf_counter()
+        outcome = {"congested": False}
+        try:
+            yield outcome
+        except BaseException:
+            self.releasing(None, congested=True)
+            raise
+        self.releasing(time.perf_counter() - started_at, outcome["congested"])
+
+
+class RateLimiter:
+    """ One HostLimiter per host, created on first use.
+    """
+
+    def __init__(self, initial_concurrency=DEFAULT_INITIAL_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        """
+
+        Args:
+            initial_concurrency: the number of requests in flight per host, at the start.
+            max_concurrency: the maximum number of requests in flight per host.
+            max_retries: the number of times a failed request is retried.
+
+        """
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        """
+
+        Args: url: the URL about to be requested.
+
+        Returns: the HostLimiter of the URL's host.
+
+        """
+        netloc = urlsplit(url).netloc.lower()
+        with self._lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = HostLimiter(self.initial_concurrency, self.max_concurrency)
+            return self._hosts[netloc]
+
+    def sending(self, url, attempt, retry_on=(IOError,)):
+        """ Sends the request within the host's window, and retries it when it fails.
+
+        Args:
+            url: the URL requested.
+            attempt: a function sending the request once, and returning its requests.Response.
+            retry_on: the exceptions meaning the request may succeed if retried (requests' errors are IOErrors).
+
+        Returns: the response of the last attempt. After the last retry, an error is raised, or a 429/5xx returned.
+
+        """
+        host = self.host(url)
+        for attempt_number in range(self.max_retries + 1):
+            last_attempt = attempt_number == self.max_retries
+            try:
+                with host.slot() as outcome:
+                    response = attempt()
+                    outcome["congested"] = response.status_code in RETRY_STATUSES
+            except retry_on:
+                if last_attempt:
+                    raise
+                time.sleep(backoff_delay(attempt_number))
+                continue
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            response.close()
+            delay = retry_after_delay(response)
+            if delay is not None:
+                # the whole host is asked to wait, not only this request.
+                host.pausing(delay)
+            else:
+                time.sleep(backoff_delay(attempt_number))
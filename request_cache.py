@@ -0,0 +1,103 @@
+""" This script holds the in-process cache used to request and parse each page at most once per run.
+
+The cache is a bounded LRU: once it is full, the page used the longest time ago is forgotten. If two threads ask for
+the same page at the same time, only the first one requests it, the other one waits for its result.
+
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Number of pages kept in memory. A parsed listing page is heavy, we don't want to keep the whole website.
+DEFAULT_MAXSIZE = 32
+
+
+class CoalescingLRUCache:
+    """ A thread-safe LRU cache which coalesces the concurrent computations of the same key.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+
+        Args:
+            key: the key of the value, e.g. a page's URL.
+            compute: the function computing the value from the key when it isn't cached yet.
+
+        Returns: the cached value, or the value computed by compute(key).
+
+        """
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return self._results[key]
+            in_flight = self._in_flight.get(key)
+            is_owner = in_flight is None
+            if is_owner:
+                self.misses += 1
+                in_flight = Future()
+                self._in_flight[key] = in_flight
+            else:
+                self.hits += 1
+
+        # Another thread is already computing this key, we just wait for its result (or its exception).
+        if not is_owner:
+            return in_flight.result()
+
+        try:
+            value = compute(key)
+        except BaseException as error:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.set_exception(error)
+            raise
+
+        with self._lock:
+            self._results[key] = value
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+            del self._in_flight[key]
+        in_flight.set_result(value)
+        return value
+
+    def clear(self):
+        """ Forgets every cached value. The computations in flight are not affected.
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def coalescing_lru_cache(maxsize=DEFAULT_MAXSIZE):
+    """ Decorator caching the result of a one-argument function in a CoalescingLRUCache.
+
+    The decorated function gets a 'cache' attribute and a 'cache_clear' function, like with functools.lru_cache.
+    The cached values are shared between the callers, they must not be modified.
+
+    Args: maxsize: the number of results kept in memory.
+
+    """
+    def decorator(function):
+        cache = CoalescingLRUCache(maxsize)
+
+        @functools.wraps(function)
+        def wrapper(argument):
+            return cache.get_or_compute(argument, function)
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
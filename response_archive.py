@@ -0,0 +1,314 @@
+""" This script holds the response archive: the listing and product pages, as the website sent them, kept to be
+extracted again later without the network.
+
+When the extraction changes, the only way to regenerate the output used to be downloading the whole website again.
+With an archive, every page fetched (see http_client.enable_archive) is appended to a WARC file: one 'response'
+record per page, with its URL, date, status, headers and body. Each record is compressed as its own gzip member, the
+way .warc.gz files are, so a record is read without decompressing the others.
+
+The archive is append-only. A page fetched again gets a new record, and the latest one is used. Next to the archive,
+an index (the archive's name + '.idx') keeps the offset and length of each record. A record is written and flushed
+before its index line: after a crash, the bytes without an index line are cut off the archive when it is opened again.
+If the index is lost, it is rebuilt by reading the archive.
+
+The replay (see http_client.enable_replay) answers the pages from the archive instead of the website: the whole
+pipeline runs without the network, as fast as the parser allows.
+
+Only the HTML pages are archived: the images have their own store (see image_store.py).
+
+Ex:
+    python pipeline.py --archive crawl.warc.gz
+    python pipeline.py --replay crawl.warc.gz --output books.jsonl
+    python response_archive.py crawl.warc.gz
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import threading
+import uuid
+import zlib
+
+from http_cache import HEADERS_NOT_TO_STORE
+
+DEFAULT_ARCHIVE = "responses.warc.gz"
+INDEX_SUFFIX = ".idx"
+# The content types archived: the listing and product pages.
+ARCHIVED_TYPES = ("text/html",)
+# Compression level of the records: the pages are written once and read again many times.
+COMPRESSION_LEVEL = 6
+# Size of the pieces read when the index is rebuilt.
+CHUNK_SIZE = 1024 * 1024
+
+
+def encoding_record(url, status_code, reason, headers, body, date=None):
+    """
+
+    Args:
+        url: the URL of the page.
+        status_code, reason: the HTTP status of the response e.g. 200, 'OK'.
+        headers: the response's headers. The ones describing the body as sent on the network are left out: the body
+                 is stored decoded.
+        body: the response's body, as bytes.
+        date: the time of the response as a 'YYYY-MM-DDTHH:MM:SSZ' string, now if None.
+
+    Returns: the WARC 'response' record, compressed as a gzip member.
+
+    """
+    if date is None:
+        date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    http_head = "HTTP/1.1 {} {}\r\n".format(status_code, reason or "")
+    http_head += "".join(name + ": " + value + "\r\n" for name, value in headers.items()
+                         if name.lower() not in HEADERS_NOT_TO_STORE)
+    block = http_head.encode("iso-8859-1", errors="replace") + b"\r\n" + body
+    warc_head = ("WARC/1.0\r\n"
+                 "WARC-Type: response\r\n"
+                 "WARC-Record-ID: <urn:uuid:" + str(uuid.uuid4()) + ">\r\n"
+                 "WARC-Date: " + date + "\r\n"
+                 "WARC-Target-URI: " + url + "\r\n"
+                 "Content-Type: application/http; msgtype=response\r\n"
+                 "Content-Length: " + str(len(block)) + "\r\n\r\n")
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(warc_head.encode("utf-8") + block + b"\r\n\r\n") + compressor.flush()
+
+
+def parsing_head(head):
+    """
+
+    Args: head: the lines of a WARC or HTTP head, without the blank line ending it.
+
+    Returns: the first line, and a dictionary of the fields below it.
+
+    """
+    lines = head.split("\r\n")
+    fields = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        fields[name.strip()] = value.strip()
+    return lines[0], fields
+
+
+def decoding_record(record):
+    """
+
+    Args: record: a WARC 'response' record, compressed as a gzip member (see encoding_record).
+
+    Returns: a (WARC fields, status code, reason, headers, body) tuple.
+
+    """
+    data = zlib.decompress(record, 31)
+    warc_head, _, rest = data.partition(b"\r\n\r\n")
+    _, warc_fields = parsing_head(warc_head.decode("utf-8"))
+    block = rest[:int(warc_fields["Content-Length"])]
+    http_head, _, body = block.partition(b"\r\n\r\n")
+    status_line, headers = parsing_head(http_head.decode("iso-8859-1"))
+    _, status_code, reason = (status_line.split(" ", 2) + [""])[:3]
+    return warc_fields, int(status_code), reason, headers, body
+
+
+def scanning_records(path):
+    """ Reads the archive from the start, one gzip member at a time.
+
+    Args: path: the archive's file.
+
+    Yields: (offset, length, WARC fields) tuples, one per complete record. An incomplete record at the end is left out.
+
+    """
+    offset = 0
+    consumed = 0
+    decompressor = zlib.decompressobj(31)
+    pieces = []
+    with open(path, 'rb') as f:
+        data = f.read(CHUNK_SIZE)
+        while data:
+            pieces.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                consumed += len(data)
+                data = f.read(CHUNK_SIZE)
+                continue
+            # the record ends in this piece: what's left is the start of the next one.
+            length = consumed + len(data) - len(decompressor.unused_data)
+            warc_head = b"".join(pieces).partition(b"\r\n\r\n")[0]
+            yield offset, length, parsing_head(warc_head.decode("utf-8"))[1]
+            offset += length
+            data = decompressor.unused_data or f.read(CHUNK_SIZE)
+            consumed = 0
+            decompressor = zlib.decompressobj(31)
+            pieces = []
+
+
+class ResponseArchive:
+    """ The pages, appended to a WARC file and indexed by URL.
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE, read_only=False):
+        """
+
+        Args:
+            path: the archive's file. It's created if needed, unless read_only.
+            read_only: if True, the archive is only read (see replaying).
+
+        """
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.read_only = read_only
+        # how many records were appended by this process.
+        self.recorded = 0
+        self._lock = threading.Lock()
+        # URL -> (offset, length) of its latest record.
+        self._records = {}
+        end = self.reading_index()
+        if end is None:
+            # no index: it's rebuilt from the archive itself.
+            end = self.rebuilding_index(write=not read_only)
+        if read_only:
+            self._file = open(path, 'rb')
+            self._index_file = None
+            return
+        self._file = open(path, 'ab')
+        # the bytes appended after the last indexed record belong to no page: a crash left them.
+        self._file.truncate(end)
+        self._file.seek(end)
+        self._index_file = open(self.index_path, 'ab')
+        # so is the end of a line cut by a crash.
+        self._index_file.truncate(self._index_size)
+
+    def reading_index(self):
+        """ Loads the index.
+
+        Returns: the end of the last indexed record, or None if there's no index while the archive isn't empty.
+
+        """
+        self._index_size = 0
+        if not os.path.exists(self.index_path):
+            return None if os.path.exists(self.path) and os.path.getsize(self.path) > 0 else 0
+        end = 0
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    url, offset, length = json.loads(line.decode("utf-8"))[:3]
+                except ValueError:
+                    # the last line was cut by a crash: its record will be cut too.
+                    break
+                self._records[url] = (offset, length)
+                self._index_size += len(line)
+                end = max(end, offset + length)
+        return end
+
+    def rebuilding_index(self, write=True):
+        """ Reads the index again from the records of the archive.
+
+        Args: write: if True, the index file is written again too.
+
+        Returns: the end of the last complete record.
+
+        """
+        self._records.clear()
+        self._index_size = 0
+        end = 0
+        lines = []
+        for offset, length, warc_fields in scanning_records(self.path):
+            url = warc_fields.get("WARC-Target-URI")
+            if url is not None:
+                self._records[url] = (offset, length)
+                lines.append(json.dumps([url, offset, length, warc_fields.get("WARC-Date")]) + "\n")
+            end = offset + length
+        if write:
+            content = "".join(lines).encode("utf-8")
+            with open(self.index_path + ".part", 'wb') as f:
+                f.write(content)
+            os.replace(self.index_path + ".part", self.index_path)
+            self._index_size = len(content)
+        return end
+
+    def recording(self, url, response):
+        """ Appends the response to the archive, if it's a page.
+
+        Args:
+            url: the URL requested.
+            response: its requests.Response.
+
+        Returns: True if the response was archived.
+
+        """
+        content_type = response.headers.get("Content-Type", "")
+        if not content_type.startswith(ARCHIVED_TYPES):
+            return False
+        date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        # the compression is done outside the lock: the other threads keep appending meanwhile.
+        record = encoding_record(url, response.status_code, response.reason, response.headers, response.content,
+                                 date)
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(record)
+            self._file.flush()
+            self._index_file.write((json.dumps([url, offset, len(record), date]) + "\n").encode("utf-8"))
+            self._index_file.flush()
+            self._records[url] = (offset, len(record))
+            self.recorded += 1
+        return True
+
+    def has(self, url):
+        return url in self._records
+
+    def replaying(self, url):
+        """
+
+        Args: url: the URL of a page.
+
+        Returns: the (status code, reason, headers, body) of its latest record, or None if it isn't archived.
+
+        """
+        location = self._records.get(url)
+        if location is None:
+            return None
+        offset, length = location
+        with self._lock:
+            self._file.seek(offset)
+            record = self._file.read(length)
+        return decoding_record(record)[1:]
+
+    def urls(self):
+        """
+
+        Returns: the URLs archived, in the order they were first archived.
+
+        """
+        return list(self._records)
+
+    def counting(self):
+        """
+
+        Returns: a (number of pages, size of the archive in bytes) tuple.
+
+        """
+        with self._lock:
+            return len(self._records), os.path.getsize(self.path)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if self._index_file is not None:
+                self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Describes a response archive, or rebuilds its index.")
+    parser.add_argument("archive", help="the .warc.gz file written with pipeline.py --archive")
+    parser.add_argument("--rebuild-index", action="store_true", help="read the whole archive to write its index again")
+    arguments = parser.parse_args()
+
+    if arguments.rebuild_index and os.path.exists(arguments.archive + INDEX_SUFFIX):
+        os.remove(arguments.archive + INDEX_SUFFIX)
+    with ResponseArchive(arguments.archive, read_only=not arguments.rebuild_index) as response_archive:
+        print("pages: {}, bytes: {}".format(*response_archive.counting()))